@@ -0,0 +1,137 @@
+"""
+端到端发送基准：上传文件解析 -> 入库 -> 发送到 scheduler -> 回调
+
+scheduler 使用本地替身服务（taobaoutils.fake_scheduler），Flask 应用在本地端口上运行以接收回调，
+分别统计每个阶段的耗时和 rows/s。callback 阶段从开始发送计时，到所有回调处理完为止。
+需要在包含 config.toml 的目录下运行：
+
+    python benchmarks/bench_dispatch.py --rows 20000 --latency 0.02
+"""
+
+import argparse
+import csv
+import io
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from taobaoutils import config_data
+
+
+def make_csv(rows):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(["商品ID", "商品链接", "标题", "库存", "上架编码"])
+    for i in range(rows):
+        item_id = 600000000000 + i
+        writer.writerow([item_id, f"https://item.taobao.com/item.htm?id={item_id}", f"商品 {i}", i % 100, f"CODE{i}"])
+    return text.getvalue().encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake scheduler latency per request (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of scheduler requests failing")
+    parser.add_argument("--payload-format", choices=["tasks", "normalized"], default="tasks")
+    parser.add_argument("--encoding", choices=["identity", "gzip", "zstd"], default="identity")
+    parser.add_argument("--no-callbacks", action="store_true", help="skip the callback stage")
+    parser.add_argument("--callback-batch", type=int, default=0, help="use the bulk callback endpoint")
+    parser.add_argument("--buffered-callbacks", action="store_true", help="enable the callback write-behind buffer")
+    args = parser.parse_args()
+
+    from taobaoutils.fake_scheduler import FakeScheduler
+
+    fake = FakeScheduler(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        callbacks=not args.no_callbacks,
+        callback_batch=args.callback_batch,
+    ).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 模块在导入时读取这些配置，需要在导入应用之前设置
+        config_data.setdefault("app", {})["DATABASE_URI"] = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        scheduler_config = config_data.setdefault("scheduler", {})
+        scheduler_config.update(
+            SCHEDULER_SERVICE_URL=fake.url,
+            DISPATCH_MODE="inline",
+            PAYLOAD_FORMAT=args.payload_format,
+            CONTENT_ENCODING=args.encoding,
+            CALLBACK_BUFFERED=args.buffered_callbacks,
+        )
+
+        from werkzeug.serving import make_server
+
+        from taobaoutils.api.auth_cache import last_used_buffer
+        from taobaoutils.api.callback_buffer import callback_buffer
+        from taobaoutils.api.resources import _dispatch_job_listings, _insert_listing_chunks
+        from taobaoutils.app import create_app, db
+        from taobaoutils.ingest import read_listing_chunks
+        from taobaoutils.models import APIToken, ImportJob, ProductListing, RequestConfig, User
+
+        app = create_app(start_dispatcher=False)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        scheduler_config["CALLBACK_URL"] = f"http://127.0.0.1:{server.server_port}/api/scheduler/callback"
+
+        with app.app_context():
+            user = User(username="bench", email="bench@example.com", password="bench")
+            db.session.add(user)
+            db.session.commit()
+            rc = RequestConfig(
+                user_id=user.id,
+                name="bench",
+                body={"linkData": [{"url": "{product_link}", "num_iid": "{product_id}"}], "stock": "{stock}"},
+                header={"Content-Type": "application/json", "Cookie": "token=bench"},
+            )
+            _, token = APIToken.create_token(user.id, "bench")
+            db.session.add_all([rc, token])
+            db.session.commit()
+            job = ImportJob(user.id, rc.id, "bench.csv", api_token_id=token.id)
+            db.session.add(job)
+            db.session.commit()
+
+            data = make_csv(args.rows)
+            timings = {}
+
+            started = time.perf_counter()
+            chunks = list(read_listing_chunks(io.BytesIO(data), "bench.csv", args.chunk_size))
+            timings["parse"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            _insert_listing_chunks(iter(chunks), job, job.lease_id)
+            timings["insert"] = time.perf_counter() - started
+
+            dispatch_started = time.perf_counter()
+            _dispatch_job_listings(job)
+            timings["dispatch"] = time.perf_counter() - dispatch_started
+
+            if not args.no_callbacks:
+                if not fake.wait_for_callbacks(fake.stats["tasks"], timeout=600):
+                    print("warning: timed out waiting for callbacks")
+                callback_buffer.stop()  # 缓冲模式下等待剩余回调写回
+                timings["callback"] = time.perf_counter() - dispatch_started
+
+            for stage, elapsed in timings.items():
+                print(f"{stage:<10} {elapsed:8.2f}s  {args.rows / elapsed:10.0f} rows/s")
+            print(
+                f"dispatched {job.rows_dispatched}/{args.rows} rows, failed {job.rows_failed}, "
+                f"callbacks applied {ProductListing.query.filter_by(status='success').count()}"
+            )
+            print(
+                f"scheduler: {fake.stats['requests']} requests, {fake.stats['bytes'] / 1e6:.1f} MB, "
+                f"{fake.stats['errors']} injected errors, {fake.stats['callbacks_failed']} failed callbacks"
+            )
+            last_used_buffer.flush()
+
+        server.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Excel 导入基准：旧的 read_excel + df.iterrows + 逐行ORM插入 vs 上传接口 /api/product-listings/upload
+
+两者读取同一个生成的 .xlsx 工作簿，都包含表格解析时间。上传接口通过 Flask test client 调用，
+走完整的请求路径（认证、表头校验、流式分块读取、批量插入、发送）；发送到 scheduler 的 HTTP 请求被替换为
+直接返回成功，任务的序列化仍然计入。需要在包含 config.toml 的目录下运行：
+
+    python benchmarks/bench_excel_import.py --rows 50000
+"""
+
+import argparse
+import io
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+
+from taobaoutils import config_data
+
+
+def make_workbook(rows):
+    df = pd.DataFrame(
+        {
+            "商品ID": [str(600000000000 + i) for i in range(rows)],
+            "商品链接": [f"https://item.taobao.com/item.htm?id={600000000000 + i}" for i in range(rows)],
+            "标题": [f"商品 {i}" for i in range(rows)],
+            "库存": [i % 100 if i % 7 else None for i in range(rows)],
+            "上架编码": [f"CODE{i}" for i in range(rows)],
+        }
+    )
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def legacy_import(workbook, user_id, request_config_id, api_token_id):
+    """改造前 ExcelUploadResource 的写法"""
+    from taobaoutils.app import db
+    from taobaoutils.ingest import REQUIRED_HEADERS
+    from taobaoutils.models import ProductListing
+
+    df = pd.read_excel(io.BytesIO(workbook))
+    for _, row in df.iterrows():
+        listing_data = {
+            eng_key: row[chn_key] if not pd.isna(row[chn_key]) else None
+            for chn_key, eng_key in REQUIRED_HEADERS.items()
+        }
+        db.session.add(
+            ProductListing(
+                user_id=user_id,
+                request_config_id=request_config_id,
+                api_token_id=api_token_id,
+                send_time=datetime.utcnow(),
+                status="Uploaded",
+                **listing_data,
+            )
+        )
+    db.session.commit()
+
+
+def upload_import(client, workbook, headers, request_config_id, api_token_id):
+    with patch("taobaoutils.scheduler._post_batch_tasks", return_value=True):
+        response = client.post(
+            "/api/product-listings/upload",
+            data={
+                "file": (io.BytesIO(workbook), "bench.xlsx"),
+                "request_config_id": request_config_id,
+                "api_token_id": api_token_id,
+            },
+            content_type="multipart/form-data",
+            headers=headers,
+        )
+    assert response.status_code == 201, response.json
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 模块在导入时读取这些配置，需要在导入应用之前设置
+        config_data.setdefault("app", {})["DATABASE_URI"] = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        config_data.setdefault("upload", {})["CHUNK_SIZE"] = args.chunk_size
+
+        from taobaoutils.app import create_app, db, guard
+        from taobaoutils.models import APIToken, ProductListing, RequestConfig, User
+
+        app = create_app()
+        client = app.test_client()
+        with app.app_context():
+            user = User(username="bench", email="bench@example.com", password="bench")
+            db.session.add(user)
+            db.session.commit()
+            rc = RequestConfig(user_id=user.id, name="bench", body={}, header={})
+            _, token = APIToken.create_token(user.id, "bench")
+            db.session.add_all([rc, token])
+            db.session.commit()
+            ids = (user.id, rc.id, token.id)
+            headers = {"Authorization": f"Bearer {guard.encode_jwt_token(user)}"}
+
+            workbook = make_workbook(args.rows)
+            results = {}
+            for name, run in (
+                ("read_excel + iterrows + ORM", lambda: legacy_import(workbook, *ids)),
+                ("POST /upload", lambda: upload_import(client, workbook, headers, *ids[1:])),
+            ):
+                started = time.perf_counter()
+                run()
+                results[name] = time.perf_counter() - started
+                assert ProductListing.query.count() == args.rows
+                ProductListing.query.delete()
+                db.session.commit()
+                db.session.expunge_all()
+
+            baseline = results["read_excel + iterrows + ORM"]
+            for name, elapsed in results.items():
+                print(f"{name:<30} {elapsed:8.2f}s  {args.rows / elapsed:10.0f} rows/s  x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+response_content 存储基准：旧的内联 TEXT 列 vs 按内容寻址、压缩保存的 responses 表
+
+先用旧表结构生成一个带 N 行响应内容（带缩进的 JSON）的 SQLite 数据库，复制一份后执行启动时的
+数据库升级（迁移到 responses 表 + 删除旧列），两份都 VACUUM 后比较 product_listings 和 responses
+两张表的大小（升级还会创建旧库没有的索引，所以单独统计表本身）、文件大小，以及不走索引的全表扫描耗时。
+--distinct N 时响应内容只有 N 种（实际回调大多是相同的几种成功/失败内容），0 表示每行都不同。
+需要在包含 config.toml 的目录下运行：
+
+    python benchmarks/bench_response_storage.py --rows 1000000 --distinct 50
+"""
+
+import argparse
+import json
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+LEGACY_SCHEMA = """
+CREATE TABLE product_listings (
+    id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, request_config_id INTEGER NOT NULL, api_token_id INTEGER,
+    import_job_id INTEGER, status VARCHAR(50), send_time DATETIME, response_content TEXT, response_code INTEGER,
+    product_id VARCHAR(255), product_link TEXT, title VARCHAR(255), stock INTEGER, listing_code VARCHAR(255)
+)
+"""
+
+
+def make_response(i, rng):
+    """模拟 scheduler/淘宝接口的响应：多数是成功，少数是带错误详情的失败"""
+    item_id = 600000000000 + i
+    if rng.random() < 0.9:
+        body = {
+            "code": 800,
+            "msg": "success",
+            "data": {
+                "num_iid": str(item_id),
+                "title": f"商品 {i}",
+                "task_id": f"{rng.getrandbits(64):016x}",
+                "copied_at": 1700000000 + i,
+                "shop": {"sub_user": "12345678", "userids": ["87654321"]},
+            },
+        }
+    else:
+        body = {
+            "code": 500 + rng.randrange(10),
+            "msg": "商品复制失败，请检查商品链接是否有效或稍后重试",
+            "data": {"num_iid": str(item_id), "errors": [{"field": "linkData", "reason": "invalid url"}] * 3},
+        }
+    return json.dumps(body, indent=2, ensure_ascii=False)
+
+
+def build_legacy(path, rows, distinct=0, batch=10000):
+    rng = random.Random(0)
+    pool = [make_response(i, rng) for i in range(distinct)]
+    connection = sqlite3.connect(path)
+    connection.execute(LEGACY_SCHEMA)
+    for start in range(0, rows, batch):
+        connection.executemany(
+            "INSERT INTO product_listings (id, user_id, request_config_id, status, send_time, response_content,"
+            " response_code, product_id, product_link, title, stock, listing_code)"
+            " VALUES (?, 1, 1, ?, '2024-01-01 00:00:00', ?, 200, ?, ?, ?, ?, ?)",
+            [
+                (
+                    i + 1,
+                    "success" if i % 10 else "failed",
+                    pool[i % distinct] if distinct else make_response(i, rng),
+                    str(600000000000 + i),
+                    f"https://item.taobao.com/item.htm?id={600000000000 + i}",
+                    f"商品 {i}",
+                    i % 100,
+                    f"CODE{i}",
+                )
+                for i in range(start, min(start + batch, rows))
+            ],
+        )
+    connection.commit()
+    connection.close()
+
+
+def vacuum(path):
+    """VACUUM 后返回 (product_listings 和 responses 表占用的字节数, 文件大小)"""
+    connection = sqlite3.connect(path)
+    connection.execute("VACUUM")
+    table_size = connection.execute(
+        "SELECT sum(pgsize) FROM dbstat WHERE name IN ('product_listings', 'responses')"
+    ).fetchone()[0]
+    connection.close()
+    return table_size, path.stat().st_size
+
+
+def scan(path):
+    """不走索引的全表扫描，读取每一页"""
+    connection = sqlite3.connect(path)
+    started = time.perf_counter()
+    connection.execute("SELECT count(*) FROM product_listings WHERE listing_code LIKE '%9'").fetchone()
+    elapsed = time.perf_counter() - started
+    connection.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--distinct", type=int, default=0, help="number of distinct responses, 0 for all unique")
+    args = parser.parse_args()
+
+    from taobaoutils import models  # noqa: F401  注册所有表
+    from taobaoutils.app import db
+    from taobaoutils.storage import RESPONSE_COMPRESSION
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = Path(tmp) / "legacy.db"
+        upgraded = Path(tmp) / "upgraded.db"
+
+        started = time.perf_counter()
+        build_legacy(legacy, args.rows, args.distinct)
+        print(f"build      {time.perf_counter() - started:8.2f}s")
+        legacy_table, legacy_file = vacuum(legacy)
+        shutil.copy(legacy, upgraded)
+
+        engine = create_engine(f"sqlite:///{upgraded}")
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            db.metadata.create_all(connection)
+        migrate = time.perf_counter() - started
+        engine.dispose()
+        upgraded_table, upgraded_file = vacuum(upgraded)
+
+        print(f"migrate    {migrate:8.2f}s  {args.rows / migrate:10.0f} rows/s ({RESPONSE_COMPRESSION})")
+        connection = sqlite3.connect(upgraded)
+        print(f"responses  {connection.execute('SELECT count(*) FROM responses').fetchone()[0]:8d} stored")
+        connection.close()
+        for name, before, after in (("table", legacy_table, upgraded_table), ("file", legacy_file, upgraded_file)):
+            print(f"{name:<10} {before / 1e6:8.1f} MB -> {after / 1e6:8.1f} MB ({after / before:.0%})")
+        print(f"scan       {scan(legacy):8.3f}s -> {scan(upgraded):8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,70 @@
+import functools
+import hashlib
 import json
 
-from flask import g, jsonify, request
-from flask_praetorian import auth_required, current_user
+from flask import g, request
+from flask_praetorian.exceptions import InvalidUserError, MissingUserError
+from flask_praetorian.utilities import add_jwt_data_to_app_context, remove_jwt_data_from_app_context
 from flask_restful import Resource, reqparse
 
+from taobaoutils.api.auth_cache import api_token_cache, claims_cache, last_used_buffer
 from taobaoutils.app import db, guard
 from taobaoutils.models import APIToken, User
 
 
+def _load_jwt_claims():
+    """读取并校验请求中的JWT，命中缓存时跳过签名校验和用户加载；已停用的用户无论是否命中都拒绝"""
+    token = guard.read_token()
+    token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    entry = claims_cache.get(token_hash)
+    if entry is None:
+        claims = guard.extract_jwt_token(token)
+        generation = claims_cache.generation(claims["id"])
+        user = db.session.get(User, claims["id"])
+        MissingUserError.require_condition(user is not None, "Could not identify the current user from the current id")
+        entry = claims_cache.put(token_hash, claims, user, generation)
+    InvalidUserError.require_condition(entry.user.is_active, "The user has been deactivated")
+    return entry
+
+
+def auth_required(method):
+    """
+    JWT认证装饰器，替代 flask_praetorian.auth_required
+    已验证的claims和用户快照按token摘要短期缓存，并在当前请求内复用
+    """
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        entry = _load_jwt_claims()
+        add_jwt_data_to_app_context(entry.claims)
+        g.current_user_snapshot = entry.user
+        try:
+            return method(*args, **kwargs)
+        finally:
+            remove_jwt_data_from_app_context()
+            g.pop("current_user_snapshot", None)
+            g.pop("_current_user", None)
+
+    return wrapper
+
+
+def current_user_snapshot():
+    """返回当前JWT用户的只读快照，不访问数据库"""
+    return g.current_user_snapshot
+
+
+def current_user_id():
+    """返回当前JWT用户的ID，不访问数据库"""
+    return g.current_user_snapshot.id
+
+
+def current_user():
+    """返回当前JWT用户的ORM对象，同一请求内只加载一次"""
+    if "_current_user" not in g:
+        g._current_user = db.session.get(User, current_user_id())
+    return g._current_user
+
+
 def api_token_required(func):
     """
     API Token认证装饰器，用于验证外部服务的API请求
@@ -18,34 +75,30 @@ def api_token_required(func):
         # 获取Authorization header
         auth_header = request.headers.get("Authorization")
         if not auth_header:
-            return jsonify({"message": "Authorization header is required"}), 401
+            return {"message": "Authorization header is required"}, 401
 
         # 检查Bearer前缀
         if not auth_header.startswith("Bearer "):
-            return jsonify({"message": "Invalid authorization header format"}), 401
+            return {"message": "Invalid authorization header format"}, 401
 
         # 提取token
         token = auth_header.split("Bearer ")[1]
 
-        # 查找并验证token
-        # 由于我们只存储了哈希值，所以需要遍历所有token进行验证
-        all_tokens = APIToken.query.filter_by(is_active=True).all()
-        valid_token = None
-
-        for api_token in all_tokens:
-            if api_token.verify_token(token):
-                valid_token = api_token
-                break
+        # 先查进程内缓存，未命中时通过token摘要的唯一索引查找，再做常量时间比较
+        token_hash = APIToken.hash_token(token)
+        cached_token = api_token_cache.get(token_hash)
+        if cached_token is None:
+            valid_token = APIToken.find_by_token(token)
+            if not valid_token:
+                return {"message": "Invalid or expired API token"}, 401
+            cached_token = api_token_cache.put(token_hash, valid_token)
 
-        if not valid_token:
-            return jsonify({"message": "Invalid or expired API token"}), 401
+        # 记录最后使用时间（写后缓冲，定期批量落库）
+        last_used_buffer.record(cached_token.id)
 
-        # 更新最后使用时间
-        valid_token.update_last_used()
-
-        # 将token和用户信息存储在请求上下文中
-        g.api_token = valid_token
-        g.user = valid_token.user
+        # 将token快照和用户ID存储在请求上下文中
+        g.api_token = cached_token
+        g.user_id = cached_token.user_id
 
         return func(*args, **kwargs)
 
@@ -194,23 +247,23 @@ class APITokenResource(Resource):
         Args:
             token_id: 可选的token ID，如果提供则获取特定token
         """
-        user = current_user()
+        user_id = current_user_id()
 
         if token_id:
             # 获取特定token
-            token = APIToken.query.filter_by(id=token_id, user_id=user.id).first()
+            token = APIToken.query.filter_by(id=token_id, user_id=user_id).first()
             if not token:
                 return {"message": "Token not found"}, 404
             return {"token": token.to_dict()}, 200
         else:
             # 获取所有token
-            tokens = APIToken.query.filter_by(user_id=user.id).all()
+            tokens = APIToken.query.filter_by(user_id=user_id).all()
             return {"tokens": [token.to_dict() for token in tokens]}, 200
 
     @auth_required
     def post(self):
         """创建新的API token"""
-        user = current_user()
+        user_id = current_user_id()
         parser = reqparse.RequestParser()
         parser.add_argument("name", type=str, required=True, help="Token name is required")
         parser.add_argument("scopes", type=list, location="json", default=["read", "write"])
@@ -220,7 +273,7 @@ class APITokenResource(Resource):
         # 生成token
         # 生成token
         token_value, token = APIToken.create_token(
-            user_id=user.id, name=args["name"], scopes=args["scopes"], expires_days=args["expires_days"]
+            user_id=user_id, name=args["name"], scopes=args["scopes"], expires_days=args["expires_days"]
         )
 
         # 保存到数据库
@@ -248,8 +301,8 @@ class APITokenResource(Resource):
         - 可以启用/禁用token
         - 可以更新名称
         """
-        user = current_user()
-        token = APIToken.query.filter_by(id=token_id, user_id=user.id).first()
+        user_id = current_user_id()
+        token = APIToken.query.filter_by(id=token_id, user_id=user_id).first()
 
         if not token:
             return {"message": "Token not found"}, 404
@@ -271,17 +324,20 @@ class APITokenResource(Resource):
             token.scopes = json.dumps(args["scopes"])
 
         db.session.commit()
+        api_token_cache.invalidate(token.token_hash)
         return {"token": token.to_dict()}, 200
 
     @auth_required
     def delete(self, token_id):
         """删除API token"""
-        user = current_user()
-        token = APIToken.query.filter_by(id=token_id, user_id=user.id).first()
+        user_id = current_user_id()
+        token = APIToken.query.filter_by(id=token_id, user_id=user_id).first()
 
         if not token:
             return {"message": "Token not found"}, 404
 
+        token_hash = token.token_hash
         db.session.delete(token)
         db.session.commit()
+        api_token_cache.invalidate(token_hash)
         return {"message": "Token deleted successfully"}, 200
@@ -0,0 +1,301 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from datetime import UTC, datetime
+from typing import NamedTuple
+
+from flask import current_app
+from sqlalchemy import bindparam, event
+from sqlalchemy.orm import Session, attributes
+
+from taobaoutils import config_data, logger
+from taobaoutils.app import db
+from taobaoutils.models import APIToken, User
+
+
+class CachedAPIToken(NamedTuple):
+    """已验证API Token的轻量快照，缓存命中时代替ORM对象使用"""
+
+    id: int
+    user_id: int
+    scopes: frozenset
+    expires_at: datetime | None  # token本身的过期时间（UTC）
+    cached_until: float  # 缓存条目的失效时间（time.monotonic）
+
+    def is_expired(self):
+        if time.monotonic() >= self.cached_until:
+            return True
+        return self.expires_at is not None and datetime.now(UTC) > self.expires_at
+
+
+class APITokenCache:
+    """
+    进程内的API Token验证结果缓存（LRU + TTL）
+
+    以token的SHA-256摘要为键，命中时无需访问数据库即可完成认证。
+    token被更新、删除时必须调用 invalidate 立即驱逐对应条目。
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token_hash):
+        """返回未过期的缓存条目，不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            if entry.is_expired():
+                del self._entries[token_hash]
+                return None
+            self._entries.move_to_end(token_hash)
+            return entry
+
+    def put(self, token_hash, api_token):
+        """缓存一个已通过验证的APIToken，返回缓存条目"""
+        expires_at = api_token.expires_at.replace(tzinfo=UTC) if api_token.expires_at else None
+        entry = CachedAPIToken(
+            id=api_token.id,
+            user_id=api_token.user_id,
+            scopes=frozenset(api_token.get_scopes()),
+            expires_at=expires_at,
+            cached_until=time.monotonic() + self.ttl,
+        )
+        if self.maxsize <= 0:
+            return entry
+        with self._lock:
+            self._entries[token_hash] = entry
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, token_hash):
+        """立即驱逐指定token的缓存条目"""
+        with self._lock:
+            self._entries.pop(token_hash, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UserSnapshot(NamedTuple):
+    """JWT认证用户的轻量快照，只读字段，不需要访问数据库；auth_required 每个请求都检查 is_active"""
+
+    id: int
+    is_active: bool
+
+
+class CachedClaims(NamedTuple):
+    """已验证JWT的claims和对应用户快照"""
+
+    claims: dict
+    user: UserSnapshot
+    cached_until: float  # time.monotonic
+
+    def is_expired(self):
+        return time.monotonic() >= self.cached_until
+
+
+class ClaimsCache:
+    """
+    JWT claims 缓存（LRU + 短TTL）
+
+    以access token的摘要为键，保存签名校验后的claims和用户快照，避免每个请求都重复
+    校验签名并加载User。条目的有效期不超过token自身的exp；用户的密码或 is_active
+    的修改提交后通过 invalidate_user 驱逐该用户的所有条目。
+
+    invalidate_user 同时递增该用户的代数：加载User前先取 generation，put 时代数已变化
+    （加载期间有修改提交）则不缓存，避免把提交前读到的旧数据重新放回缓存。
+    """
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._user_tokens = {}  # user_id -> {token_hash}
+        self._generations = {}  # user_id -> 失效次数
+        self._lock = threading.Lock()
+
+    def get(self, token_hash):
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            if entry.is_expired():
+                self._remove(token_hash)
+                return None
+            self._entries.move_to_end(token_hash)
+            return entry
+
+    def generation(self, user_id):
+        """用户当前的代数，在从数据库加载User之前读取，传给 put"""
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def put(self, token_hash, claims, user, generation=None):
+        """
+        缓存claims和用户快照，返回缓存条目
+
+        Args:
+            generation: 加载User之前读取的代数，与当前代数不同时只返回条目而不缓存
+        """
+        snapshot = UserSnapshot(id=user.id, is_active=bool(user.is_active))
+        ttl = self.ttl
+        if claims.get("exp"):
+            ttl = min(ttl, claims["exp"] - time.time())
+        entry = CachedClaims(claims=claims, user=snapshot, cached_until=time.monotonic() + ttl)
+        if self.maxsize <= 0 or ttl <= 0:
+            return entry
+        with self._lock:
+            if generation is not None and generation != self._generations.get(snapshot.id, 0):
+                return entry
+            self._entries[token_hash] = entry
+            self._entries.move_to_end(token_hash)
+            self._user_tokens.setdefault(snapshot.id, set()).add(token_hash)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def invalidate_user(self, user_id):
+        """驱逐指定用户的所有缓存条目"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for token_hash in self._user_tokens.pop(user_id, set()):
+                self._entries.pop(token_hash, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_tokens.clear()
+
+    def _remove(self, token_hash):
+        entry = self._entries.pop(token_hash, None)
+        if entry is not None:
+            hashes = self._user_tokens.get(entry.user.id)
+            if hashes is not None:
+                hashes.discard(token_hash)
+                if not hashes:
+                    del self._user_tokens[entry.user.id]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LastUsedBuffer:
+    """
+    APIToken.last_used_at 的写后缓冲
+
+    认证时只在内存中记录每个token最近一次的使用时间，累计到 flush_size 个token
+    或距第一次记录超过 flush_interval 秒时，用一条批量UPDATE写回数据库；进程退出时也会写回。
+    last_used_at 因此是最终一致的，延迟不超过 flush_interval 秒。
+    """
+
+    def __init__(self, flush_interval=5, flush_size=500):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._app = None
+
+    def record(self, token_id, used_at=None):
+        """记录一次token使用，需要在应用上下文中调用"""
+        with self._lock:
+            self._pending[token_id] = used_at or datetime.now(UTC)
+            self._app = current_app._get_current_object()
+            should_flush = len(self._pending) >= self.flush_size
+            if not should_flush and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush_in_app_context)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """将缓冲的使用时间批量写回数据库，返回写回的token数量"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not pending:
+            return 0
+
+        table = APIToken.__table__
+        statement = table.update().where(table.c.id == bindparam("token_id")).values(last_used_at=bindparam("used_at"))
+        # 使用独立的连接和事务，不影响当前请求的session
+        with db.engine.begin() as connection:
+            connection.execute(
+                statement, [{"token_id": token_id, "used_at": used_at} for token_id, used_at in pending.items()]
+            )
+        return len(pending)
+
+    def flush_in_app_context(self):
+        """在最近一次记录时的应用上下文中写回，供定时器和进程退出时调用"""
+        app = self._app
+        if app is None:
+            return
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception as e:
+            logger.error("Failed to flush API token last_used_at updates: %s", e)
+
+
+_auth_config = config_data.get("auth", {})
+
+api_token_cache = APITokenCache(
+    maxsize=_auth_config.get("API_TOKEN_CACHE_SIZE", 1024),
+    ttl=_auth_config.get("API_TOKEN_CACHE_TTL", 60),
+)
+
+claims_cache = ClaimsCache(
+    maxsize=_auth_config.get("JWT_CLAIMS_CACHE_SIZE", 1024),
+    ttl=_auth_config.get("JWT_CLAIMS_CACHE_TTL", 30),
+)
+
+last_used_buffer = LastUsedBuffer(
+    flush_interval=_auth_config.get("LAST_USED_FLUSH_INTERVAL", 5),
+    flush_size=_auth_config.get("LAST_USED_FLUSH_SIZE", 500),
+)
+# 进程退出前写回尚未落库的使用时间
+atexit.register(last_used_buffer.flush_in_app_context)
+
+
+# 修改后需要让缓存的claims失效的User属性
+_CLAIMS_ATTRIBUTES = ("password_hash", "is_active")
+_CHANGED_USERS = "taobaoutils_changed_user_ids"
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_users(session, flush_context, instances):
+    """flush前记下密码或启用状态被修改、以及被删除的用户，提交后再让他们的claims失效"""
+    changed = session.info.setdefault(_CHANGED_USERS, set())
+    for user in session.dirty:
+        if isinstance(user, User) and user.id is not None:
+            if any(attributes.get_history(user, name).has_changes() for name in _CLAIMS_ATTRIBUTES):
+                changed.add(user.id)
+    changed.update(user.id for user in session.deleted if isinstance(user, User))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    # 提交后才驱逐：提交前驱逐的话，并发请求可能读到旧数据并重新缓存整个TTL
+    for user_id in session.info.pop(_CHANGED_USERS, ()):
+        claims_cache.invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop(_CHANGED_USERS, None)
@@ -0,0 +1,174 @@
+import atexit
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import Integer, bindparam, func
+
+from taobaoutils import config_data, logger
+from taobaoutils.app import db
+from taobaoutils.models import ProductListing, ResponseBody
+
+
+def callback_update_statement():
+    """
+    按回调更新listing的批量UPDATE，参数为 listing_id、new_status、new_response_code、new_response_id；
+    response_code/response_id 为空时保持原值
+    """
+    table = ProductListing.__table__
+    return (
+        table.update()
+        .where(table.c.id == bindparam("listing_id"))
+        .values(
+            status=bindparam("new_status"),
+            response_code=func.coalesce(bindparam("new_response_code", type_=Integer), table.c.response_code),
+            response_id=func.coalesce(bindparam("new_response_id", type_=Integer), table.c.response_id),
+        )
+    )
+
+
+def apply_callbacks(connection, callbacks):
+    """
+    在 connection 的事务中应用一批回调（listing_id、new_status、new_response_code、new_response_content），
+    响应内容先写入 responses 表（相同内容只保存一次），再用一条 executemany UPDATE 更新listing
+
+    Returns:
+        int: 匹配到的listing数量（驱动不支持时为 -1）
+    """
+    texts = {values["new_response_content"] for values in callbacks if values["new_response_content"] is not None}
+    response_ids = ResponseBody.intern(texts, connection) if texts else {}
+    params = [
+        {
+            "listing_id": values["listing_id"],
+            "new_status": values["new_status"],
+            "new_response_code": values["new_response_code"],
+            "new_response_id": response_ids.get(values["new_response_content"]),
+        }
+        for values in callbacks
+    ]
+    return connection.execute(callback_update_statement(), params).rowcount
+
+
+class CallbackBuffer:
+    """
+    scheduler 回调的写后缓冲
+
+    回调接口只把更新放进有界的内存队列就返回 202，后台线程在第一条回调到达后 flush_interval 秒、
+    或队列累计到 flush_size 条时，用 apply_callbacks 在一个事务中批量写回，SQLite 上只有这一个写者。
+    队列满时 submit 返回 False，由调用方按原来的方式同步写入，保证已确认的回调不会因为缓冲而丢弃；
+    写回失败的回调放回队列稍后重试；进程退出时 stop 会写回剩余的回调。
+
+    Args:
+        max_size: 队列容量
+        flush_interval: 第一条回调到达后最多等待多少秒写回
+        flush_size: 累计多少条立即写回，也是每个事务的最大条数
+        retry_interval: 写回失败后的重试间隔（秒）
+    """
+
+    def __init__(self, max_size=10000, flush_interval=0.005, flush_size=1000, retry_interval=1):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.retry_interval = retry_interval
+        self.stats = {"accepted": 0, "flushed": 0, "rejected": 0, "errors": 0}
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._app = None
+
+    def submit(self, values):
+        """
+        放入一条回调更新（apply_callbacks 的参数），需要在应用上下文中调用
+
+        Returns:
+            bool: 是否已放入队列，False 表示队列已满
+        """
+        with self._condition:
+            if self._stopping or len(self._pending) >= self.max_size:
+                self.stats["rejected"] += 1
+                return False
+            self._pending.append(values)
+            self.stats["accepted"] += 1
+            if self._thread is None:
+                self._app = current_app._get_current_object()
+                self._thread = threading.Thread(target=self._run, name="tb-callback-flush", daemon=True)
+                self._thread.start()
+            if len(self._pending) == 1 or len(self._pending) >= self.flush_size:
+                self._condition.notify()
+        return True
+
+    def flush(self):
+        """把队列中的回调全部写回数据库，返回写回的条数；需要在应用上下文中调用"""
+        flushed = 0
+        while True:
+            with self._condition:
+                batch = self._pending[: self.flush_size]
+                del self._pending[: self.flush_size]
+            if not batch:
+                return flushed
+            try:
+                # 使用独立的连接和事务，不影响当前请求的session
+                with db.engine.begin() as connection:
+                    matched = apply_callbacks(connection, batch)
+            except Exception:
+                with self._condition:
+                    self._pending[:0] = batch
+                    self.stats["errors"] += 1
+                raise
+            missing = len(batch) - matched
+            if 0 < missing <= len(batch):
+                logger.warning("%d of %d buffered callbacks matched no listing.", missing, len(batch))
+            with self._condition:
+                self.stats["flushed"] += len(batch)
+            flushed += len(batch)
+
+    def _run(self):
+        with self._app.app_context():
+            while True:
+                with self._condition:
+                    while not self._pending and not self._stopping:
+                        self._condition.wait()
+                    if not self._stopping and len(self._pending) < self.flush_size:
+                        # 等待更多回调到达，凑成一批再写回
+                        self._condition.wait(self.flush_interval)
+                    stopping = self._stopping
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error("Failed to flush buffered scheduler callbacks: %s", e)
+                    if stopping:
+                        break
+                    time.sleep(self.retry_interval)
+                    continue
+                finally:
+                    db.session.remove()
+                if stopping:
+                    break
+
+    def status(self):
+        with self._condition:
+            return {"pending": len(self._pending), **self.stats}
+
+    def stop(self, timeout=10):
+        """不再接收新的回调，写回队列中剩余的回调并等待后台线程结束"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        with self._condition:
+            if self._pending:
+                logger.error("%d buffered scheduler callbacks were not written back.", len(self._pending))
+
+
+_scheduler_config = config_data.get("scheduler", {})
+
+callback_buffer = CallbackBuffer(
+    max_size=_scheduler_config.get("CALLBACK_BUFFER_SIZE", 10000),
+    flush_interval=_scheduler_config.get("CALLBACK_FLUSH_INTERVAL", 0.005),
+    flush_size=_scheduler_config.get("CALLBACK_FLUSH_SIZE", 1000),
+)
+# 进程退出前写回尚未落库的回调
+atexit.register(callback_buffer.stop)
@@ -1,8 +1,8 @@
 import json
 
-from flask_praetorian import auth_required, current_user
 from flask_restful import Resource, reqparse
 
+from taobaoutils.api.auth import auth_required, current_user_id
 from taobaoutils.app import db
 from taobaoutils.models import RequestConfig
 
@@ -23,14 +23,14 @@ class RequestConfigListResource(Resource):
 
     @auth_required
     def get(self):
-        user_id = current_user().id
+        user_id = current_user_id()
         configs = RequestConfig.query.filter_by(user_id=user_id).all()
         return [config.to_dict() for config in configs]
 
     @auth_required
     def post(self):
         args = self.parser.parse_args()
-        user_id = current_user().id
+        user_id = current_user_id()
 
         method = args.get("method", "POST").upper()
         if method not in VALID_METHODS:
@@ -68,14 +68,14 @@ class RequestConfigResource(Resource):
 
     @auth_required
     def get(self, config_id):
-        user_id = current_user().id
+        user_id = current_user_id()
         config = RequestConfig.query.filter_by(id=config_id, user_id=user_id).first_or_404()
         return config.to_dict()
 
     @auth_required
     def put(self, config_id):
         args = self.parser.parse_args()
-        user_id = current_user().id
+        user_id = current_user_id()
         config = RequestConfig.query.filter_by(id=config_id, user_id=user_id).first_or_404()
 
         if args["name"]:
@@ -104,7 +104,7 @@ class RequestConfigResource(Resource):
 
     @auth_required
     def delete(self, config_id):
-        user_id = current_user().id
+        user_id = current_user_id()
         config = RequestConfig.query.filter_by(id=config_id, user_id=user_id).first_or_404()
 
         db.session.delete(config)
@@ -1,16 +1,75 @@
+import base64
+import hashlib
 import json
-from datetime import datetime
+import os
+import shutil
+import tempfile
+from contextlib import closing
+from datetime import UTC, datetime, timedelta
 
-import pandas as pd
 import requests
-from flask_praetorian import auth_required, current_user
-from flask_restful import Resource, reqparse
+from flask import current_app, request
+from flask_restful import Resource, inputs, reqparse
+from sqlalchemy import func, insert, select, tuple_
+from sqlalchemy.orm import joinedload, load_only
 from werkzeug.datastructures import FileStorage
 
 from taobaoutils import config_data, logger
-from taobaoutils.api.auth import api_token_required
+from taobaoutils.api.auth import api_token_required, auth_required, current_user_id
+from taobaoutils.api.callback_buffer import apply_callbacks, callback_buffer
 from taobaoutils.app import db
-from taobaoutils.models import APIToken, ProductListing, RequestConfig
+from taobaoutils.ingest import (
+    CHUNK_SIZE,
+    MissingHeadersError,
+    UnsupportedFormatError,
+    check_headers,
+    is_supported_filename,
+    read_listing_chunks,
+)
+from taobaoutils.models import (
+    APIToken,
+    ImportJob,
+    ImportJobLeaseLostError,
+    OutboxEntry,
+    ProductListing,
+    RequestConfig,
+)
+from taobaoutils.scheduler import scheduler_client, send_batch_tasks
+from taobaoutils.workers import BoundedExecutor, QueueFullError
+
+import_executor = BoundedExecutor(
+    max_workers=config_data.get("upload", {}).get("IMPORT_WORKERS", 2),
+    max_pending=config_data.get("upload", {}).get("IMPORT_QUEUE_SIZE", 8),
+    thread_name_prefix="tb-import",
+)
+
+# 单条任务接口的读取超时（秒），批量接口使用 scheduler_client 的 READ_TIMEOUT
+SINGLE_TASK_TIMEOUT = config_data.get("scheduler", {}).get("SINGLE_TASK_TIMEOUT", 10)
+
+# inline: 在请求/导入任务中直接发送；outbox: 只写入发件箱，由 OutboxDispatcher 在后台发送
+DISPATCH_MODE = config_data.get("scheduler", {}).get("DISPATCH_MODE", "inline")
+# inline 模式下发送失败（包括熔断器打开时被拒绝）的listing写入发件箱，由调度器稍后重试
+FALLBACK_TO_OUTBOX = config_data.get("scheduler", {}).get("FALLBACK_TO_OUTBOX", False)
+
+# 批量回调接口每次请求最多包含的回调数
+CALLBACK_BATCH_LIMIT = config_data.get("scheduler", {}).get("CALLBACK_BATCH_LIMIT", 1000)
+# 单条回调接口只把更新放进内存队列并返回 202，由后台线程批量写回（队列满时仍同步写入）
+CALLBACK_BUFFERED = config_data.get("scheduler", {}).get("CALLBACK_BUFFERED", False)
+
+# 商品列表每页默认条数和上限（?limit= 超过上限时按上限返回）
+LISTING_PAGE_SIZE = config_data.get("app", {}).get("LISTING_PAGE_SIZE", 100)
+LISTING_MAX_PAGE_SIZE = config_data.get("app", {}).get("LISTING_MAX_PAGE_SIZE", 1000)
+
+# queued/running 的导入任务超过该秒数没有心跳（执行者每提交一块更新一次）时视为执行者已退出，
+# 重新上传同一文件会接管任务并从检查点续传
+IMPORT_STALE_SECONDS = config_data.get("upload", {}).get("STALE_JOB_SECONDS", 300)
+
+# 上传去重可选的字段，"none" 表示不去重
+DEDUPE_CHOICES = ("none", "product_id", "product_link")
+DEFAULT_DEDUPE = config_data.get("upload", {}).get("DEDUPE", "none")
+# reqparse 不按 choices 校验默认值，配置错误在启动时报出，而不是在导入过程中失败
+if DEFAULT_DEDUPE not in DEDUPE_CHOICES:
+    raise ValueError(f"Unsupported upload dedupe: {DEFAULT_DEDUPE}. Supported: {DEDUPE_CHOICES}")
 
 
 def _get_payload_from_listing(product_listing):
@@ -79,7 +138,7 @@ def _send_single_task_to_scheduler(product_listing):
     }
 
     try:
-        response = requests.post(task_url, json=task_data, timeout=10)
+        response = scheduler_client.post(task_url, json=task_data, read_timeout=SINGLE_TASK_TIMEOUT)
         response.raise_for_status()
         logger.info("Successfully sent single task to scheduler for listing ID: %s", product_listing.id)
         return True
@@ -88,67 +147,302 @@ def _send_single_task_to_scheduler(product_listing):
         return False
 
 
-def _send_batch_tasks_to_scheduler(product_listings):
+def _drop_duplicate_records(records, job):
     """
-    Sends a batch of product listing tasks to the scheduler service.
+    按任务的去重字段过滤一块记录：块内重复只保留第一行，已存在于数据库中的（同一用户、同一配置）
+    通过一条 IN 查询找出并跳过。去重字段为空的行无法判断，照常插入。
     """
-    scheduler_url = config_data["scheduler"]["SCHEDULER_SERVICE_URL"]
-    callback_url = config_data.get("scheduler", {}).get("CALLBACK_URL")
+    key = job.dedupe_key
+    values = {record[key] for record in records if record[key] is not None}
+    if not values:
+        return records
+
+    column = getattr(ProductListing, key)
+    existing = set(
+        db.session.execute(
+            select(column).where(
+                ProductListing.user_id == job.user_id,
+                ProductListing.request_config_id == job.request_config_id,
+                column.in_(values),
+            )
+        ).scalars()
+    )
+    unique = []
+    for record in records:
+        value = record[key]
+        if value is not None:
+            if value in existing:
+                continue
+            existing.add(value)
+        unique.append(record)
+    return unique
+
+
+def _insert_listing_chunks(chunks, job, lease_id):
+    """
+    按块批量插入上传的行，每块与任务的检查点（已提交的行数）在同一事务中提交，提交前确认仍持有租约。
+    每块通过一条 executemany INSERT ... RETURNING 写入，不创建ORM对象。返回本次插入的行数。
+    outbox 模式下新listing的发件箱条目也在同一事务中写入。
+    """
+    dialect = db.session.get_bind().dialect
+    inserted = 0
+    for chunk in chunks:
+        records = _drop_duplicate_records(chunk, job) if job.dedupe_key else chunk
+        send_time = datetime.utcnow()  # Default send_time
+        for record in records:
+            record.update(
+                user_id=job.user_id,
+                request_config_id=job.request_config_id,
+                api_token_id=job.api_token_id,
+                import_job_id=job.id,
+                send_time=send_time,
+                status="Uploaded",  # Default status for uploaded items
+            )
 
-    task_url = scheduler_url.rstrip("/") + "/add_req_tasks"
+        if records and dialect.insert_executemany_returning:
+            # 只需要新ID的集合，不要求与参数顺序对应，因此可以使用批量的 INSERT ... RETURNING
+            table = ProductListing.__table__
+            statement = insert(table).returning(table.c.id)
+            listing_ids = db.session.connection().execute(statement, records).scalars().all()
+        elif records:
+            # 数据库不支持 executemany RETURNING 时退回ORM插入
+            listings = [ProductListing(**record) for record in records]
+            db.session.add_all(listings)
+            db.session.flush()
+            listing_ids = [listing.id for listing in listings]
+            for listing in listings:
+                db.session.expunge(listing)
+        else:
+            listing_ids = []
 
-    tasks_data = []
+        if DISPATCH_MODE == "outbox":
+            OutboxEntry.enqueue(listing_ids)
 
-    for listing in product_listings:
-        if not listing.request_config:
-            logger.warning("ProductListing %s missing request_config, skipping.", listing.id)
-            continue
+        job.rows_parsed += len(chunk)
+        job.rows_inserted += len(records)
+        job.rows_skipped += len(chunk) - len(records)
+        job.checkpoint_row += len(chunk)
+        job.renew_lease(lease_id)
+        db.session.commit()  # 提交本块及检查点，写事务保持短小
+        inserted += len(records)
+    return inserted
 
-        req_config = listing.request_config
 
-        # Parse header
-        header = None
+def _dispatch_job_listings(job, lease_id=None):
+    """
+    按ID顺序分页加载任务中尚未发送的listing并发送到scheduler，发送成功的块将状态更新为 '是否完成'。
+    失败块的listing保持 'Uploaded'，续传或重试时只补发这些listing。返回发送成功的listing数量。
+    导入过程中调用时传入租约，每页提交时更新心跳。
+    """
+    dispatched = 0
+    job.rows_failed = 0
+    last_id = 0
+    while True:
+        # 请求配置和token随listing在同一条查询中加载，生成任务时不再逐条懒加载
+        listings = (
+            ProductListing.query.options(
+                joinedload(ProductListing.request_config), joinedload(ProductListing.api_token)
+            )
+            .filter(
+                ProductListing.import_job_id == job.id,
+                ProductListing.status == "Uploaded",
+                ProductListing.id > last_id,
+            )
+            .order_by(ProductListing.id)
+            .limit(CHUNK_SIZE)
+            .all()
+        )
+        if not listings:
+            break
+        last_id = listings[-1].id
+        result = send_batch_tasks(listings)
+        if result.sent_ids:
+            # 只更新仍为 'Uploaded' 的listing：scheduler 的回调可能先于这里到达，不能覆盖回调写入的状态
+            ProductListing.query.filter(
+                ProductListing.id.in_(result.sent_ids), ProductListing.status == "Uploaded"
+            ).update({"status": "是否完成"}, synchronize_session=False)
+            dispatched += len(result.sent_ids)
+            job.rows_dispatched += len(result.sent_ids)
+        job.rows_failed += len(result.failed_ids)
+        if FALLBACK_TO_OUTBOX:
+            OutboxEntry.enqueue(result.failed_ids)
+        # 提交前移出本页的listing，提交时不再逐个过期，之后也不会被逐条刷新
+        for listing in listings:
+            db.session.expunge(listing)
+        if lease_id:
+            job.renew_lease(lease_id)
+        db.session.commit()  # Commit status updates and job progress
+    return dispatched
+
+
+def _enqueue_job_listings(job):
+    """outbox 模式下重试：把任务中尚未发送的listing重新加入发件箱（包括已标记为 dead 的），返回加入的数量"""
+    queued = 0
+    last_id = 0
+    while True:
+        listing_ids = (
+            db.session.execute(
+                select(ProductListing.id)
+                .where(
+                    ProductListing.import_job_id == job.id,
+                    ProductListing.status == "Uploaded",
+                    ProductListing.id > last_id,
+                )
+                .order_by(ProductListing.id)
+                .limit(CHUNK_SIZE)
+            )
+            .scalars()
+            .all()
+        )
+        if not listing_ids:
+            break
+        last_id = listing_ids[-1]
+        queued += OutboxEntry.enqueue(listing_ids)
+    job.rows_failed = 0
+    job.status = "queued_for_dispatch"
+    job.finished_at = None
+    db.session.flush()
+    ImportJob.complete_dispatched([job.id])
+    db.session.commit()
+    return queued
+
+
+def _run_listing_import(job, chunks, lease_id):
+    """
+    执行一次导入：分块插入并提交，再分块发送到scheduler（outbox 模式下由调度器在后台发送），
+    进度和检查点记录在ImportJob上，每次提交都确认仍持有租约并更新心跳。
+    出错时只回滚当前块，任务标记为失败后重新抛出异常；再次上传同一文件会从检查点继续。
+    执行者没有机会标记失败（进程崩溃、被杀死）时，任务在心跳超过 IMPORT_STALE_SECONDS 后同样可以续传；
+    任务被接管后这里的下一次提交会失败并回滚，不会与接管者重复插入。
+    """
+    try:
+        job.status = "running"
+        job.error = None
+        job.started_at = datetime.utcnow()
+        job.renew_lease(lease_id)
+        db.session.commit()
+
+        inserted = _insert_listing_chunks(chunks, job, lease_id)
+
+        if DISPATCH_MODE == "outbox":
+            logger.info("Queued %d product listings of import job %s for dispatch.", inserted, job.id)
+        else:
+            # After committing, send the new listings to the scheduler service chunk by chunk
+            dispatched = _dispatch_job_listings(job, lease_id)
+            if job.rows_failed == 0:
+                logger.info(
+                    "Batch of %d product listings status updated to '是否完成' after sending to scheduler.", dispatched
+                )
+            else:
+                logger.warning(
+                    "%d product listings of import job %s failed to send to scheduler service.", job.rows_failed, job.id
+                )
+
+        if DISPATCH_MODE == "outbox":
+            # 调度器发送完任务在发件箱中的条目后才标记为完成
+            job.status = "queued_for_dispatch"
+            db.session.flush()
+            ImportJob.complete_dispatched([job.id])  # 没有需要发送的行，或导入期间调度器已全部发送
+        else:
+            job.status = "completed"
+            job.finished_at = datetime.utcnow()
+        job.renew_lease(lease_id)
+        db.session.commit()
+        logger.info(
+            "Successfully uploaded and processed %d product listings from Excel for user %s.",
+            job.rows_inserted,
+            job.user_id,
+        )
+        return inserted
+    except ImportJobLeaseLostError:
+        # 任务已由接管者负责，不修改它的状态
+        db.session.rollback()
+        raise
+    except Exception as e:
+        _fail_job(job, e, lease_id)
+        raise
+
+
+def _fail_job(job, error, lease_id):
+    """回滚未提交的块，把任务标记为失败；任务已被接管（lease_id 不再匹配）时不修改"""
+    db.session.rollback()
+    if not job.fail(lease_id, error):
+        logger.warning("Import job %s was taken over, not marking it failed: %s", job.id, error)
+    db.session.commit()
+
+
+def _run_import_job_in_background(app, job_id, path, lease_id):
+    """后台线程入口：在应用上下文中执行导入任务，结束后删除临时文件"""
+    with app.app_context():
         try:
-            header = json.loads(req_config.header)
-        except json.JSONDecodeError:
-            logger.warning("Failed to parse header for RequestConfig %s", req_config.id)
-
-        # Generate body
-        body = req_config.generate_body(listing)
-
-        # Get callback token if associated
-        callback_token = ""
-        if listing.api_token:
-            callback_token = listing.api_token.token
-
-        task_item = {
-            "name": listing.title or f"Product {listing.id}",
-            "start_time": datetime.utcnow().timestamp(),
-            "header": header,
-            "method": req_config.method,
-            "request_url": scheduler_url,  # Per user instruction
-            "callback_url": callback_url,
-            "callback_id": str(listing.id),
-            "callback_token": callback_token,
-            "body": body,
-            "cron": None,
-        }
-        tasks_data.append(task_item)
-
-    if not tasks_data:
-        logger.warning("No valid tasks to send to scheduler.")
-        return False
+            job = db.session.get(ImportJob, job_id)
+            with open(path, "rb") as stream:
+                try:
+                    chunks = read_listing_chunks(stream, job.filename, CHUNK_SIZE, skip_rows=job.checkpoint_row)
+                except Exception as e:
+                    # .xls 在这里才解析和校验表头
+                    _fail_job(job, e, lease_id)
+                    raise
+                with closing(chunks):
+                    _run_listing_import(job, chunks, lease_id)
+        except Exception as e:
+            logger.error("Import job %s failed: %s", job_id, str(e))
+        finally:
+            os.remove(path)
 
-    payload = {"tasks_data": tasks_data}
 
+def _file_sha256(stream):
+    """计算上传文件内容的SHA-256，读取后将流重置到开头"""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _listing_projection(fields):
+    """
+    解析 ?fields=（逗号分隔），返回 (字段列表, 查询选项, 错误信息)
+
+    只 SELECT 选中的列；response_content 保存在 responses 表中，选中时才 JOIN 加载
+    """
+    if not fields:
+        return None, [joinedload(ProductListing.response)], None
+    selected = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in selected if field not in ProductListing.DICT_FIELDS]
+    if unknown or not selected:
+        return None, [], f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(ProductListing.DICT_FIELDS)}"
+    columns = [getattr(ProductListing, field) for field in selected if field not in ("id", "response_content")]
+    options = []
+    if "response_content" in selected:
+        columns.append(ProductListing.response_id)
+        options.append(joinedload(ProductListing.response))
+    # send_time 用于生成下一页的游标
+    options.append(load_only(ProductListing.id, ProductListing.send_time, *columns))
+    return selected, options, None
+
+
+def _encode_cursor(listing):
+    """下一页的游标：最后一条的 (send_time, id)，base64url 编码"""
+    data = json.dumps([listing.send_time.isoformat(), listing.id]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    """解析游标，格式错误时抛出 ValueError"""
     try:
-        response = requests.post(task_url, json=payload, timeout=30)
-        response.raise_for_status()
-        logger.info("Successfully sent batch of %d tasks to scheduler.", len(tasks_data))
-        return True
-    except requests.exceptions.RequestException as e:
-        logger.error("Failed to send batch tasks to scheduler: %s", e)
-        return False
+        send_time, listing_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(send_time), int(listing_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _as_utc(value):
+    """带时区的时间转成数据库中保存的 UTC 时间（不带时区）"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(UTC).replace(tzinfo=None)
+    return value
 
 
 class ProductListingResource(Resource):  # Renamed class
@@ -164,33 +458,75 @@ class ProductListingResource(Resource):  # Renamed class
 
     @auth_required
     def get(self, log_id=None):
-        user_id = current_user().id  # Get current user's ID
+        """
+        ?fields=id,status,... 只查询和返回选中的字段，默认返回全部字段
+
+        列表按 (send_time, id) 倒序分页：每页 ?limit= 条（默认 LISTING_PAGE_SIZE，不超过 LISTING_MAX_PAGE_SIZE），
+        还有下一页时响应头 X-Next-Cursor 给出游标，作为 ?cursor= 传入获取下一页。
+        可按 status、request_config_id、response_code 和 send_time 范围（since <= send_time < until）过滤
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument("fields", type=str, location="args")
+        parser.add_argument("limit", type=int, location="args")
+        parser.add_argument("cursor", type=str, location="args")
+        parser.add_argument("status", type=str, location="args")
+        parser.add_argument("request_config_id", type=int, location="args")
+        parser.add_argument("response_code", type=int, location="args")
+        parser.add_argument("since", type=inputs.datetime_from_iso8601, location="args")
+        parser.add_argument("until", type=inputs.datetime_from_iso8601, location="args")
+        args = parser.parse_args()
+        fields, options, error = _listing_projection(args["fields"])
+        if error:
+            return {"message": error}, 400
+
+        user_id = current_user_id()
+        query = ProductListing.query.options(*options)
         if log_id:
             # Changed RequestLog to ProductListing and added user_id filter
-            log = ProductListing.query.filter_by(id=log_id, user_id=user_id).first_or_404()
-            return log.to_dict()
-        else:
-            # Changed RequestLog to ProductListing and added user_id filter
-            logs = ProductListing.query.filter_by(user_id=user_id).order_by(ProductListing.send_time.desc()).all()
-            return [log.to_dict() for log in logs]
+            log = query.filter_by(id=log_id, user_id=user_id).first_or_404()
+            return log.to_dict(fields)
+
+        # Changed RequestLog to ProductListing and added user_id filter
+        query = query.filter(ProductListing.user_id == user_id)
+        for name in ("status", "request_config_id", "response_code"):
+            if args[name] is not None:
+                query = query.filter(getattr(ProductListing, name) == args[name])
+        if args["since"] is not None:
+            query = query.filter(ProductListing.send_time >= _as_utc(args["since"]))
+        if args["until"] is not None:
+            query = query.filter(ProductListing.send_time < _as_utc(args["until"]))
+        if args["cursor"]:
+            try:
+                send_time, listing_id = _decode_cursor(args["cursor"])
+            except ValueError as e:
+                return {"message": str(e)}, 400
+            query = query.filter(tuple_(ProductListing.send_time, ProductListing.id) < (send_time, listing_id))
+
+        limit = min(max(args["limit"] or LISTING_PAGE_SIZE, 1), LISTING_MAX_PAGE_SIZE)
+        logs = query.order_by(ProductListing.send_time.desc(), ProductListing.id.desc()).limit(limit + 1).all()
+        headers = {}
+        if len(logs) > limit:
+            logs = logs[:limit]
+            headers["X-Next-Cursor"] = _encode_cursor(logs[-1])
+        return [log.to_dict(fields) for log in logs], 200, headers
 
     @auth_required
     def post(self):
         args = self.parser.parse_args()
 
         # Validate request_config_id
-        req_config = RequestConfig.query.filter_by(id=args["request_config_id"], user_id=current_user().id).first()
+        req_config = RequestConfig.query.filter_by(id=args["request_config_id"], user_id=current_user_id()).first()
         if not req_config:
             return {"message": "Invalid request_config_id"}, 400
 
         # Validate api_token_id if provided
         if args.get("api_token_id"):
-            token = APIToken.query.filter_by(id=args["api_token_id"], user_id=current_user().id).first()
+            token = APIToken.query.filter_by(id=args["api_token_id"], user_id=current_user_id()).first()
             if not token:
                 return {"message": "Invalid api_token_id"}, 400
 
         new_listing = ProductListing(
-            user_id=current_user().id,
+            user_id=current_user_id(),
             request_config_id=args["request_config_id"],
             product_id=args["product_id"],
             product_link=args["product_link"],
@@ -200,19 +536,29 @@ class ProductListingResource(Resource):  # Renamed class
             api_token_id=args.get("api_token_id"),
         )
         db.session.add(new_listing)
+        if DISPATCH_MODE == "outbox":
+            db.session.flush()
+            OutboxEntry.enqueue([new_listing.id])
         db.session.commit()
 
         logger.info(
             "New product listing added for user %s: %s",
-            current_user().id,
+            current_user_id(),
             new_listing.product_id or new_listing.product_link,
         )  # Updated to use product_link
 
+        if DISPATCH_MODE == "outbox":
+            return new_listing.to_dict(), 201  # 由发件箱调度器发送
+
         # After successfully adding to DB, send to scheduler service
         if _send_single_task_to_scheduler(new_listing):
             new_listing.status = "是否完成"  # Set status to "whether completed"
             db.session.commit()
             logger.info("Product listing %s status updated to '是否完成' after sending to scheduler.", new_listing.id)
+        elif FALLBACK_TO_OUTBOX:
+            OutboxEntry.enqueue([new_listing.id])
+            db.session.commit()
+            logger.warning("Product listing %s failed to send to scheduler service, queued for retry.", new_listing.id)
         else:
             logger.warning(
                 "Product listing %s failed to send to scheduler service. Status remains as before.", new_listing.id
@@ -230,94 +576,173 @@ class ExcelUploadResource(Resource):
             "request_config_id", type=int, location="form", required=True, help="RequestConfig ID is required"
         )  # Add request_config_id
         parser.add_argument("api_token_id", type=int, location="form", required=True, help="API Token ID is required")
+        parser.add_argument("async", type=inputs.boolean, location="form", default=False)  # 后台导入，立即返回202
+        parser.add_argument(
+            "dedupe", type=str, location="form", choices=DEDUPE_CHOICES, default=DEFAULT_DEDUPE
+        )  # 跳过已上传过的商品
         args = parser.parse_args()
 
         excel_file = args["file"]
         request_config_id = args["request_config_id"]
         api_token_id = args.get("api_token_id")
+        dedupe_key = None if args["dedupe"] == "none" else args["dedupe"]
 
         # Validate request_config_id
-        req_config = RequestConfig.query.filter_by(id=request_config_id, user_id=current_user().id).first()
+        req_config = RequestConfig.query.filter_by(id=request_config_id, user_id=current_user_id()).first()
         if not req_config:
             return {"message": "Invalid request_config_id"}, 400
 
         # Validate api_token_id if provided
         if api_token_id:
-            token = APIToken.query.filter_by(id=api_token_id, user_id=current_user().id).first()
+            token = APIToken.query.filter_by(id=api_token_id, user_id=current_user_id()).first()
             if not token:
                 return {"message": "Invalid api_token_id"}, 400
 
-        if not excel_file.filename.endswith((".xlsx", ".xls")):
-            return {"message": "Invalid file type. Only .xlsx and .xls are allowed."}, 400
+        if not is_supported_filename(excel_file.filename):
+            return {"message": str(UnsupportedFormatError())}, 400
+
+        # 同一用户以相同配置重新上传之前失败（或执行者已退出）的同一文件时，接管该任务并从检查点继续导入；
+        # 任务仍在执行时返回409，不重复导入
+        file_hash = _file_sha256(excel_file.stream)
+        stale_before = datetime.utcnow() - timedelta(seconds=IMPORT_STALE_SECONDS)
+        job = (
+            ImportJob.query.filter(
+                ImportJob.user_id == current_user_id(),
+                ImportJob.request_config_id == request_config_id,
+                ImportJob.api_token_id == api_token_id,
+                ImportJob.file_hash == file_hash,
+                ImportJob.status.in_(("failed", "queued", "running")),
+            )
+            .order_by(ImportJob.id.desc())
+            .first()
+        )
+        if job:
+            lease_id = job.take_over(stale_before)
+            if lease_id is None:
+                return {"message": "This file is still being imported.", "job": job.to_dict()}, 409
+        skip_rows = job.checkpoint_row if job else 0
 
         try:
-            df = pd.read_excel(excel_file.stream)
-
-            required_headers = {
-                "商品ID": "product_id",
-                "商品链接": "product_link",
-                "标题": "title",
-                "库存": "stock",
-                "上架编码": "listing_code",
-            }
-
-            # Validate headers
-            if not all(header in df.columns for header in required_headers):
-                return {"message": f"Missing required headers. Required: {list(required_headers.keys())}"}, 400
-
-            new_listings = []
-            for _, row in df.iterrows():
-                # Correctly handle potential key errors if column names don't match exactly (though validation above helps)
-                # Use .get with row to avoid KeyError if something subtle is wrong, but standard access is safer after validation
-                listing_data = {
-                    eng_key: row[chn_key] if not pd.isna(row[chn_key]) else None
-                    for chn_key, eng_key in required_headers.items()
-                }
-
-                new_listing = ProductListing(
-                    user_id=current_user().id,
-                    request_config_id=request_config_id,
-                    product_id=listing_data.get("product_id"),
-                    product_link=listing_data.get("product_link"),
-                    title=listing_data.get("title"),
-                    stock=listing_data.get("stock"),
-                    listing_code=listing_data.get("listing_code"),
-                    api_token_id=api_token_id,
-                    send_time=datetime.utcnow(),  # Default send_time
-                    status="Uploaded",  # Default status for uploaded items
-                )
-                db.session.add(new_listing)
-                new_listings.append(new_listing)
-
-            db.session.commit()  # Commit all new listings
-
-            # After committing, send each new listing to the scheduler service
-            if _send_batch_tasks_to_scheduler(new_listings):
-                for listing in new_listings:
-                    listing.status = "是否完成"  # Set status to "whether completed"
-                    db.session.add(listing)  # Re-add to session for update
-                db.session.commit()  # Commit status updates
-                logger.info(
-                    "Batch of %d product listings status updated to '是否完成' after sending to scheduler.",
-                    len(new_listings),
-                )
+            if args["async"]:
+                # 后台导入只在请求中读取表头行（读完即关闭），.xls 由后台任务解析时校验
+                check_headers(excel_file.stream, excel_file.filename)
+                chunks = None
             else:
-                logger.warning(
-                    "Batch of %d product listings from Excel failed to send to scheduler service. Status remains as before.",
-                    len(new_listings),
-                )
-
-            logger.info(
-                "Successfully uploaded and processed %d product listings from Excel for user %s.",
-                len(new_listings),
-                current_user().id,
+                # 先判断格式并校验表头，再按块流式读取
+                chunks = read_listing_chunks(excel_file.stream, excel_file.filename, CHUNK_SIZE, skip_rows=skip_rows)
+        except (UnsupportedFormatError, MissingHeadersError) as e:
+            if job:
+                _fail_job(job, e, lease_id)
+            return {"message": str(e)}, 400
+        except Exception as e:
+            # 损坏或截断的文件（BadZipFile、xlrd/pandas 的解析错误等）；接管的任务标记为失败，之后可以重新上传
+            logger.error("Error reading uploaded file %s: %s", excel_file.filename, e)
+            if job:
+                _fail_job(job, e, lease_id)
+            return {"message": f"Error processing Excel file: {str(e)}"}, 400
+
+        if job:
+            logger.info("Resuming import job %s from row %d.", job.id, skip_rows)
+        else:
+            job = ImportJob(
+                user_id=current_user_id(),
+                request_config_id=request_config_id,
+                api_token_id=api_token_id,
+                filename=excel_file.filename,
+                file_hash=file_hash,
             )
-            return {"message": f"Successfully uploaded and processed {len(new_listings)} product listings."}, 201
+            db.session.add(job)
+            lease_id = job.lease_id
+        job.dedupe_key = dedupe_key
+        job.status = "queued"
+        db.session.commit()
+
+        if args["async"]:
+            return self._submit_background_job(job, excel_file, lease_id)
 
+        try:
+            with closing(chunks):
+                _run_listing_import(job, chunks, lease_id)
+        except (UnsupportedFormatError, MissingHeadersError) as e:
+            # 文件中间的行格式错误（例如 JSON Lines 某一行不是对象），任务已标记为失败
+            return {"message": str(e), "job_id": job.id, "checkpoint_row": job.checkpoint_row}, 400
         except Exception as e:
-            db.session.rollback()
             logger.error("Error processing Excel upload: %s", str(e))
-            return {"message": f"Error processing Excel file: {str(e)}"}, 500
+            return {
+                "message": f"Error processing Excel file: {str(e)}",
+                "job_id": job.id,
+                "checkpoint_row": job.checkpoint_row,
+            }, 500
+
+        return {
+            "message": f"Successfully uploaded and processed {job.rows_inserted} product listings.",
+            "job_id": job.id,
+            "resumed_from_row": skip_rows,
+            "skipped": job.rows_skipped,
+        }, 201
+
+    @staticmethod
+    def _submit_background_job(job, excel_file, lease_id):
+        """把上传文件落到临时文件，交给后台线程池导入，立即返回202"""
+        suffix = os.path.splitext(excel_file.filename)[1]
+        fd, path = tempfile.mkstemp(prefix="tb-import-", suffix=suffix)
+        with os.fdopen(fd, "wb") as temp_file:
+            excel_file.stream.seek(0)
+            shutil.copyfileobj(excel_file.stream, temp_file)
+
+        try:
+            import_executor.submit(
+                _run_import_job_in_background, current_app._get_current_object(), job.id, path, lease_id
+            )
+        except QueueFullError:
+            os.remove(path)
+            _fail_job(job, "Import queue is full", lease_id)
+            return {"message": "Too many imports in progress, please retry later.", "job_id": job.id}, 503
+
+        return {"message": "Import accepted.", "job_id": job.id, "status_url": f"/api/import-jobs/{job.id}"}, 202
+
+
+class ImportJobResource(Resource):
+    @auth_required
+    def get(self, job_id=None):
+        user_id = current_user_id()
+        if job_id:
+            job = ImportJob.query.filter_by(id=job_id, user_id=user_id).first_or_404()
+            return job.to_dict()
+        jobs = ImportJob.query.filter_by(user_id=user_id).order_by(ImportJob.id.desc()).limit(100).all()
+        return [job.to_dict() for job in jobs]
+
+
+class ImportJobRetryResource(Resource):
+    @auth_required
+    def post(self, job_id):
+        """重新发送导入任务中之前发送失败的listing，已发送成功的不会重复发送"""
+        job = ImportJob.query.filter_by(id=job_id, user_id=current_user_id()).first_or_404()
+        if job.status in ("queued", "running"):
+            return {"message": "Import job is still in progress.", "job": job.to_dict()}, 409
+
+        if DISPATCH_MODE == "outbox":
+            queued = _enqueue_job_listings(job)
+            logger.info("Requeued %d listings of import job %s.", queued, job.id)
+            return {"message": f"Queued {queued} product listings.", "job": job.to_dict()}, 202
+
+        dispatched = _dispatch_job_listings(job)
+        logger.info("Retried import job %s: %d listings sent, %d failed.", job.id, dispatched, job.rows_failed)
+        return {"message": f"Sent {dispatched} product listings.", "job": job.to_dict()}, 200
+
+
+class SchedulerStatusResource(Resource):
+    @auth_required
+    def get(self):
+        """scheduler服务的熔断器状态、请求耗时分位数和当前读取超时，以及发件箱和回调缓冲的积压情况"""
+        outbox = dict(db.session.execute(select(OutboxEntry.status, func.count()).group_by(OutboxEntry.status)).all())
+        return {
+            "scheduler_url": config_data["scheduler"]["SCHEDULER_SERVICE_URL"],
+            "dispatch_mode": DISPATCH_MODE,
+            **scheduler_client.status(),
+            "outbox": {"pending": outbox.get("pending", 0), "dead": outbox.get("dead", 0)},
+            "callback_buffer": {"enabled": CALLBACK_BUFFERED, **callback_buffer.status()},
+        }, 200
 
 
 class SchedulerCallbackResource(Resource):
@@ -327,6 +752,7 @@ class SchedulerCallbackResource(Resource):
         处理scheduler_service的回调请求，更新ProductListing的状态、响应内容和响应码
         接收参数：id (int)、status (str)、response_code (int)、response_content (str)
         需要使用API token进行认证访问
+        CALLBACK_BUFFERED 开启时放进写后缓冲并返回 202，不检查listing是否存在；缓冲已满时按原方式同步写入
         """
         parser = reqparse.RequestParser()
         parser.add_argument("id", type=int, required=True, help="ProductListing ID is required")
@@ -335,6 +761,16 @@ class SchedulerCallbackResource(Resource):
         parser.add_argument("response_content", type=str, required=False, help="HTTP response content")
         args = parser.parse_args()
 
+        if CALLBACK_BUFFERED and callback_buffer.submit(
+            {
+                "listing_id": args["id"],
+                "new_status": args["status"],
+                "new_response_code": args["response_code"],
+                "new_response_content": args["response_content"],
+            }
+        ):
+            return {"message": "Callback accepted"}, 202
+
         try:
             # 通过id查询ProductListing
             product_listing = ProductListing.query.filter_by(id=args["id"]).first()
@@ -369,3 +805,97 @@ class SchedulerCallbackResource(Resource):
             db.session.rollback()
             logger.error("Error updating ProductListing %d: %s", args["id"], str(e))
             return {"message": "Internal server error"}, 500
+
+
+def _parse_callback(item):
+    """
+    校验批量回调中的一条，规则与单条回调接口相同
+
+    Returns:
+        tuple: (更新参数, 错误信息)，校验失败时更新参数为None
+    """
+    if not isinstance(item, dict):
+        return None, "Callback must be an object"
+    try:
+        listing_id = int(item["id"])
+    except (KeyError, TypeError, ValueError):
+        return None, "ProductListing ID is required"
+    if not isinstance(item.get("status"), str):
+        return None, "Status is required"
+    response_code = item.get("response_code")
+    if response_code is not None:
+        try:
+            response_code = int(response_code)
+        except (TypeError, ValueError):
+            return None, "HTTP response code must be an integer"
+    response_content = item.get("response_content")
+    return {
+        "listing_id": listing_id,
+        "new_status": item["status"],
+        "new_response_code": response_code,
+        "new_response_content": None if response_content is None else str(response_content),
+    }, None
+
+
+def _apply_callbacks(items):
+    """
+    在一个事务中应用一批回调（响应内容写入 responses 表，listing 用一条 executemany UPDATE 更新），
+    返回与 items 一一对应的结果列表
+    response_code/response_content 为空时保持原值（与单条回调接口一致）；同一listing出现多次时后面的生效
+    """
+    results = []
+    params = []
+    for index, item in enumerate(items):
+        values, error = _parse_callback(item)
+        if error:
+            results.append({"index": index, "id": item.get("id") if isinstance(item, dict) else None, "error": error})
+        else:
+            results.append(values)
+            params.append(values)
+
+    listing_ids = {values["listing_id"] for values in params}
+    existing = set()
+    if listing_ids:
+        existing = set(
+            db.session.execute(select(ProductListing.id).where(ProductListing.id.in_(listing_ids))).scalars()
+        )
+    params = [values for values in params if values["listing_id"] in existing]
+    if params:
+        apply_callbacks(db.session.connection(), params)
+    db.session.commit()
+
+    for index, result in enumerate(results):
+        if "error" in result:
+            results[index] = {"id": result["id"], "result": "invalid", "message": result["error"]}
+        elif result["listing_id"] in existing:
+            results[index] = {"id": result["listing_id"], "result": "updated"}
+        else:
+            results[index] = {"id": result["listing_id"], "result": "not_found"}
+    return results
+
+
+class SchedulerCallbacksResource(Resource):
+    @api_token_required
+    def post(self):
+        """
+        批量处理scheduler_service的回调，请求体为回调数组（或 {"callbacks": [...]}），
+        每项与单条回调接口的参数相同：id、status、response_code、response_content。
+        所有回调在一个事务中通过一条批量UPDATE写入，返回每项的结果：updated/not_found/invalid
+        """
+        payload = request.get_json(silent=True)
+        items = payload.get("callbacks") if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            return {"message": "Request body must be an array of callbacks"}, 400
+        if len(items) > CALLBACK_BATCH_LIMIT:
+            return {"message": f"Too many callbacks, at most {CALLBACK_BATCH_LIMIT} per request"}, 413
+
+        try:
+            results = _apply_callbacks(items)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error applying %d scheduler callbacks: %s", len(items), str(e))
+            return {"message": "Internal server error"}, 500
+
+        updated = sum(result["result"] == "updated" for result in results)
+        logger.info("Applied %d of %d scheduler callbacks.", updated, len(items))
+        return {"updated": updated, "results": results}, 200
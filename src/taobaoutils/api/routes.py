@@ -7,7 +7,15 @@ from taobaoutils.api.auth import (
     UsersResource,
 )
 from taobaoutils.api.request_config import RequestConfigListResource, RequestConfigResource
-from taobaoutils.api.resources import ExcelUploadResource, ProductListingResource, SchedulerCallbackResource
+from taobaoutils.api.resources import (
+    ExcelUploadResource,
+    ImportJobResource,
+    ImportJobRetryResource,
+    ProductListingResource,
+    SchedulerCallbackResource,
+    SchedulerCallbacksResource,
+    SchedulerStatusResource,
+)
 
 
 def initialize_routes(api):
@@ -24,7 +32,11 @@ def initialize_routes(api):
     # 业务相关路由
     api.add_resource(ProductListingResource, "/api/product-listings", "/api/product-listings/<int:log_id>")
     api.add_resource(ExcelUploadResource, "/api/product-listings/upload")
+    api.add_resource(ImportJobResource, "/api/import-jobs", "/api/import-jobs/<int:job_id>")
+    api.add_resource(ImportJobRetryResource, "/api/import-jobs/<int:job_id>/retry")
     api.add_resource(SchedulerCallbackResource, "/api/scheduler/callback")  # 添加新的回调端点
+    api.add_resource(SchedulerCallbacksResource, "/api/scheduler/callbacks")  # 批量回调
+    api.add_resource(SchedulerStatusResource, "/api/scheduler/status")
 
     # RequestConfig routes
     api.add_resource(RequestConfigListResource, "/api/request-configs")
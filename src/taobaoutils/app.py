@@ -4,15 +4,24 @@ from flask import Flask
 from flask_praetorian import Praetorian
 from flask_restful import Api
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 from taobaoutils import config_data, logger
+from taobaoutils.migrations import upgrade_schema
 
 db = SQLAlchemy()
+# create_all 之后为旧数据库补齐新增的列、索引和数据
+event.listen(db.metadata, "after_create", upgrade_schema)
 api = Api()
 guard = Praetorian()  # Praetorian guard 实例
 
 
-def create_app():
+def create_app(start_dispatcher=True):
+    """
+    Args:
+        start_dispatcher: outbox 模式（或开启 FALLBACK_TO_OUTBOX）下是否在本进程启动发件箱调度线程
+            （配置 OUTBOX_THREAD = false 时不启动，由单独的 ``tb dispatcher`` 进程发送）
+    """
     app = Flask(__name__)
 
     # Load Flask configuration from config.toml
@@ -51,5 +60,15 @@ def create_app():
     with app.app_context():
         db.create_all()  # Create database tables for our models
 
+    scheduler_config = config_data.get("scheduler", {})
+    if (
+        start_dispatcher
+        and (scheduler_config.get("DISPATCH_MODE", "inline") == "outbox" or scheduler_config.get("FALLBACK_TO_OUTBOX"))
+        and scheduler_config.get("OUTBOX_THREAD", True)
+    ):
+        from taobaoutils.dispatcher import start_dispatcher_thread
+
+        app.extensions["outbox_dispatcher"] = start_dispatcher_thread(app)
+
     logger.info("Flask application created and configured.")
     return app
@@ -33,6 +33,50 @@ def serve(host, port):
         sys.exit(1)
 
 
+@main.command()
+@click.option("--once", is_flag=True, default=False, help="Send one batch from the outbox and exit.")
+def dispatcher(once):
+    """Run the outbox dispatcher that sends queued listings to the scheduler service."""
+    from taobaoutils.dispatcher import create_dispatcher
+
+    app = create_app(start_dispatcher=False)
+    outbox_dispatcher = create_dispatcher(app)
+    if once:
+        with app.app_context():
+            sent = outbox_dispatcher.run_once()
+        logger.info("Processed %d outbox entries.", sent)
+        return
+
+    logger.info("Starting outbox dispatcher (owner %s)...", outbox_dispatcher.owner)
+    try:
+        outbox_dispatcher.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Outbox dispatcher stopped.")
+
+
+@main.command("fake-scheduler")
+@click.option("--host", default="127.0.0.1", help="Host address for the fake scheduler.")
+@click.option("--port", default=8000, type=int, help="Port for the fake scheduler.")
+@click.option("--latency", default=0.0, type=float, help="Average response latency in seconds.")
+@click.option("--error-rate", default=0.0, type=float, help="Fraction of requests answered with 503.")
+@click.option("--callbacks", is_flag=True, default=False, help="Call back /api/scheduler/callback for every task.")
+@click.option("--callback-batch", default=0, type=int, help="Group callbacks into bulk requests of this size.")
+def fake_scheduler(host, port, latency, error_rate, callbacks, callback_batch):
+    """Run a local stand-in for the scheduler service."""
+    from taobaoutils.fake_scheduler import FakeScheduler
+
+    scheduler = FakeScheduler(
+        host, port, latency=latency, error_rate=error_rate, callbacks=callbacks, callback_batch=callback_batch
+    )
+    logger.info("Fake scheduler listening on %s", scheduler.url)
+    try:
+        scheduler.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Fake scheduler stopped: %s", scheduler.stats)
+    finally:
+        scheduler.stop()
+
+
 @main.command()
 @click.option("--coverage", is_flag=True, default=False, help="Run tests with coverage report.")
 def test(coverage):
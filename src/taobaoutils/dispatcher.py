@@ -0,0 +1,242 @@
+"""
+发件箱调度器
+
+``[scheduler] DISPATCH_MODE = "outbox"`` 时，上传和新建listing只在同一事务中写入发件箱条目，
+请求本身不再等待scheduler。OutboxDispatcher 在后台线程（或 ``tb dispatcher`` 进程）中循环：
+
+1. 用一条 UPDATE 给一批可发送的条目加上租约（lease_id + leased_until），多个调度器并存时不会重复领取；
+2. 加载这些listing并按批发送到scheduler；
+3. 发送成功的listing状态更新为 '是否完成' 并删除条目，失败的按指数退避推迟，超过次数后标记为 dead；
+   导入任务的条目都已发送（或 dead）后，任务从 queued_for_dispatch 标记为 completed。
+
+进程在发送途中退出时租约会过期，条目之后被重新领取，因此发送是“至少一次”的。
+
+Web 进程内的调度线程通过 start_dispatcher_thread 启动，每个进程只有一个。
+"""
+
+import atexit
+import os
+import random
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.orm import joinedload
+
+from taobaoutils import config_data, logger
+from taobaoutils.app import db
+from taobaoutils.models import ImportJob, OutboxEntry, ProductListing
+from taobaoutils.scheduler import CircuitBreaker, scheduler_client, send_batch_tasks
+
+
+class OutboxDispatcher:
+    """
+    从发件箱领取条目并发送到scheduler
+
+    Args:
+        app: Flask 应用，循环在它的应用上下文中执行
+        batch_size: 每次领取的条目数
+        lease_seconds: 租约时长（秒），应大于发送一批所需的时间
+        max_attempts: 最大发送次数，达到后条目标记为 dead
+        backoff_base: 第一次失败后的重试间隔（秒），之后每次翻倍
+        backoff_max: 重试间隔上限（秒）
+        poll_interval: 发件箱为空时的轮询间隔（秒）
+    """
+
+    def __init__(
+        self,
+        app,
+        batch_size=500,
+        lease_seconds=120,
+        max_attempts=8,
+        backoff_base=5,
+        backoff_max=600,
+        poll_interval=1,
+    ):
+        self.app = app
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, app, scheduler_config):
+        """根据 config.toml 的 [scheduler] 配置创建调度器"""
+        return cls(
+            app,
+            batch_size=scheduler_config.get("OUTBOX_BATCH_SIZE", 500),
+            lease_seconds=scheduler_config.get("OUTBOX_LEASE_SECONDS", 120),
+            max_attempts=scheduler_config.get("OUTBOX_MAX_ATTEMPTS", 8),
+            backoff_base=scheduler_config.get("OUTBOX_BACKOFF_BASE", 5),
+            backoff_max=scheduler_config.get("OUTBOX_BACKOFF_MAX", 600),
+            poll_interval=scheduler_config.get("OUTBOX_POLL_INTERVAL", 1),
+        )
+
+    def backoff(self, attempts):
+        """第 attempts 次失败后的重试间隔（秒），指数增长并带随机抖动，避免大量条目同时重试"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def lease(self):
+        """
+        领取一批可发送的条目并提交租约
+
+        Returns:
+            list: 领取到的 (条目ID, listing ID, 已失败次数)
+        """
+        now = datetime.utcnow()
+        lease_id = f"{self.owner}-{uuid.uuid4().hex[:8]}"
+        ready = and_(
+            OutboxEntry.status == "pending",
+            OutboxEntry.available_at <= now,
+            or_(OutboxEntry.leased_until.is_(None), OutboxEntry.leased_until < now),
+        )
+        candidates = select(OutboxEntry.id).where(ready).order_by(OutboxEntry.id).limit(self.batch_size)
+        # 外层再次检查条件：并发领取时，已被其他调度器领取的行在更新时会被跳过
+        db.session.execute(
+            update(OutboxEntry)
+            .where(OutboxEntry.id.in_(candidates.scalar_subquery()), ready)
+            .values(lease_id=lease_id, leased_until=now + timedelta(seconds=self.lease_seconds))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return db.session.execute(
+            select(OutboxEntry.id, OutboxEntry.listing_id, OutboxEntry.attempts).where(OutboxEntry.lease_id == lease_id)
+        ).all()
+
+    def run_once(self):
+        """领取并发送一批条目，返回本次领取的条目数量"""
+        breaker = scheduler_client.breaker(config_data["scheduler"]["SCHEDULER_SERVICE_URL"])
+        if breaker.state == CircuitBreaker.OPEN:
+            return 0  # 熔断期间不领取，避免把重试次数消耗在必然被拒绝的请求上
+        entries = self.lease()
+        if not entries:
+            return 0
+
+        listings = (
+            ProductListing.query.options(
+                joinedload(ProductListing.request_config), joinedload(ProductListing.api_token)
+            )
+            .filter(ProductListing.id.in_([entry.listing_id for entry in entries]))
+            .all()
+        )
+        job_ids = {listing.id: listing.import_job_id for listing in listings}
+        result = send_batch_tasks(listings)
+        sent = set(result.sent_ids)
+        # 已被删除的listing不需要再发送
+        done = [entry.id for entry in entries if entry.listing_id in sent or entry.listing_id not in job_ids]
+        failed = [entry for entry in entries if entry.listing_id in job_ids and entry.listing_id not in sent]
+
+        if sent:
+            # 回调可能先于这里到达，只更新尚未被回调更新过状态的listing
+            ProductListing.query.filter(
+                ProductListing.id.in_(sent), ProductListing.status.in_(("Uploaded", "pending"))
+            ).update({"status": "是否完成"}, synchronize_session=False)
+            self._add_job_counts("rows_dispatched", Counter(job_ids[listing_id] for listing_id in sent))
+        if done:
+            db.session.execute(delete(OutboxEntry).where(OutboxEntry.id.in_(done)))
+
+        now = datetime.utcnow()
+        dead = Counter()
+        for entry in failed:
+            attempts = entry.attempts + 1
+            values = {"attempts": attempts, "lease_id": None, "leased_until": None}
+            if attempts >= self.max_attempts:
+                values["status"] = "dead"
+                dead[job_ids[entry.listing_id]] += 1
+                logger.error("Listing %s failed to send to scheduler %d times, giving up.", entry.listing_id, attempts)
+            else:
+                values["available_at"] = now + timedelta(seconds=self.backoff(attempts))
+            db.session.execute(
+                update(OutboxEntry)
+                .where(OutboxEntry.id == entry.id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        self._add_job_counts("rows_failed", dead)
+        ImportJob.complete_dispatched(set(job_ids.values()))
+
+        for listing in listings:
+            db.session.expunge(listing)
+        db.session.commit()
+        if failed:
+            logger.warning("%d of %d outbox entries failed to send, will retry later.", len(failed), len(entries))
+        return len(entries)
+
+    @staticmethod
+    def _add_job_counts(column, counts):
+        """按导入任务累加计数"""
+        for job_id, count in counts.items():
+            if job_id is None:
+                continue
+            db.session.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id)
+                .values({column: getattr(ImportJob, column) + count})
+                .execution_options(synchronize_session=False)
+            )
+
+    def run_forever(self):
+        """循环发送直到 stop() 被调用；领取不满一批时等待 poll_interval 秒"""
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    processed = self.run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error("Outbox dispatcher error: %s", e)
+                    processed = 0
+                if processed < self.batch_size:
+                    self._stop.wait(self.poll_interval)
+            db.session.remove()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """在后台守护线程中运行"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="tb-outbox", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        """通知循环退出，并等待后台线程结束"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def create_dispatcher(app):
+    """按 [scheduler] 配置创建调度器"""
+    return OutboxDispatcher.from_config(app, config_data.get("scheduler", {}))
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def start_dispatcher_thread(app):
+    """
+    在本进程的后台线程中启动调度器，已有调度线程在运行时直接返回它
+
+    多次调用 create_app 不会启动多个线程（已有的线程继续使用它启动时的应用）；
+    fork 出的子进程中没有父进程的线程，会重新启动。
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None or not _dispatcher.running:
+            _dispatcher = create_dispatcher(app)
+            _dispatcher.start()
+            atexit.register(_dispatcher.stop, timeout=5)
+            logger.info("Outbox dispatcher thread started.")
+        return _dispatcher
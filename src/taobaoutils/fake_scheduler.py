@@ -0,0 +1,238 @@
+"""
+本地替身 scheduler 服务
+
+实现 scheduler 的 ``POST /add_req_task`` 和 ``POST /add_req_tasks``，用于在没有真实 scheduler 的环境中
+测量发送吞吐量、演练熔断和重试。可以配置响应延迟和错误率；开启回调后，收到的每个批量任务
+会按 callback_url / callback_id / callback_token 回调 ``/api/scheduler/callback``；设置 callback_batch
+后改为分组回调批量接口 ``/api/scheduler/callbacks``（callback_url 加 "s"）。
+支持 gzip/zstd 压缩的请求体和 normalized 格式的批量任务。
+
+    tb fake-scheduler --port 8000 --latency 0.05 --error-rate 0.01 --callbacks
+"""
+
+import gzip
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from taobaoutils import logger
+
+
+def expand_tasks(payload):
+    """把 normalized 格式的批量任务展开成完整任务（"shared" 引用替换为对应的公共字段）"""
+    shared = payload.get("shared") or {}
+    tasks = []
+    for task in payload.get("tasks_data", []):
+        if "shared" in task:
+            task = {**shared[str(task["shared"])], **{key: value for key, value in task.items() if key != "shared"}}
+        tasks.append(task)
+    return tasks
+
+
+def _decode_body(body, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(body)
+    return body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        scheduler = self.server.scheduler
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path not in ("/add_req_task", "/add_req_tasks"):
+            self._reply(404, {"message": "Not found"})
+            return
+        try:
+            payload = json.loads(_decode_body(body, self.headers.get("Content-Encoding")))
+        except (OSError, ValueError) as e:
+            self._reply(400, {"message": f"Invalid payload: {e}"})
+            return
+
+        if scheduler.latency:
+            time.sleep(scheduler.latency * random.uniform(1 - scheduler.jitter, 1 + scheduler.jitter))
+        if scheduler.error_rate and random.random() < scheduler.error_rate:
+            scheduler.record("errors")
+            self._reply(503, {"message": "Injected error"})
+            return
+
+        tasks = expand_tasks(payload) if self.path == "/add_req_tasks" else [payload]
+        scheduler.accept(tasks, len(body))
+        self._reply(200, {"message": "ok", "count": len(tasks)})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeScheduler:
+    """
+    在后台线程中运行的替身 scheduler
+
+    Args:
+        host: 监听地址
+        port: 监听端口，0 表示随机端口
+        latency: 每个请求的平均延迟（秒）
+        jitter: 延迟的随机波动比例，0.2 表示 ±20%
+        error_rate: 返回 503 的请求比例
+        callbacks: 是否回调任务的 callback_url
+        callback_status: 回调时上报的状态
+        callback_workers: 并发回调的线程数
+        callback_batch: 大于0时按这个数量分组调用批量回调接口
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.2,
+        error_rate=0.0,
+        callbacks=False,
+        callback_status="success",
+        callback_workers=4,
+        callback_batch=0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.callbacks = callbacks
+        self.callback_status = callback_status
+        self.callback_batch = callback_batch
+        self.stats = {
+            "requests": 0,
+            "tasks": 0,
+            "bytes": 0,
+            "errors": 0,
+            "callbacks_sent": 0,
+            "callbacks_failed": 0,
+        }
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.scheduler = self
+        self._thread = None
+        self._callback_executor = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix="fake-callback")
+        self._callback_session = requests.Session()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, name, count=1):
+        with self._lock:
+            self.stats[name] += count
+
+    def accept(self, tasks, size):
+        """记录收到的任务，需要时提交回调"""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["tasks"] += len(tasks)
+            self.stats["bytes"] += size
+        if self.callbacks:
+            callbacks = [task for task in tasks if task.get("callback_url") and task.get("callback_id")]
+            if not callbacks:
+                return
+            if self.callback_batch > 0:
+                for start in range(0, len(callbacks), self.callback_batch):
+                    self._callback_executor.submit(
+                        self._send_bulk_callbacks, callbacks[start : start + self.callback_batch]
+                    )
+            else:
+                self._callback_executor.submit(self._send_callbacks, callbacks)
+
+    def _callback_body(self, task):
+        return {
+            "id": int(task["callback_id"]),
+            "status": self.callback_status,
+            "response_code": 200,
+            "response_content": json.dumps({"code": 800, "callback_id": task["callback_id"]}),
+        }
+
+    def _send_callbacks(self, tasks):
+        for task in tasks:
+            try:
+                response = self._callback_session.post(
+                    task["callback_url"],
+                    json=self._callback_body(task),
+                    headers={"Authorization": f"Bearer {task.get('callback_token', '')}"},
+                    timeout=30,
+                )
+                response.raise_for_status()
+                self.record("callbacks_sent")
+            except requests.exceptions.RequestException as e:
+                self.record("callbacks_failed")
+                logger.warning("Fake scheduler callback for %s failed: %s", task["callback_id"], e)
+
+    def _send_bulk_callbacks(self, tasks):
+        """按 (callback_url, callback_token) 分组，每组一次请求"""
+        groups = {}
+        for task in tasks:
+            groups.setdefault((task["callback_url"], task.get("callback_token", "")), []).append(task)
+        for (url, token), group in groups.items():
+            try:
+                response = self._callback_session.post(
+                    url.rstrip("/") + "s",
+                    json=[self._callback_body(task) for task in group],
+                    headers={"Authorization": f"Bearer {token}"},
+                    timeout=30,
+                )
+                response.raise_for_status()
+                results = response.json()["results"]
+                updated = sum(result["result"] == "updated" for result in results)
+                self.record("callbacks_sent", updated)
+                self.record("callbacks_failed", len(group) - updated)
+            except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+                self.record("callbacks_failed", len(group))
+                logger.warning("Fake scheduler bulk callback of %d tasks failed: %s", len(group), e)
+
+    def wait_for_callbacks(self, count, timeout=60):
+        """等待回调（成功或失败）累计达到 count 个，返回是否在超时前完成"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self.stats["callbacks_sent"] + self.stats["callbacks_failed"] >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """在当前线程中运行，直到进程被中断"""
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+        self._callback_executor.shutdown(wait=True)
+        self._callback_session.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,397 @@
+"""
+上传文件解析
+
+把上传的表格转换成 ProductListing 字段字典。支持 xlsx/xls/csv/tsv/jsonl/parquet，
+格式由扩展名和文件内容（魔数、分隔符）共同判断。除 xls 外都流式读取：先校验表头，
+再按固定行数分块，每块按列完成类型转换后产出，内存占用与文件大小无关。
+"""
+
+import codecs
+import csv
+import io
+import json
+import os
+from functools import partial
+from itertools import chain, islice
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from taobaoutils import config_data
+
+# 表头（中文） -> ProductListing 字段
+REQUIRED_HEADERS = {
+    "商品ID": "product_id",
+    "商品链接": "product_link",
+    "标题": "title",
+    "库存": "stock",
+    "上架编码": "listing_code",
+}
+
+CHUNK_SIZE = config_data.get("upload", {}).get("CHUNK_SIZE", 1000)
+
+# 允许上传的扩展名 -> 默认格式
+SUPPORTED_EXTENSIONS = {
+    ".xlsx": "xlsx",
+    ".xls": "xls",
+    ".csv": "csv",
+    ".tsv": "tsv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".parquet": "parquet",
+}
+
+# 二进制格式的文件头
+MAGIC_NUMBERS = (
+    (b"PK\x03\x04", "xlsx"),  # zip 容器
+    (b"\xd0\xcf\x11\xe0", "xls"),  # OLE2 复合文档
+    (b"PAR1", "parquet"),
+)
+
+SNIFF_SIZE = 4096
+
+
+class MissingHeadersError(ValueError):
+    """上传文件缺少必需的表头"""
+
+    def __init__(self, missing):
+        self.missing = missing
+        super().__init__(f"Missing required headers. Required: {list(REQUIRED_HEADERS.keys())}")
+
+
+class UnsupportedFormatError(ValueError):
+    """上传文件的格式不受支持"""
+
+    def __init__(self, message=None):
+        super().__init__(message or f"Invalid file type. Supported: {', '.join(SUPPORTED_EXTENSIONS)}.")
+
+
+def is_supported_filename(filename):
+    """文件扩展名是否在允许上传的范围内"""
+    return os.path.splitext(filename or "")[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def _text_encoding(head):
+    """文本文件编码：能按 UTF-8 解码时使用 UTF-8（兼容BOM），否则按国标编码读取"""
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return "gb18030"
+    return "utf-8-sig"
+
+
+def detect_format(stream, filename):
+    """
+    根据扩展名和文件开头的内容判断格式，读取后流的位置保持不变
+    二进制格式以文件头为准；文本格式根据首个字符和首行中的分隔符区分 jsonl/tsv/csv
+
+    Raises:
+        UnsupportedFormatError: 扩展名不受支持
+    """
+    if not is_supported_filename(filename):
+        raise UnsupportedFormatError()
+    position = stream.tell()
+    head = stream.read(SNIFF_SIZE)
+    stream.seek(position)
+
+    for magic, file_format in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return file_format
+
+    text = head.decode(_text_encoding(head), errors="ignore").lstrip("\ufeff").lstrip()
+    if text.startswith("{"):
+        return "jsonl"
+    first_line = text.split("\n", 1)[0]
+    if first_line.count("\t") > first_line.count(","):
+        return "tsv"
+    return "csv"
+
+
+def _header_positions(header_row):
+    """校验表头并返回 字段 -> 列序号 的映射"""
+    header = [str(cell).strip() if cell is not None else None for cell in (() if header_row is None else header_row)]
+    missing = [name for name in REQUIRED_HEADERS if name not in header]
+    if missing:
+        raise MissingHeadersError(missing)
+    return {field: header.index(name) for name, field in REQUIRED_HEADERS.items()}
+
+
+TEXT_FIELDS = ("product_id", "product_link", "title", "listing_code")
+
+
+def _text_column(series):
+    """文本列：整数值的浮点列（例如带空值的商品ID列）先转为可空整数，避免出现 "111.0"；空字符串视为空值"""
+    if pd.api.types.is_float_dtype(series) and (series.dropna() % 1 == 0).all():
+        series = series.astype("Int64")
+    return series.astype("string").replace("", pd.NA)
+
+
+def _int_column(series):
+    """整数列：小数截断取整，空字符串和无法解析的值（例如 "N/A"、"10件"）视为空值，不让整份上传失败"""
+    return np.trunc(pd.to_numeric(series, errors="coerce")).astype("Int64")
+
+
+def normalize_frame(df):
+    """
+    把以模型字段为列名的 DataFrame 按列转换成模型字段类型：
+    商品ID等文本字段保持字符串，库存为可空整数
+    """
+    converted = {field: _text_column(df[field]) for field in TEXT_FIELDS}
+    converted["stock"] = _int_column(df["stock"])
+    return pd.DataFrame(converted, columns=list(REQUIRED_HEADERS.values()))
+
+
+def frame_to_records(df):
+    """DataFrame -> 字段字典列表，缺失值统一转换为 None（按列转换后再按行组装，比 to_dict("records") 快）"""
+    columns = list(df.columns)
+    values = [df[column].astype(object).where(df[column].notna(), None).tolist() for column in columns]
+    return [dict(zip(columns, row, strict=True)) for row in zip(*values, strict=True)]
+
+
+def _iter_row_chunks(rows, positions, chunk_size, skip_rows, close):
+    """
+    按表头位置从逐行产出的单元格序列中取出所需列，跳过空行和前 skip_rows 行数据，
+    每 chunk_size 行转换一次，结束或中断时调用 close 释放底层文件
+    """
+    fields = list(positions)
+    indexes = list(positions.values())
+    try:
+        selected = (
+            [row[index] if index < len(row) else None for index in indexes]
+            for row in rows
+            if any(cell is not None and cell != "" for cell in row)
+        )
+        for chunk in iter_chunks(islice(selected, skip_rows, None), chunk_size):
+            frame = pd.DataFrame(chunk, columns=fields).infer_objects()
+            yield frame_to_records(normalize_frame(frame))
+    finally:
+        close()
+
+
+def read_xlsx(stream, chunk_size=CHUNK_SIZE, skip_rows=0):
+    """
+    以 read_only 模式打开 xlsx，校验表头后返回按块产出记录列表的迭代器
+    skip_rows 为跳过的数据行数（不含表头、空行），用于从检查点续传
+
+    Raises:
+        MissingHeadersError: 缺少必需表头
+    """
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        positions = _header_positions(next(rows, None))
+    except Exception:
+        workbook.close()
+        raise
+    return _iter_row_chunks(rows, positions, chunk_size, skip_rows, workbook.close)
+
+
+def read_xls(stream, chunk_size=CHUNK_SIZE, skip_rows=0):
+    """旧版 .xls 无法流式读取，仍通过 pandas 一次性读入，文本列按字符串读取"""
+    text_headers = [name for name, field in REQUIRED_HEADERS.items() if field in TEXT_FIELDS]
+    df = pd.read_excel(stream, dtype=dict.fromkeys(text_headers, str))
+    _header_positions(df.columns)
+    df = df.dropna(how="all").iloc[skip_rows:]
+    df = normalize_frame(df[list(REQUIRED_HEADERS)].rename(columns=REQUIRED_HEADERS))
+    return (frame_to_records(df.iloc[start : start + chunk_size]) for start in range(0, len(df), chunk_size))
+
+
+def _open_text(stream):
+    """以文本方式包装二进制流，返回包装器（读取结束后需要 detach，避免关闭底层流）"""
+    position = stream.tell()
+    encoding = _text_encoding(stream.read(SNIFF_SIZE))
+    stream.seek(position)
+    return io.TextIOWrapper(stream, encoding=encoding, newline="")
+
+
+def read_delimited(stream, chunk_size=CHUNK_SIZE, skip_rows=0, delimiter=","):
+    """
+    用 csv 模块逐行读取 csv/tsv，所有单元格都是字符串，商品ID等文本字段保留前导零
+
+    Raises:
+        MissingHeadersError: 缺少必需表头
+    """
+    text = _open_text(stream)
+    try:
+        reader = csv.reader(text, delimiter=delimiter)
+        positions = _header_positions(next(reader, None))
+    except Exception:
+        text.detach()
+        raise
+    return _iter_row_chunks(reader, positions, chunk_size, skip_rows, text.detach)
+
+
+def _jsonl_objects(text):
+    """
+    逐行解析 JSON Lines，跳过空行
+
+    Raises:
+        UnsupportedFormatError: 某一行不是合法的 JSON 对象
+    """
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            raise UnsupportedFormatError(f"JSON Lines line {number} is not valid JSON: {e}") from e
+        if not isinstance(obj, dict):
+            raise UnsupportedFormatError(f"JSON Lines line {number} is not a JSON object.")
+        yield obj
+
+
+def read_jsonl(stream, chunk_size=CHUNK_SIZE, skip_rows=0):
+    """
+    逐行读取 JSON Lines，每行一个以中文表头为键的对象，以第一行对象的键校验表头
+
+    Raises:
+        MissingHeadersError: 缺少必需表头
+        UnsupportedFormatError: 某一行不是 JSON 对象（之后的行在读取对应的块时才会发现）
+    """
+    text = _open_text(stream)
+    try:
+        objects = _jsonl_objects(text)
+        first = next(objects, None)
+        _header_positions(None if first is None else list(first))
+    except Exception:
+        text.detach()
+        raise
+    rows = ([obj.get(name) for name in REQUIRED_HEADERS] for obj in chain([first], objects))
+    positions = {field: index for index, field in enumerate(REQUIRED_HEADERS.values())}
+    return _iter_row_chunks(rows, positions, chunk_size, skip_rows, text.detach)
+
+
+def _iter_parquet_chunks(parquet_file, chunk_size, skip_rows):
+    try:
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(REQUIRED_HEADERS)):
+            df = batch.to_pandas().dropna(how="all")
+            if skip_rows:
+                skipped = min(skip_rows, len(df))
+                df = df.iloc[skipped:]
+                skip_rows -= skipped
+            if len(df):
+                yield frame_to_records(normalize_frame(df.rename(columns=REQUIRED_HEADERS)))
+    finally:
+        parquet_file.close()
+
+
+def _open_parquet(stream):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise UnsupportedFormatError(
+            "Parquet uploads require pyarrow, install the 'parquet' extra (pip install 'taobaoutils[parquet]')."
+        ) from e
+    return pq.ParquetFile(stream)
+
+
+def read_parquet(stream, chunk_size=CHUNK_SIZE, skip_rows=0):
+    """
+    按 row group 分批读取 parquet，只读取必需的列，需要安装 pyarrow
+
+    Raises:
+        MissingHeadersError: 缺少必需表头
+        UnsupportedFormatError: 未安装 pyarrow
+    """
+    parquet_file = _open_parquet(stream)
+    try:
+        _header_positions(parquet_file.schema_arrow.names)
+    except Exception:
+        parquet_file.close()
+        raise
+    return _iter_parquet_chunks(parquet_file, chunk_size, skip_rows)
+
+
+READERS = {
+    "xlsx": read_xlsx,
+    "xls": read_xls,
+    "csv": read_delimited,
+    "tsv": partial(read_delimited, delimiter="\t"),
+    "jsonl": read_jsonl,
+    "parquet": read_parquet,
+}
+
+
+def _xlsx_header(stream):
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        return next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), None)
+    finally:
+        workbook.close()
+
+
+def _delimited_header(stream, delimiter=","):
+    text = _open_text(stream)
+    try:
+        return next(csv.reader(text, delimiter=delimiter), None)
+    finally:
+        text.detach()
+
+
+def _jsonl_header(stream):
+    text = _open_text(stream)
+    try:
+        first = next(_jsonl_objects(text), None)
+        return None if first is None else list(first)
+    finally:
+        text.detach()
+
+
+def _parquet_header(stream):
+    parquet_file = _open_parquet(stream)
+    try:
+        return parquet_file.schema_arrow.names
+    finally:
+        parquet_file.close()
+
+
+# 只读取表头行的解析器；.xls 只能整份读入，没有对应的表头解析器
+HEADER_READERS = {
+    "xlsx": _xlsx_header,
+    "csv": _delimited_header,
+    "tsv": partial(_delimited_header, delimiter="\t"),
+    "jsonl": _jsonl_header,
+    "parquet": _parquet_header,
+}
+
+
+def check_headers(stream, filename):
+    """
+    只读取表头行校验格式和表头，读取后关闭文件并把流恢复到原来的位置，用于后台导入前快速拒绝错误的文件。
+    .xls 无法只读取表头，这里不校验，由导入时的 read_xls 校验
+
+    Returns:
+        str: 文件格式
+
+    Raises:
+        UnsupportedFormatError: 文件格式不受支持
+        MissingHeadersError: 缺少必需表头
+    """
+    file_format = detect_format(stream, filename)
+    header_reader = HEADER_READERS.get(file_format)
+    if header_reader is not None:
+        position = stream.tell()
+        try:
+            _header_positions(header_reader(stream))
+        finally:
+            stream.seek(position)
+    return file_format
+
+
+def read_listing_chunks(stream, filename, chunk_size=CHUNK_SIZE, skip_rows=0):
+    """
+    判断文件格式并选择解析器，返回按块产出 ProductListing 字段字典列表的迭代器
+
+    Raises:
+        UnsupportedFormatError: 文件格式不受支持
+        MissingHeadersError: 缺少必需表头
+    """
+    return READERS[detect_format(stream, filename)](stream, chunk_size, skip_rows)
+
+
+def iter_chunks(iterable, size=CHUNK_SIZE):
+    """把迭代器切分成长度不超过 size 的列表"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,139 @@
+"""
+轻量级数据库升级
+
+项目没有引入 Alembic，``db.create_all()`` 只会创建缺失的表，不会给已经存在的表补充新列和索引。
+``upgrade_schema`` 挂在 metadata 的 ``after_create`` 事件上，每次 ``create_all`` 之后执行，
+所有步骤都是幂等的，旧数据库在下次启动时即可自动升级。
+"""
+
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import bindparam, inspect, select, sql
+
+from taobaoutils import logger
+
+# 旧数据中缺失的 send_time 回填为该值
+LEGACY_SEND_TIME = datetime(1970, 1, 1)
+
+
+def _add_missing_columns(connection, metadata):
+    """为已存在的表补充模型中新增的列（统一以可空列的形式添加，标量默认值同时作为列默认值回填旧行）"""
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if column.default is not None and column.default.is_scalar and isinstance(column.default.arg, int | float):
+                ddl += f" DEFAULT {column.default.arg!r}"
+            connection.exec_driver_sql(ddl)
+            logger.info("数据库升级：为表 %s 添加列 %s", table.name, column.name)
+
+
+def _backfill_api_token_hashes(connection, metadata):
+    """为旧的 api_tokens 记录补齐 token_hash"""
+    from taobaoutils.models import APIToken
+
+    table = metadata.tables["api_tokens"]
+    rows = connection.execute(select(table.c.id, table.c.token).where(table.c.token_hash.is_(None))).all()
+    for token_id, token in rows:
+        connection.execute(table.update().where(table.c.id == token_id).values(token_hash=APIToken.hash_token(token)))
+    if rows:
+        logger.info("数据库升级：为 %d 个 API Token 回填 token_hash", len(rows))
+
+
+def _backfill_listing_send_time(connection, metadata):
+    """
+    把旧的 product_listings 中为空的 send_time 回填为 1970-01-01
+
+    商品列表按 (send_time, id) 分页，空值无法编码到游标中，元组比较也会跳过它们。
+    已存在的表无法在 SQLite 中改为 NOT NULL，新写入的行总是带有 send_time。
+    回填值早于所有真实的发送时间，这些行仍然排在倒序列表的最后，与之前空值的顺序一致。
+    """
+    table = metadata.tables["product_listings"]
+    if not inspect(connection).has_table(table.name):
+        return
+    backfilled = connection.execute(
+        table.update().where(table.c.send_time.is_(None)).values(send_time=LEGACY_SEND_TIME)
+    ).rowcount
+    if backfilled:
+        logger.info("数据库升级：为 %d 条商品回填 send_time", backfilled)
+
+
+def _move_response_content(connection, metadata, batch_size=1000):
+    """
+    把 product_listings 中旧的响应内容列（文本列 response_content，或压缩二进制列 response_body）
+    按批写入按内容寻址的 responses 表并设置 response_id，完成后删除旧列（SQLite 3.35 之前不支持 DROP COLUMN，改为清空）
+    """
+    from taobaoutils.models import ResponseBody
+    from taobaoutils.storage import decode_text
+
+    inspector = inspect(connection)
+    if not inspector.has_table("product_listings"):
+        return
+    existing = {column["name"] for column in inspector.get_columns("product_listings")}
+    table = metadata.tables["product_listings"]
+    statement = table.update().where(table.c.id == bindparam("row_id")).values(response_id=bindparam("response_id"))
+
+    for name in ("response_content", "response_body"):
+        if name not in existing:
+            continue
+        legacy = sql.table("product_listings", sql.column("id"), sql.column(name))
+        last_id = 0
+        moved = 0
+        while True:
+            rows = connection.execute(
+                select(legacy.c.id, legacy.c[name])
+                .where(legacy.c.id > last_id, legacy.c[name].is_not(None))
+                .order_by(legacy.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            texts = {row_id: decode_text(value) for row_id, value in rows}
+            response_ids = ResponseBody.intern(texts.values(), connection)
+            connection.execute(
+                statement, [{"row_id": row_id, "response_id": response_ids[text]} for row_id, text in texts.items()]
+            )
+            last_id = rows[-1][0]
+            moved += len(rows)
+
+        if connection.dialect.name == "sqlite" and sqlite3.sqlite_version_info < (3, 35):
+            connection.execute(legacy.update().values({name: None}))
+        else:
+            connection.exec_driver_sql(f"ALTER TABLE product_listings DROP COLUMN {name}")
+        logger.info("数据库升级：把 %d 条 %s 迁移到 responses 表", moved, name)
+
+
+def _create_missing_indexes(connection, metadata):
+    """创建模型中声明但数据库中缺失的索引"""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+# 数据迁移步骤，按顺序执行
+DATA_MIGRATIONS = [
+    _backfill_api_token_hashes,
+    _backfill_listing_send_time,
+    _move_response_content,
+]
+
+
+def upgrade_schema(metadata, connection, **kwargs):
+    """
+    在 create_all 之后执行的升级入口
+
+    Args:
+        metadata: 触发事件的 MetaData
+        connection: create_all 使用的数据库连接
+    """
+    _add_missing_columns(connection, metadata)
+    for migration in DATA_MIGRATIONS:
+        migration(connection, metadata)
+    _create_missing_indexes(connection, metadata)
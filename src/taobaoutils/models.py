@@ -1,10 +1,17 @@
+import hashlib
 import json
 import secrets
+import uuid
 from datetime import UTC, datetime, timedelta
 
 from flask_praetorian import SQLAlchemyUserMixin
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 
+from taobaoutils import storage
 from taobaoutils.app import db, guard
+from taobaoutils.storage import CompressedText
+from taobaoutils.templates import LISTING_FIELDS, template_cache
 
 
 class User(db.Model, SQLAlchemyUserMixin):
@@ -116,14 +123,27 @@ class ProductListing(db.Model):
     """产品列表模型"""
 
     __tablename__ = "product_listings"  # Renamed table
+    __table_args__ = (
+        # 上传去重：按块用 IN 查询已存在的商品ID/商品链接
+        db.Index("ix_product_listings_dedupe_product_id", "user_id", "request_config_id", "product_id"),
+        db.Index("ix_product_listings_dedupe_product_link", "user_id", "request_config_id", "product_link"),
+        # 商品列表按 (send_time, id) 倒序分页；以 user_id 开头，同时用于 user_id 外键的查找和级联删除
+        db.Index("ix_product_listings_user_send_time", "user_id", "send_time", "id"),
+        # 按状态过滤后分页：常用来查找发送失败或尚未发送的商品，没有匹配行时不需要扫描用户的全部商品。
+        # 按请求配置、响应码过滤时沿用上面的索引并逐行过滤，单独建索引会明显降低导入的插入速度
+        db.Index("ix_product_listings_user_status", "user_id", "status", "send_time", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     request_config_id = db.Column(db.Integer, db.ForeignKey("request_configs.id"), nullable=False)
     api_token_id = db.Column(db.Integer, db.ForeignKey("api_tokens.id"), nullable=True)
+    import_job_id = db.Column(db.Integer, db.ForeignKey("import_jobs.id"), nullable=True, index=True)  # 来源导入任务
     status = db.Column(db.String(50), default="pending")
-    send_time = db.Column(db.DateTime, default=datetime.utcnow)
-    response_content = db.Column(db.Text, nullable=True)
+    # 分页游标依赖 send_time，不能为空；旧数据库中的空值在升级时回填（见 migrations._backfill_listing_send_time）
+    send_time = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # 响应内容保存在 responses 表中，相同内容只保存一次，通过 response_content 属性读写
+    response_id = db.Column(db.Integer, db.ForeignKey("responses.id"), nullable=True, index=True)
     response_code = db.Column(db.Integer, nullable=True)
     product_id = db.Column(db.String(255), nullable=True)
     product_link = db.Column(db.Text, nullable=True)
@@ -135,6 +155,8 @@ class ProductListing(db.Model):
 
     request_config = db.relationship("RequestConfig", backref="product_listings", lazy=True)
     api_token = db.relationship("APIToken", backref="product_listings", lazy=True)
+    # 响应内容只在访问时加载，列表查询需要时用 joinedload(ProductListing.response)
+    response = db.relationship("ResponseBody", lazy="select")
 
     def __init__(
         self,
@@ -150,10 +172,12 @@ class ProductListing(db.Model):
         stock=None,
         listing_code=None,
         api_token_id=None,
+        import_job_id=None,
     ):
         self.user_id = user_id
         self.request_config_id = request_config_id
         self.api_token_id = api_token_id
+        self.import_job_id = import_job_id
         self.status = status
         self.send_time = send_time or datetime.now(UTC)
         self.response_content = response_content
@@ -167,22 +191,101 @@ class ProductListing(db.Model):
     def __repr__(self):
         return f"<ProductListing {self.id} - {self.product_id or self.product_link}>"  # Updated to use product_link
 
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "status": self.status,
-            "send_time": self.send_time.isoformat() if self.send_time else None,
-            "response_content": self.response_content,
-            "response_code": self.response_code,
-            "product_id": self.product_id,
-            "product_link": self.product_link,
-            "title": self.title,
-            "stock": self.stock,
-            "listing_code": self.listing_code,  # 上架编码
-            "user_id": self.user_id,
-            "request_config_id": self.request_config_id,
-            "api_token_id": self.api_token_id,
-        }
+    @property
+    def response_content(self):
+        """响应内容（文本）"""
+        return self.response.content if self.response is not None else None
+
+    @response_content.setter
+    def response_content(self, text):
+        if text is None:
+            self.response = None
+        else:
+            self.response = db.session.get(ResponseBody, ResponseBody.intern([text])[text])
+
+    # to_dict 输出的字段，也是列表接口 ?fields= 可以选择的字段
+    DICT_FIELDS = LISTING_FIELDS
+
+    def to_dict(self, fields=None):
+        """
+        Args:
+            fields: 只输出这些字段（DICT_FIELDS 的子集），默认输出全部；未选择的字段不会被访问，不会触发加载
+        """
+        data = {field: getattr(self, field) for field in fields or self.DICT_FIELDS}
+        if data.get("send_time") is not None:
+            data["send_time"] = data["send_time"].isoformat()
+        return data
+
+
+def _insert_ignoring_conflicts(table, dialect_name):
+    """插入时跳过唯一键冲突的行（并发写入相同内容时只保留一行）"""
+    if dialect_name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name in ("mysql", "mariadb"):
+        return insert(table).prefix_with("IGNORE")
+    return insert(table)
+
+
+class ResponseBody(db.Model):
+    """
+    按内容寻址的响应内容
+
+    大部分回调的响应是相同的几种成功/失败内容，以内容的 SHA-256 摘要为唯一键只保存一次，
+    ProductListing 通过 response_id 引用；内容本身按 [storage] 配置压缩保存。
+    """
+
+    __tablename__ = "responses"
+
+    id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(64), nullable=False, unique=True)  # 内容（截断后）的 SHA-256 摘要
+    content = db.Column(CompressedText, nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # 未压缩的 UTF-8 字节数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ResponseBody {self.id} - {self.hash[:12]}>"
+
+    @staticmethod
+    def hash_content(text):
+        """计算保存的内容的SHA-256摘要，超过 RESPONSE_MAX_BYTES 的内容按截断后的文本计算"""
+        return hashlib.sha256(storage.truncate_text(text, storage.RESPONSE_MAX_BYTES).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def intern(cls, texts, connection=None):
+        """
+        保存响应内容，已存在的内容不重复写入；不提交，调用方与引用它的listing一起提交
+
+        Args:
+            texts: 响应内容（文本）
+            connection: 使用的数据库连接，默认使用当前session的连接
+
+        Returns:
+            dict: 文本 -> 响应ID
+        """
+        connection = connection if connection is not None else db.session.connection()
+        digests = {text: cls.hash_content(text) for text in set(texts)}
+        if not digests:
+            return {}
+        table = cls.__table__
+        ids = dict(connection.execute(select(table.c.hash, table.c.id).where(table.c.hash.in_(digests.values()))).all())
+        missing = {digest: text for text, digest in digests.items() if digest not in ids}
+        if missing:
+            connection.execute(
+                _insert_ignoring_conflicts(table, connection.dialect.name),
+                [
+                    {
+                        "hash": digest,
+                        "content": text,
+                        "size": len(storage.truncate_text(text, storage.RESPONSE_MAX_BYTES).encode("utf-8")),
+                        "created_at": datetime.utcnow(),
+                    }
+                    for digest, text in missing.items()
+                ],
+            )
+            ids.update(connection.execute(select(table.c.hash, table.c.id).where(table.c.hash.in_(missing))).all())
+        return {text: ids[digest] for text, digest in digests.items()}
 
 
 class RequestConfig(db.Model):
@@ -202,6 +305,9 @@ class RequestConfig(db.Model):
     request_interval_minutes = db.Column(db.Integer, default=8, nullable=True)
     random_min = db.Column(db.Integer, default=2, nullable=True)
     random_max = db.Column(db.Integer, default=15, nullable=True)
+    updated_at = db.Column(
+        db.DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC)
+    )  # 作为编译模板缓存的版本
 
     user = db.relationship("User", backref="request_configs", lazy=True)
 
@@ -232,22 +338,18 @@ class RequestConfig(db.Model):
     def __repr__(self):
         return f"<RequestConfig {self.id} - {self.name}>"
 
+    def compiled_body(self):
+        """返回编译后的body模板，按 (id, updated_at) 缓存"""
+        return template_cache.get(self.id, self.updated_at, self.body)
+
     def generate_body(self, product):
         """
         根据ProductListing对象生成具体的请求体
+        模板只编译一次，字段值直接放入JSON树，不需要转义
         """
         if not self.body:
             return {}
-
-        template_str = self.body
-        # Use to_dict() to get product attributes
-        params = product.to_dict()
-
-        for key, value in params.items():
-            val_str = str(value) if value is not None else ""
-            template_str = template_str.replace(f"{{{key}}}", val_str)
-
-        return json.loads(template_str)
+        return self.compiled_body().render_object(product)
 
     def to_dict(self):
         body_obj = None
@@ -287,6 +389,7 @@ class APIToken(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     name = db.Column(db.String(255), nullable=False)
     token = db.Column(db.String(255), unique=True, nullable=False)  # 存储原始token
+    token_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)  # token的SHA-256摘要，用于索引查找
     scopes = db.Column(db.Text, nullable=True)  # JSON list of scopes
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=True)
@@ -301,6 +404,27 @@ class APIToken(db.Model):
     def __repr__(self):
         return f"<APIToken {self.name}>"
 
+    @staticmethod
+    def hash_token(token):
+        """计算token的SHA-256摘要（十六进制），用作索引查找键"""
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def find_by_token(cls, token):
+        """
+        通过摘要索引查找并验证token
+
+        Args:
+            token: 请求中携带的原始token字符串
+
+        Returns:
+            APIToken | None: 有效的token对象，无效或不存在时返回None
+        """
+        api_token = cls.query.filter_by(token_hash=cls.hash_token(token)).first()
+        if api_token and api_token.verify_token(token):
+            return api_token
+        return None
+
     @classmethod
     def create_token(cls, user_id, name, scopes=None, expires_days=None):
         """
@@ -330,6 +454,7 @@ class APIToken(db.Model):
         # 创建token记录 - 直接存储明文token
         token = APIToken(
             token=token_bytes,
+            token_hash=cls.hash_token(token_bytes),
             name=name,
             user_id=user_id,
             scopes=json.dumps(scopes) if scopes else None,
@@ -389,3 +514,243 @@ class APIToken(db.Model):
             "last_used_at": self.last_used_at.isoformat() if self.last_used_at else None,
             "is_active": self.is_active,
         }
+
+
+class ImportJobLeaseLostError(RuntimeError):
+    """导入任务已被重新上传的请求接管，当前执行者应停止"""
+
+
+class ImportJob(db.Model):
+    """上传导入任务，记录文件导入的状态和进度"""
+
+    __tablename__ = "import_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    request_config_id = db.Column(db.Integer, db.ForeignKey("request_configs.id"), nullable=False)
+    api_token_id = db.Column(db.Integer, db.ForeignKey("api_tokens.id"), nullable=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_hash = db.Column(db.String(64), nullable=True, index=True)  # 文件内容的SHA-256，用于识别重新上传的同一文件
+    # queued/running/queued_for_dispatch/completed/failed
+    # queued_for_dispatch：outbox 模式下已导入，发件箱中还有待发送的条目
+    status = db.Column(db.String(20), default="queued", nullable=False)
+    rows_parsed = db.Column(db.Integer, default=0, nullable=False)
+    rows_inserted = db.Column(db.Integer, default=0, nullable=False)
+    rows_dispatched = db.Column(db.Integer, default=0, nullable=False)
+    rows_failed = db.Column(db.Integer, default=0, nullable=False)
+    checkpoint_row = db.Column(db.Integer, default=0, nullable=False)  # 已提交的数据行数，续传时跳过这些行
+    dedupe_key = db.Column(db.String(20), nullable=True)  # 去重字段：product_id/product_link，为空时不去重
+    rows_skipped = db.Column(db.Integer, default=0, nullable=False)  # 因重复而跳过的行数
+    error = db.Column(db.Text, nullable=True)
+    lease_id = db.Column(db.String(32), nullable=True)  # 当前执行者的租约，任务被续传接管后旧执行者不能再提交
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # 执行者每次提交时更新，长时间未更新视为执行者已退出
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(
+        self,
+        user_id,
+        request_config_id,
+        filename,
+        api_token_id=None,
+        file_hash=None,
+        dedupe_key=None,
+        status="queued",
+    ):
+        self.user_id = user_id
+        self.request_config_id = request_config_id
+        self.api_token_id = api_token_id
+        self.filename = filename
+        self.file_hash = file_hash
+        self.dedupe_key = dedupe_key
+        self.status = status
+        self.rows_parsed = 0
+        self.rows_inserted = 0
+        self.rows_dispatched = 0
+        self.rows_failed = 0
+        self.checkpoint_row = 0
+        self.rows_skipped = 0
+        self.lease_id = uuid.uuid4().hex
+        self.heartbeat_at = datetime.utcnow()
+
+    def __repr__(self):
+        return f"<ImportJob {self.id} - {self.status}>"
+
+    @classmethod
+    def resumable(cls, stale_before):
+        """
+        可以从检查点续传的任务：已失败的，以及 queued/running 但心跳早于 stale_before 的
+        （执行者所在进程崩溃或被杀死，任务不会再被标记为失败）
+        """
+        last_seen = func.coalesce(cls.heartbeat_at, cls.started_at, cls.created_at)
+        return or_(cls.status == "failed", and_(cls.status.in_(("queued", "running")), last_seen < stale_before))
+
+    def take_over(self, stale_before):
+        """
+        以新的租约接管可续传的任务并提交，之后旧执行者的 renew_lease 会失败，不会再提交新的块
+
+        Returns:
+            str: 新的租约；任务已被其他请求接管或执行者仍然存活时返回None
+        """
+        lease_id = uuid.uuid4().hex
+        taken = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == self.id, ImportJob.resumable(stale_before))
+            .values(lease_id=lease_id, status="queued", heartbeat_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if not taken:
+            return None
+        db.session.refresh(self)  # 检查点以接管之后的为准
+        return lease_id
+
+    def renew_lease(self, lease_id):
+        """
+        在提交前调用：确认任务仍由 lease_id 执行并更新心跳
+
+        Raises:
+            ImportJobLeaseLostError: 任务已被续传接管，调用方应回滚本次要提交的内容
+        """
+        renewed = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == self.id, ImportJob.lease_id == lease_id)
+            .values(heartbeat_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not renewed:
+            raise ImportJobLeaseLostError(f"Import job {self.id} was taken over by another upload")
+
+    def fail(self, lease_id, error):
+        """
+        以 lease_id 的身份把任务标记为失败，不提交
+
+        任务已被续传接管时不修改，避免旧执行者迟到的失败覆盖接管者正在执行的任务。
+
+        Returns:
+            bool: 是否标记成功
+        """
+        return bool(
+            db.session.execute(
+                update(ImportJob)
+                .where(ImportJob.id == self.id, ImportJob.lease_id == lease_id)
+                .values(status="failed", error=str(error), finished_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        )
+
+    @classmethod
+    def complete_dispatched(cls, job_ids):
+        """
+        把发件箱中已没有 pending 条目的 queued_for_dispatch 任务标记为完成，不提交
+        （dead 条目不再发送，已计入 rows_failed）
+
+        Returns:
+            int: 标记为完成的任务数量
+        """
+        job_ids = [job_id for job_id in job_ids if job_id is not None]
+        if not job_ids:
+            return 0
+        pending = (
+            select(OutboxEntry.id)
+            .join(ProductListing, ProductListing.id == OutboxEntry.listing_id)
+            .where(ProductListing.import_job_id == cls.id, OutboxEntry.status == "pending")
+        )
+        return db.session.execute(
+            update(cls)
+            .where(cls.id.in_(job_ids), cls.status == "queued_for_dispatch", ~pending.exists())
+            .values(status="completed", finished_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "request_config_id": self.request_config_id,
+            "api_token_id": self.api_token_id,
+            "filename": self.filename,
+            "status": self.status,
+            "rows_parsed": self.rows_parsed,
+            "rows_inserted": self.rows_inserted,
+            "rows_dispatched": self.rows_dispatched,
+            "rows_failed": self.rows_failed,
+            "checkpoint_row": self.checkpoint_row,
+            "dedupe_key": self.dedupe_key,
+            "rows_skipped": self.rows_skipped,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class OutboxEntry(db.Model):
+    """
+    待发送到scheduler的listing（事务性发件箱）
+
+    条目与listing在同一事务中写入，由 OutboxDispatcher 租约领取后批量发送：发送成功即删除，
+    失败时按指数退避推迟 available_at，超过最大重试次数后标记为 dead。
+    """
+
+    __tablename__ = "dispatch_outbox"
+    __table_args__ = (
+        # 领取条目：status = 'pending' AND available_at <= now
+        db.Index("ix_dispatch_outbox_ready", "status", "available_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    listing_id = db.Column(db.Integer, db.ForeignKey("product_listings.id"), nullable=False, unique=True)
+    status = db.Column(db.String(20), default="pending", nullable=False)  # pending/dead
+    attempts = db.Column(db.Integer, default=0, nullable=False)  # 已失败的发送次数
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # 最早可以再次发送的时间
+    lease_id = db.Column(db.String(64), nullable=True, index=True)  # 当前持有租约的领取批次
+    leased_until = db.Column(db.DateTime, nullable=True)  # 租约到期时间，到期未确认的条目可被重新领取
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<OutboxEntry {self.listing_id} - {self.status}>"
+
+    @classmethod
+    def enqueue(cls, listing_ids):
+        """
+        把listing加入发件箱，不提交，调用方与listing的写入一起提交
+
+        已有的条目（包括 dead）重置为立即可发送，租约未到期的条目保持不变；其余新建条目。
+
+        Returns:
+            int: 新建或重置的条目数量
+        """
+        if not listing_ids:
+            return 0
+        now = datetime.utcnow()
+        existing = set(db.session.execute(select(cls.listing_id).where(cls.listing_id.in_(listing_ids))).scalars())
+        reset = 0
+        if existing:
+            reset = db.session.execute(
+                update(cls)
+                .where(
+                    cls.listing_id.in_(existing),
+                    or_(cls.leased_until.is_(None), cls.leased_until < now),
+                )
+                .values(status="pending", attempts=0, available_at=now, lease_id=None, leased_until=None)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        new_ids = [listing_id for listing_id in dict.fromkeys(listing_ids) if listing_id not in existing]
+        if new_ids:
+            db.session.execute(
+                insert(cls.__table__), [{"listing_id": listing_id, "available_at": now} for listing_id in new_ids]
+            )
+        return reset + len(new_ids)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "listing_id": self.listing_id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "available_at": self.available_at.isoformat() if self.available_at else None,
+            "leased_until": self.leased_until.isoformat() if self.leased_until else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
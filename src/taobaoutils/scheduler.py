@@ -0,0 +1,567 @@
+"""
+scheduler 服务的HTTP客户端
+
+进程内共享一个 requests.Session，连接按主机放在 HTTPAdapter 的连接池中并保持 keep-alive，
+单条任务、批量任务和 utils.send_request 都通过它发送，不再每次请求都重新建立 TCP/TLS 连接。
+
+每个主机有一个熔断器：连续失败（包括超过 slow_call_seconds 的慢请求）达到阈值后打开，
+打开期间请求直接抛出 CircuitOpenError 而不占用工作线程等待超时；reset_timeout 秒后进入半开状态，
+放行一个探测请求，成功则关闭，失败则重新打开。读取超时根据每个接口最近请求耗时的 p99 自适应调整，
+不超过调用方给出的上限；批量任务接口默认不自适应（见 BATCH_ADAPTIVE_TIMEOUT）。
+
+批量任务的请求体可以按配置用 gzip 或 zstd 压缩（Content-Encoding），zstd 需要安装 zstandard（zstd 可选依赖）。
+
+send_batch_tasks 把一批listing序列化成scheduler任务，分块并发POST到批量接口，
+上传导入（api.resources）和发件箱调度器（dispatcher）都通过它发送。
+"""
+
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from taobaoutils import config_data, logger
+from taobaoutils.templates import json_column, text_column
+
+CONTENT_ENCODINGS = ("identity", "gzip", "zstd")
+
+
+def _zstd_compressor(level):
+    """zstd 压缩器，未安装 zstandard 时返回None"""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard.ZstdCompressor(level=level or 3)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """熔断器打开期间直接拒绝请求（是 RequestException 的子类，调用方按发送失败处理）"""
+
+
+class CircuitBreaker:
+    """
+    连续失败熔断器
+
+    Args:
+        failure_threshold: 连续失败多少次后打开
+        slow_call_seconds: 耗时超过该值的成功请求也计为失败，None 表示不按耗时判断
+        reset_timeout: 打开后经过多少秒进入半开状态
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, slow_call_seconds=None, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._times_opened = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probing = False
+        return self._state
+
+    def before_call(self):
+        """
+        请求前检查：打开时拒绝；半开时只放行一个探测请求
+
+        Raises:
+            CircuitOpenError: 熔断器打开，或半开状态下已有探测请求在进行
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN or (state == self.HALF_OPEN and self._probing):
+                self._rejected += 1
+                raise CircuitOpenError("Circuit breaker is open")
+            if state == self.HALF_OPEN:
+                self._probing = True
+
+    def record_success(self, elapsed):
+        """记录一次成功的请求，耗时过长时按失败处理"""
+        if self.slow_call_seconds is not None and elapsed > self.slow_call_seconds:
+            self.record_failure()
+            return
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._times_opened += 1
+
+    def snapshot(self):
+        """用于监控的状态快照"""
+        with self._lock:
+            state = self._current_state()
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+                "rejected": self._rejected,
+                "retry_in": (
+                    max(0.0, self.reset_timeout - (self._clock() - self._opened_at)) if state == self.OPEN else None
+                ),
+            }
+
+
+class LatencyWindow:
+    """最近 size 次请求耗时的滑动窗口"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        """最近耗时的 q 分位数（0-100，取最近秩），没有样本时返回None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[max(0, math.ceil(q / 100 * len(samples)) - 1)]
+
+
+class SchedulerClient:
+    """
+    带连接池的HTTP客户端
+
+    Session 在第一次使用时创建；进程 fork 后（例如 gunicorn 的 preload）会在子进程中重新创建，
+    避免父子进程共用同一个socket。只对建立连接失败的情况重试，请求发出后不会重复POST。
+
+    adaptive_timeout 开启后，某个接口积累 min_samples 个样本后读取超时取
+    clamp(p99 * timeout_factor, min_read_timeout, 上限)。
+
+    content_encoding 为 gzip/zstd 时，post(compress=True) 且请求体不小于 compress_min_bytes 的请求会被压缩；
+    配置为 zstd 但未安装 zstandard 时退回 gzip。
+    """
+
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=32,
+        connect_timeout=5,
+        read_timeout=30,
+        connect_retries=2,
+        failure_threshold=5,
+        slow_call_seconds=None,
+        reset_timeout=30,
+        adaptive_timeout=True,
+        timeout_factor=3,
+        min_read_timeout=1,
+        min_samples=20,
+        latency_window=200,
+        content_encoding="identity",
+        compress_min_bytes=1024,
+        compress_level=None,
+    ):
+        if content_encoding not in CONTENT_ENCODINGS:
+            raise ValueError(f"Unsupported content encoding: {content_encoding}. Supported: {CONTENT_ENCODINGS}")
+        if content_encoding == "zstd" and _zstd_compressor(compress_level) is None:
+            logger.warning("zstandard is not installed, scheduler payloads will be compressed with gzip instead.")
+            content_encoding = "gzip"
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.connect_retries = connect_retries
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.adaptive_timeout = adaptive_timeout
+        self.timeout_factor = timeout_factor
+        self.min_read_timeout = min_read_timeout
+        self.min_samples = min_samples
+        self.latency_window = latency_window
+        self.content_encoding = content_encoding
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self._breakers = {}  # 主机 -> 熔断器
+        self._latencies = {}  # 接口URL -> 耗时窗口
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, scheduler_config):
+        """根据 config.toml 的 [scheduler] 配置创建客户端"""
+        return cls(
+            pool_connections=scheduler_config.get("POOL_CONNECTIONS", 10),
+            pool_maxsize=scheduler_config.get("POOL_MAXSIZE", 32),
+            connect_timeout=scheduler_config.get("CONNECT_TIMEOUT", 5),
+            read_timeout=scheduler_config.get("READ_TIMEOUT", 30),
+            connect_retries=scheduler_config.get("CONNECT_RETRIES", 2),
+            failure_threshold=scheduler_config.get("BREAKER_FAILURE_THRESHOLD", 5),
+            slow_call_seconds=scheduler_config.get("BREAKER_SLOW_CALL_SECONDS"),
+            reset_timeout=scheduler_config.get("BREAKER_RESET_TIMEOUT", 30),
+            adaptive_timeout=scheduler_config.get("ADAPTIVE_TIMEOUT", True),
+            timeout_factor=scheduler_config.get("ADAPTIVE_TIMEOUT_FACTOR", 3),
+            min_read_timeout=scheduler_config.get("MIN_READ_TIMEOUT", 1),
+            min_samples=scheduler_config.get("ADAPTIVE_TIMEOUT_MIN_SAMPLES", 20),
+            latency_window=scheduler_config.get("LATENCY_WINDOW", 200),
+            content_encoding=scheduler_config.get("CONTENT_ENCODING", "identity"),
+            compress_min_bytes=scheduler_config.get("COMPRESS_MIN_BYTES", 1024),
+            compress_level=scheduler_config.get("COMPRESS_LEVEL"),
+        )
+
+    def breaker(self, url):
+        """url 所在主机的熔断器"""
+        host = urlsplit(url).netloc
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    host, CircuitBreaker(self.failure_threshold, self.slow_call_seconds, self.reset_timeout)
+                )
+        return breaker
+
+    def _latency_window(self, url):
+        window = self._latencies.get(url)
+        if window is None:
+            with self._lock:
+                window = self._latencies.setdefault(url, LatencyWindow(self.latency_window))
+        return window
+
+    def read_timeout_for(self, url, limit=None, adaptive=True):
+        """
+        url 的读取超时：样本不足时为上限，否则按最近耗时的 p99 自适应
+
+        Args:
+            url: 请求地址
+            limit: 超时上限（秒），默认使用客户端配置的 read_timeout
+            adaptive: 为 False 时固定使用上限
+        """
+        limit = limit or self.read_timeout
+        window = self._latencies.get(url)
+        if not (self.adaptive_timeout and adaptive) or window is None or len(window) < self.min_samples:
+            return limit
+        return min(limit, max(self.min_read_timeout, window.percentile(99) * self.timeout_factor))
+
+    def _create_session(self):
+        session = requests.Session()
+        retry = Retry(total=self.connect_retries, connect=self.connect_retries, read=0, status=0, backoff_factor=0.1)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive"
+        return session
+
+    @property
+    def session(self):
+        """当前进程的共享 Session"""
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._create_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def compress(self, data):
+        """
+        按配置的编码压缩请求体
+
+        Returns:
+            tuple: (请求体, Content-Encoding)，不压缩时编码为None
+        """
+        if self.content_encoding == "identity" or len(data) < self.compress_min_bytes:
+            return data, None
+        if self.content_encoding == "zstd":
+            return _zstd_compressor(self.compress_level).compress(data), "zstd"
+        level = 6 if self.compress_level is None else self.compress_level
+        return gzip.compress(data, compresslevel=level), "gzip"
+
+    def post(self, url, read_timeout=None, compress=False, adaptive=True, **kwargs):
+        """
+        通过连接池发送POST请求
+
+        读取超时后请求可能已经被对方处理，调用方重试时会重复提交；
+        非幂等、耗时波动大的请求应传 adaptive=False，固定使用超时上限。
+
+        Args:
+            url: 请求地址
+            read_timeout: 读取超时上限（秒），默认使用客户端配置的 read_timeout
+            compress: 是否按 content_encoding 压缩 data（bytes）
+            adaptive: 是否使用自适应读取超时
+            **kwargs: 透传给 requests.Session.post 的参数（json、data、headers 等）
+
+        Raises:
+            CircuitOpenError: 目标主机的熔断器处于打开状态
+        """
+        breaker = self.breaker(url)
+        breaker.before_call()
+        try:
+            if compress and isinstance(kwargs.get("data"), bytes):
+                kwargs["data"], encoding = self.compress(kwargs["data"])
+                if encoding:
+                    kwargs["headers"] = {**(kwargs.get("headers") or {}), "Content-Encoding": encoding}
+            timeout = (self.connect_timeout, self.read_timeout_for(url, read_timeout, adaptive))
+            started = time.monotonic()
+            try:
+                response = self.session.post(url, timeout=timeout, **kwargs)
+            except requests.exceptions.ReadTimeout:
+                # 超时按超时时间记入样本，持续变慢时自适应超时会随之放宽
+                self._latency_window(url).add(timeout[1])
+                raise
+        except BaseException:
+            # 任何异常（不只是 RequestException）都要记为失败，否则半开状态的探测名额不会释放
+            breaker.record_failure()
+            raise
+
+        elapsed = time.monotonic() - started
+        self._latency_window(url).add(elapsed)
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success(elapsed)
+        return response
+
+    def status(self):
+        """各主机熔断器状态以及各接口的耗时分位数和当前读取超时，用于监控"""
+        return {
+            "breakers": {host: breaker.snapshot() for host, breaker in list(self._breakers.items())},
+            "latency": {
+                url: {
+                    "samples": len(window),
+                    "p50": window.percentile(50),
+                    "p95": window.percentile(95),
+                    "p99": window.percentile(99),
+                    "read_timeout": self.read_timeout_for(url),
+                }
+                for url, window in list(self._latencies.items())
+            },
+        }
+
+    def close(self):
+        """关闭连接池"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+# 进程内共享的客户端
+scheduler_client = SchedulerClient.from_config(config_data.get("scheduler", {}))
+
+# 发送到scheduler时每个批量请求的任务数，以及并发发送的线程数
+DISPATCH_CHUNK_SIZE = config_data.get("scheduler", {}).get("DISPATCH_CHUNK_SIZE", 200)
+dispatch_executor = ThreadPoolExecutor(
+    max_workers=config_data.get("scheduler", {}).get("DISPATCH_WORKERS", 4),
+    thread_name_prefix="tb-dispatch",
+)
+
+# 批量任务的格式：tasks 每个任务都带完整的 header/method 等公共字段；
+# normalized 每批中每组公共字段只发送一次（payload 的 shared），任务通过 "shared" 引用
+PAYLOAD_FORMAT = config_data.get("scheduler", {}).get("PAYLOAD_FORMAT", "tasks")
+
+# 批量POST不是幂等的：读取超时后scheduler可能已经创建了任务，重试会重复发送。
+# 默认固定使用 READ_TIMEOUT，开启后与单条任务一样按 p99 自适应（批量请求耗时波动大时容易误判超时）
+BATCH_ADAPTIVE_TIMEOUT = config_data.get("scheduler", {}).get("BATCH_ADAPTIVE_TIMEOUT", False)
+
+
+class BatchDispatchResult(NamedTuple):
+    """分块发送的结果：发送成功和失败的listing ID"""
+
+    sent_ids: list
+    failed_ids: list
+
+    def __bool__(self):
+        return bool(self.sent_ids) and not self.failed_ids
+
+
+def _parse_header(req_config, parsed_headers):
+    """解析RequestConfig的header，同一批次中相同的header只解析一次"""
+    if req_config.header not in parsed_headers:
+        header = None
+        try:
+            header = json.loads(req_config.header)
+        except json.JSONDecodeError:
+            logger.warning("Failed to parse header for RequestConfig %s", req_config.id)
+        parsed_headers[req_config.header] = header
+    return parsed_headers[req_config.header]
+
+
+def _serialize_batch_tasks(
+    listings, req_config, api_token, scheduler_url, callback_url, parsed_headers, shared_ref=None
+):
+    """
+    把使用同一请求配置和token的一组listing序列化成scheduler任务（UTF-8 JSON bytes）
+
+    请求体由编译后的body模板按列批量渲染；所有任务共用的字段只序列化一次，
+    每行不同的字段（名称、回调ID）同样按列转换后拼接，不逐行调用 json.dumps。
+
+    Args:
+        shared_ref: normalized 格式下公共字段的编号，任务中只写 "shared": 编号，不再内嵌公共字段
+
+    Returns:
+        tuple: (任务 bytes 列表, 公共字段的 JSON bytes)
+    """
+    count = len(listings)
+    if req_config.body:
+        template = req_config.compiled_body()
+        columns = {field: [getattr(listing, field) for listing in listings] for field in template.fields}
+        bodies = template.render_text_batch(columns, count)
+    else:
+        bodies = "{}"
+
+    shared = {
+        "header": _parse_header(req_config, parsed_headers),
+        "method": req_config.method,
+        "request_url": scheduler_url,  # Per user instruction
+        "callback_url": callback_url,
+        "callback_token": api_token.token if api_token else "",  # Get callback token if associated
+        "cron": None,
+    }
+    shared_json = json.dumps(shared, ensure_ascii=False, separators=(",", ":"))
+    envelope = shared_json[1:-1] if shared_ref is None else f'"shared":{shared_ref}'
+    start_time = json.dumps(datetime.utcnow().timestamp())
+
+    names = json_column([listing.title or f"Product {listing.id}" for listing in listings])
+    callback_ids = text_column([listing.id for listing in listings])
+    tasks = (
+        '{"name":'
+        + names
+        + ',"start_time":'
+        + start_time
+        + ',"callback_id":"'
+        + callback_ids
+        + '",'
+        + envelope
+        + ',"body":'
+        + bodies
+        + "}"
+    )
+    return [task.encode("utf-8") for task in tasks], shared_json.encode("utf-8")
+
+
+def _post_batch_tasks(tasks_data, shared=None):
+    """
+    把一块已序列化的任务POST到scheduler的批量接口，在发送线程池中执行，不访问数据库
+    请求体按 scheduler_client 配置的 CONTENT_ENCODING 压缩
+
+    Args:
+        tasks_data: 每个任务的 JSON bytes，直接拼接成 {"tasks_data": [...]}
+        shared: normalized 格式下本块任务引用的公共字段（编号 -> JSON bytes），放在 payload 的 "shared" 中
+    """
+    task_url = config_data["scheduler"]["SCHEDULER_SERVICE_URL"].rstrip("/") + "/add_req_tasks"
+    payload = b'{"tasks_data":[' + b",".join(tasks_data) + b"]}"
+    if shared:
+        entries = b",".join(b'"%d":%s' % (ref, shared_json) for ref, shared_json in shared.items())
+        payload = b'{"shared":{' + entries + b"}," + payload[1:]
+    try:
+        response = scheduler_client.post(
+            task_url,
+            data=payload,
+            headers={"Content-Type": "application/json"},
+            compress=True,
+            adaptive=BATCH_ADAPTIVE_TIMEOUT,
+        )
+        response.raise_for_status()
+        logger.info("Successfully sent batch of %d tasks to scheduler.", len(tasks_data))
+        return True
+    except requests.exceptions.RequestException as e:
+        logger.error("Failed to send batch of %d tasks to scheduler: %s", len(tasks_data), e)
+        return False
+
+
+def send_batch_tasks(product_listings):
+    """
+    Sends a batch of product listing tasks to the scheduler service.
+
+    listing的 request_config、api_token 应已随listing一起加载（见 resources._dispatch_job_listings）。
+    任务在调用线程中按 (请求配置, token) 分组批量序列化（需要访问ORM对象），再按 DISPATCH_CHUNK_SIZE 分块，
+    由发送线程池并发POST。每块的结果单独记录，只有所在块发送成功的listing计入 sent_ids，
+    失败块的listing计入 failed_ids，可以单独重试。
+    """
+    scheduler_url = config_data["scheduler"]["SCHEDULER_SERVICE_URL"]
+    callback_url = config_data.get("scheduler", {}).get("CALLBACK_URL")
+
+    failed_ids = []
+    groups = {}
+    for listing in product_listings:
+        if not listing.request_config:
+            logger.warning("ProductListing %s missing request_config, skipping.", listing.id)
+            failed_ids.append(listing.id)
+            continue
+        groups.setdefault((listing.request_config, listing.api_token), []).append(listing)
+
+    normalized = PAYLOAD_FORMAT == "normalized"
+    listing_ids = []
+    tasks_data = []
+    task_refs = []  # 每个任务引用的公共字段编号
+    shared = {}
+    parsed_headers = {}
+    for ref, ((req_config, api_token), listings) in enumerate(groups.items()):
+        listing_ids.extend(listing.id for listing in listings)
+        tasks, shared[ref] = _serialize_batch_tasks(
+            listings,
+            req_config,
+            api_token,
+            scheduler_url,
+            callback_url,
+            parsed_headers,
+            shared_ref=ref if normalized else None,
+        )
+        tasks_data.extend(tasks)
+        task_refs.extend([ref] * len(tasks))
+
+    if not tasks_data:
+        logger.warning("No valid tasks to send to scheduler.")
+        return BatchDispatchResult([], failed_ids)
+
+    chunks = []
+    for start in range(0, len(tasks_data), DISPATCH_CHUNK_SIZE):
+        end = start + DISPATCH_CHUNK_SIZE
+        chunk_shared = {ref: shared[ref] for ref in dict.fromkeys(task_refs[start:end])} if normalized else None
+        chunks.append((listing_ids[start:end], tasks_data[start:end], chunk_shared))
+    if len(chunks) == 1:
+        # 只有一块时直接在当前线程发送
+        results = [_post_batch_tasks(chunks[0][1], chunks[0][2])]
+    else:
+        results = list(
+            dispatch_executor.map(_post_batch_tasks, [tasks for _, tasks, _ in chunks], [refs for _, _, refs in chunks])
+        )
+
+    sent_ids = []
+    for (chunk_ids, _, _), ok in zip(chunks, results, strict=True):
+        (sent_ids if ok else failed_ids).extend(chunk_ids)
+    return BatchDispatchResult(sent_ids, failed_ids)
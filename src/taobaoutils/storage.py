@@ -0,0 +1,130 @@
+"""
+响应内容的压缩存储
+
+responses 表（ResponseBody.content）中的响应内容（常常是带缩进的 JSON）以二进制列保存，
+第一个字节标记编码方式，其余为数据：
+
+- ``\\x00``：未压缩的 UTF-8 文本（短于 RESPONSE_COMPRESS_MIN_BYTES，压缩没有收益）
+- ``\\x01``：zlib
+- ``\\x02``：zstd（需要安装 zstandard，未安装时写入使用 zlib；已有的 zstd 数据在未安装时无法读取）
+
+CompressedText 列类型在写入时压缩、读取时解压，模型、Core 语句和 to_dict 看到的仍然是 str。
+RESPONSE_MAX_BYTES 大于 0 时，超过该大小（UTF-8 字节）的响应在写入前被截断。
+"""
+
+import zlib
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+from taobaoutils import config_data, logger
+
+RESPONSE_CODECS = ("none", "zlib", "zstd")
+
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+_ZSTD = b"\x02"
+
+# 截断后追加的标记
+TRUNCATED_MARKER = "...[truncated]"
+
+_storage_config = config_data.get("storage", {})
+RESPONSE_COMPRESSION = _storage_config.get("RESPONSE_COMPRESSION", "zlib")
+RESPONSE_COMPRESS_MIN_BYTES = _storage_config.get("RESPONSE_COMPRESS_MIN_BYTES", 64)
+RESPONSE_COMPRESS_LEVEL = _storage_config.get("RESPONSE_COMPRESS_LEVEL", 6)
+RESPONSE_MAX_BYTES = _storage_config.get("RESPONSE_MAX_BYTES", 0)
+
+
+def _zstd():
+    """未安装 zstandard 时返回None"""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _require_zstd():
+    """读写 zstd 数据前调用，未安装 zstandard 时给出明确的错误而不是 AttributeError"""
+    zstandard = _zstd()
+    if zstandard is None:
+        raise RuntimeError(
+            "Response content is compressed with zstd but zstandard is not installed, "
+            "install the 'zstd' extra (pip install 'taobaoutils[zstd]')."
+        )
+    return zstandard
+
+
+if RESPONSE_COMPRESSION not in RESPONSE_CODECS:
+    raise ValueError(f"Unsupported response compression: {RESPONSE_COMPRESSION}. Supported: {RESPONSE_CODECS}")
+if RESPONSE_COMPRESSION == "zstd" and _zstd() is None:
+    logger.warning("zstandard is not installed, response content will be compressed with zlib instead.")
+    RESPONSE_COMPRESSION = "zlib"
+
+
+def truncate_text(text, max_bytes):
+    """把文本截断到不超过 max_bytes 个 UTF-8 字节（含截断标记），不会截断在多字节字符中间"""
+    data = text.encode("utf-8")
+    if max_bytes <= 0 or len(data) <= max_bytes:
+        return text
+    keep = max(0, max_bytes - len(TRUNCATED_MARKER.encode()))
+    return data[:keep].decode("utf-8", errors="ignore") + TRUNCATED_MARKER
+
+
+def encode_text(text, compression=None, min_bytes=None, level=None, max_bytes=None):
+    """
+    把文本编码成带标记字节的二进制，参数默认取 [storage] 配置
+
+    Args:
+        text: 响应内容
+        compression: none/zlib/zstd
+        min_bytes: 小于该大小（UTF-8 字节）的文本不压缩
+        level: 压缩级别
+        max_bytes: 大于 0 时截断超过该大小的文本
+    """
+    compression = compression or RESPONSE_COMPRESSION
+    min_bytes = RESPONSE_COMPRESS_MIN_BYTES if min_bytes is None else min_bytes
+    level = RESPONSE_COMPRESS_LEVEL if level is None else level
+    max_bytes = RESPONSE_MAX_BYTES if max_bytes is None else max_bytes
+
+    data = truncate_text(text, max_bytes).encode("utf-8")
+    if compression == "none" or len(data) < min_bytes:
+        return _RAW + data
+    if compression == "zstd":
+        compressed = _ZSTD + _require_zstd().ZstdCompressor(level=level).compress(data)
+    else:
+        compressed = _ZLIB + zlib.compress(data, level)
+    # 不可压缩的内容按原文保存
+    return compressed if len(compressed) < len(data) + 1 else _RAW + data
+
+
+def decode_text(data):
+    """encode_text 的逆操作；旧数据库中以文本保存的值原样返回"""
+    if isinstance(data, str):
+        return data
+    data = bytes(data)
+    marker, body = data[:1], data[1:]
+    if marker == _ZLIB:
+        return zlib.decompress(body).decode("utf-8")
+    if marker == _ZSTD:
+        return _require_zstd().ZstdDecompressor().decompress(body).decode("utf-8")
+    if marker == _RAW:
+        return body.decode("utf-8")
+    # 没有标记字节的二进制按 UTF-8 文本处理
+    return data.decode("utf-8", errors="replace")
+
+
+class CompressedText(TypeDecorator):
+    """以压缩二进制保存、以 str 读写的列类型"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_text(value if isinstance(value, str) else str(value))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_text(value)
@@ -0,0 +1,333 @@
+"""
+请求体模板编译
+
+RequestConfig.body 是带 ``{字段名}`` 占位符的 JSON 模板。模板只解析一次，编译成记录了
+占位符位置的结构，渲染时直接把值放进 JSON 树，不再对整个字符串做替换后重新 json.loads，
+值中的引号、反斜杠等由 JSON 序列化负责转义。
+
+占位符可以写在字符串里（``"{title}"``、``"id={product_id}"``，渲染结果总是字符串），
+也可以直接作为值（``{"stock": {stock}}``，渲染为原始值）。
+
+批量渲染时模板被序列化成 "JSON片段 + 占位符" 的骨架，每个字段按列一次性转成 JSON 文本，
+再按列拼接片段，N 行得到 N 个已序列化的请求体，不需要逐行 json.dumps。
+"""
+
+import json
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+
+from taobaoutils import config_data
+
+# ProductListing.to_dict 输出的字段（ProductListing.DICT_FIELDS 引用这里），也是模板中可以使用的占位符
+LISTING_FIELDS = (
+    "id",
+    "status",
+    "send_time",
+    "response_content",
+    "response_code",
+    "product_id",
+    "product_link",
+    "title",
+    "stock",
+    "listing_code",  # 上架编码
+    "user_id",
+    "request_config_id",
+    "api_token_id",
+)
+TEMPLATE_FIELDS = frozenset(LISTING_FIELDS)
+
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+# 直接作为值的占位符在解析前替换成以这个私有区字符开头的字符串
+_RAW_MARKER = "\ue000tb-raw:"
+
+
+def format_value(value):
+    """字符串中的占位符按 ProductListing.to_dict 的格式转成文本，空值为空字符串"""
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _raw_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _mark_raw_placeholders(source):
+    """把不在JSON字符串内的占位符替换成带标记的字符串，使模板可以按JSON解析"""
+    parts = []
+    in_string = False
+    escaped = False
+    position = 0
+    while position < len(source):
+        char = source[position]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            match = PLACEHOLDER.match(source, position)
+            if match and match.group(1) in TEMPLATE_FIELDS:
+                parts.append(f'"{_RAW_MARKER}{match.group(1)}"')
+                position = match.end()
+                continue
+        parts.append(char)
+        position += 1
+    return "".join(parts)
+
+
+def _split_string(text):
+    """把字符串拆成 [字面量, 字段名, 字面量, ...]，没有占位符时返回None"""
+    pieces = []
+    last = 0
+    for match in PLACEHOLDER.finditer(text):
+        if match.group(1) not in TEMPLATE_FIELDS:
+            continue
+        pieces.append(text[last : match.start()])
+        pieces.append(match.group(1))
+        last = match.end()
+    if not pieces:
+        return None
+    pieces.append(text[last:])
+    return pieces
+
+
+def _compile_string(text, fields):
+    if text.startswith(_RAW_MARKER):
+        field = text[len(_RAW_MARKER) :]
+        fields.add(field)
+        return lambda values: _raw_value(values[field])
+
+    pieces = _split_string(text)
+    if pieces is None:
+        return lambda values: text
+    fields.update(pieces[1::2])
+    literals = pieces[0::2]
+    names = pieces[1::2]
+
+    def render(values):
+        parts = [literals[0]]
+        for name, literal in zip(names, literals[1:], strict=True):
+            parts.append(format_value(values[name]))
+            parts.append(literal)
+        return "".join(parts)
+
+    return render
+
+
+def _compile_node(node, fields):
+    """把解析后的JSON节点编译成 render(values) 函数，每次渲染都生成新的容器"""
+    if isinstance(node, dict):
+        items = [(_compile_node(key, fields), _compile_node(value, fields)) for key, value in node.items()]
+        return lambda values: {key(values): value(values) for key, value in items}
+    if isinstance(node, list):
+        elements = [_compile_node(element, fields) for element in node]
+        return lambda values: [element(values) for element in elements]
+    if isinstance(node, str):
+        return _compile_string(node, fields)
+    return lambda values: node
+
+
+# 序列化骨架中标记占位符位置的私有区字符
+_STRING_SLOT = "\ue001"
+_RAW_SLOT = "\ue002"
+_SLOT_PATTERN = re.compile(f'"{_RAW_SLOT}(\\d+){_RAW_SLOT}"|{_STRING_SLOT}(\\d+){_STRING_SLOT}')
+_CONTROL_CHARACTERS = re.compile(r"[\x00-\x1f]")
+
+
+def _slot_tree(node, slots):
+    """把解析后的模板中的占位符换成带序号的标记，slots 记录每个序号对应的 (字段, 是否原始值)"""
+    if isinstance(node, dict):
+        return {_slot_tree(key, slots): _slot_tree(value, slots) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_slot_tree(element, slots) for element in node]
+    if not isinstance(node, str):
+        return node
+    if node.startswith(_RAW_MARKER):
+        slots.append((node[len(_RAW_MARKER) :], True))
+        return f"{_RAW_SLOT}{len(slots) - 1}{_RAW_SLOT}"
+    pieces = _split_string(node)
+    if pieces is None:
+        return node
+    parts = [pieces[0]]
+    for name, literal in zip(pieces[1::2], pieces[2::2], strict=True):
+        slots.append((name, False))
+        parts.append(f"{_STRING_SLOT}{len(slots) - 1}{_STRING_SLOT}")
+        parts.append(literal)
+    return "".join(parts)
+
+
+def _compile_skeleton(tree):
+    """返回 (片段列表, 占位符列表)，片段与占位符交替拼接即为渲染结果"""
+    slots = []
+    text = json.dumps(_slot_tree(tree, slots), ensure_ascii=False, separators=(",", ":"))
+    fragments = []
+    order = []
+    last = 0
+    for match in _SLOT_PATTERN.finditer(text):
+        fragments.append(text[last : match.start()])
+        order.append(slots[int(match.group(1) or match.group(2))])
+        last = match.end()
+    fragments.append(text[last:])
+    return fragments, order
+
+
+def _as_series(values):
+    """列数据转成从0开始编号的Series，list按元素类型推断为可空整数、字符串、时间等类型"""
+    if isinstance(values, pd.Series):
+        return values.reset_index(drop=True)
+    return pd.Series(pd.array(list(values)))
+
+
+def text_column(values):
+    """按列把值转成占位符文本（同 format_value），返回字符串Series"""
+    series = _as_series(values)
+    if series.dtype == object:
+        return series.map(format_value).astype("string")
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.map(lambda value: "" if pd.isna(value) else value.isoformat()).astype("string")
+    return series.astype("string").fillna("")
+
+
+def escape_column(text):
+    """按列转义JSON字符串内容（不含两侧引号）"""
+    text = text.str.replace("\\", "\\\\", regex=False).str.replace('"', '\\"', regex=False)
+    if text.str.contains(_CONTROL_CHARACTERS).any():
+        text = text.str.replace(_CONTROL_CHARACTERS, lambda match: f"\\u{ord(match.group()):04x}", regex=True)
+    return text
+
+
+def json_column(values):
+    """按列把值序列化成JSON文本：数字、布尔保持原样，空值为 null，其他按字符串处理"""
+    series = _as_series(values)
+    if pd.api.types.is_bool_dtype(series):
+        return series.map({True: "true", False: "false"}).astype("string").fillna("null")
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype("string").fillna("null")
+    quoted = '"' + escape_column(text_column(series)) + '"'
+    return quoted.mask(series.isna(), "null")
+
+
+class CompiledTemplate:
+    """
+    编译后的请求体模板
+
+    Attributes:
+        source: 模板原文
+        fields: 模板中用到的字段名
+    """
+
+    def __init__(self, source):
+        self.source = source
+        fields = set()
+        tree = json.loads(_mark_raw_placeholders(source))
+        self._render = _compile_node(tree, fields)
+        self._fragments, self._slots = _compile_skeleton(tree)
+        self.fields = frozenset(fields)
+
+    def render(self, values):
+        """
+        用字段值渲染模板，返回新的JSON对象
+
+        Args:
+            values: 字段名 -> 值 的映射，至少包含 fields 中的字段
+        """
+        return self._render(values)
+
+    def render_object(self, product):
+        """从对象的属性中读取模板用到的字段并渲染"""
+        return self._render({field: getattr(product, field, None) for field in self.fields})
+
+    def render_text_batch(self, columns, length):
+        """
+        按列批量渲染，返回已序列化的JSON文本Series
+
+        Args:
+            columns: 字段名 -> 一列值（list、Series，或直接传入 DataFrame）
+            length: 行数
+        """
+        if not self._slots:
+            return pd.Series([self._fragments[0]] * length, dtype="string")
+
+        encoded = {}
+        rendered = self._fragments[0]
+        for (field, raw), fragment in zip(self._slots, self._fragments[1:], strict=True):
+            if (field, raw) not in encoded:
+                values = _as_series(columns[field])
+                encoded[field, raw] = json_column(values) if raw else escape_column(text_column(values))
+            rendered = rendered + encoded[field, raw] + fragment
+        return rendered
+
+    def _batch_length(self, columns):
+        """从一批列数据推断行数：DataFrame 取行数，否则优先取模板用到的列，再取任意一列"""
+        if isinstance(columns, pd.DataFrame):
+            return len(columns)
+        for field in (*self.fields, *columns):
+            if field in columns:
+                return len(columns[field])
+        raise ValueError("length is required when columns is empty")
+
+    def render_batch(self, columns, length=None):
+        """
+        按列批量渲染，返回每行请求体的 UTF-8 JSON bytes，可直接拼接进发送给scheduler的payload
+
+        Args:
+            columns: 字段名 -> 一列值（list、Series，或直接传入 DataFrame）
+            length: 行数，默认取 DataFrame 的行数或第一列的长度；模板没有占位符时也按行数返回
+
+        Raises:
+            ValueError: 未给出 length，且 columns 中没有任何一列可以确定行数
+        """
+        if length is None:
+            length = self._batch_length(columns)
+        return [text.encode("utf-8") for text in self.render_text_batch(columns, length)]
+
+
+class TemplateCache:
+    """编译结果的 LRU 缓存，以 (配置ID, 版本) 为键，模板原文变化时重新编译"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, config_id, version, source):
+        key = (config_id, version)
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None and template.source == source:
+                self._entries.move_to_end(key)
+                return template
+
+        template = CompiledTemplate(source)
+        if config_id is None or self.maxsize <= 0:
+            return template
+        with self._lock:
+            self._entries[key] = template
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+template_cache = TemplateCache(maxsize=config_data.get("scheduler", {}).get("TEMPLATE_CACHE_SIZE", 256))
@@ -3,6 +3,7 @@ import json
 import requests
 
 from taobaoutils import config_data, logger
+from taobaoutils.scheduler import scheduler_client
 
 
 def send_request(target_url, payload, cookies: str | None = None):
@@ -38,7 +39,7 @@ def send_request(target_url, payload, cookies: str | None = None):
     response_content = ""
     try:
         logger.info("准备发送的请求体: %s", json.dumps(payload, indent=2, ensure_ascii=False))
-        response = requests.post(target_url, data=json.dumps(payload), headers=headers, timeout=30)
+        response = scheduler_client.post(target_url, data=json.dumps(payload), headers=headers)
         response.raise_for_status()  # 如果请求失败 (状态码 4xx 或 5xx), 则抛出异常
 
         logger.info("成功发送请求.\n状态码: %s", response.status_code)
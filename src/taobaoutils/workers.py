@@ -0,0 +1,37 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(RuntimeError):
+    """后台线程池的等待队列已满"""
+
+
+class BoundedExecutor:
+    """
+    有界的后台线程池
+
+    ThreadPoolExecutor 的等待队列是无界的，这里用信号量限制“运行中 + 排队中”的任务总数，
+    超出上限时 submit 立即抛出 QueueFullError，而不是无限堆积。
+    """
+
+    def __init__(self, max_workers, max_pending, thread_name_prefix=""):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Background worker queue is full")
+        try:
+            return self._executor.submit(self._run, fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _run(self, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -1,5 +1,6 @@
 import pytest
 
+from taobaoutils.api.auth_cache import last_used_buffer
 from taobaoutils.app import create_app, db
 
 
@@ -12,6 +13,7 @@ def app():
     with app.app_context():
         db.create_all()
         yield app
+        last_used_buffer.flush()
         db.session.remove()
         db.drop_all()
         db.engine.dispose()
@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 import pytest
 
 from taobaoutils.app import db, guard
@@ -93,3 +95,38 @@ def test_api_token_crud(client, auth_headers, app):
 # Test api_token_required decorator logic using the decorator directly via a route
 # Usually we need to integraton test it.
 # Or we can create a dummy protected route in the test app.
+
+
+def test_jwt_claims_cached(client, auth_headers):
+    assert client.get("/api/auth/me", headers=auth_headers).status_code == 200
+
+    with patch.object(guard, "extract_jwt_token") as mock_extract:
+        response = client.get("/api/tokens", headers=auth_headers)
+        assert response.status_code == 200
+        mock_extract.assert_not_called()
+
+
+def test_jwt_claims_invalidated_on_user_change(client, auth_headers):
+    assert client.get("/api/auth/me", headers=auth_headers).status_code == 200
+
+    response = client.put("/api/auth/me", json={"password": "new-password"}, headers=auth_headers)
+    assert response.status_code == 200
+
+    with patch.object(guard, "extract_jwt_token", wraps=guard.extract_jwt_token) as mock_extract:
+        assert client.get("/api/auth/me", headers=auth_headers).status_code == 200
+        mock_extract.assert_called_once()
+
+
+def test_deactivated_user_rejected_on_cache_hit(client, auth_headers, app):
+    assert client.get("/api/auth/me", headers=auth_headers).status_code == 200
+
+    with app.app_context():
+        user = User.query.filter_by(username="auth_user").first()
+        user.is_active = False
+        db.session.commit()
+
+    with patch.object(guard, "extract_jwt_token", wraps=guard.extract_jwt_token) as mock_extract:
+        assert client.get("/api/auth/me", headers=auth_headers).status_code == 403
+        mock_extract.assert_called_once()  # 提交后缓存已失效，重新加载的快照为已停用
+    # 已停用用户的快照留在缓存中，命中时同样拒绝
+    assert client.get("/api/auth/me", headers=auth_headers).status_code == 403
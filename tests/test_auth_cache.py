@@ -0,0 +1,178 @@
+import time
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+
+from taobaoutils.api.auth_cache import APITokenCache, ClaimsCache, LastUsedBuffer, claims_cache
+from taobaoutils.app import db
+from taobaoutils.models import APIToken, User
+
+
+def make_token(token_id=1, expires_at=None, scopes=None):
+    return SimpleNamespace(id=token_id, user_id=7, expires_at=expires_at, get_scopes=lambda: scopes or ["read"])
+
+
+def test_token_cache_put_get():
+    cache = APITokenCache(maxsize=10, ttl=60)
+    entry = cache.put("h1", make_token(scopes=["read", "write"]))
+
+    assert cache.get("h1") == entry
+    assert entry.user_id == 7
+    assert entry.scopes == frozenset({"read", "write"})
+    assert cache.get("missing") is None
+
+
+def test_token_cache_lru_eviction():
+    cache = APITokenCache(maxsize=2, ttl=60)
+    cache.put("h1", make_token(1))
+    cache.put("h2", make_token(2))
+    cache.get("h1")  # h1 becomes most recently used
+    cache.put("h3", make_token(3))
+
+    assert cache.get("h2") is None
+    assert cache.get("h1") is not None
+    assert cache.get("h3") is not None
+
+
+def test_token_cache_ttl_and_token_expiry():
+    cache = APITokenCache(maxsize=10, ttl=0.01)
+    cache.put("h1", make_token())
+    time.sleep(0.02)
+    assert cache.get("h1") is None
+
+    cache = APITokenCache(maxsize=10, ttl=60)
+    cache.put("h2", make_token(expires_at=datetime.now(UTC) - timedelta(seconds=1)))
+    assert cache.get("h2") is None
+    assert len(cache) == 0
+
+
+def test_token_cache_invalidate():
+    cache = APITokenCache(maxsize=10, ttl=60)
+    cache.put("h1", make_token())
+    cache.invalidate("h1")
+    cache.invalidate("unknown")
+    assert cache.get("h1") is None
+
+
+def create_tokens(count):
+    user = User(username="buffer_user", email="buffer@example.com", password="pwd")
+    db.session.add(user)
+    db.session.commit()
+    tokens = []
+    for i in range(count):
+        _, token = APIToken.create_token(user.id, f"Token{i}")
+        db.session.add(token)
+        tokens.append(token)
+    db.session.commit()
+    return [token.id for token in tokens]
+
+
+def test_last_used_buffer_flush(app):
+    token_ids = create_tokens(2)
+    buffer = LastUsedBuffer(flush_interval=60, flush_size=100)
+    used_at = datetime(2024, 1, 1, 12, 0, 0)
+
+    buffer.record(token_ids[0], used_at)
+    buffer.record(token_ids[1], used_at)
+    buffer.record(token_ids[1], used_at + timedelta(seconds=5))  # Coalesced into one update
+
+    db.session.expire_all()
+    assert db.session.get(APIToken, token_ids[0]).last_used_at is None
+
+    assert buffer.flush() == 2
+    assert buffer.flush() == 0
+
+    db.session.expire_all()
+    assert db.session.get(APIToken, token_ids[0]).last_used_at == used_at
+    assert db.session.get(APIToken, token_ids[1]).last_used_at == used_at + timedelta(seconds=5)
+
+
+def test_last_used_buffer_flushes_at_size(app):
+    token_ids = create_tokens(2)
+    buffer = LastUsedBuffer(flush_interval=60, flush_size=2)
+
+    buffer.record(token_ids[0])
+    buffer.record(token_ids[1])
+
+    db.session.expire_all()
+    assert all(db.session.get(APIToken, token_id).last_used_at is not None for token_id in token_ids)
+
+
+def test_last_used_buffer_flushes_on_timer(app):
+    token_ids = create_tokens(1)
+    buffer = LastUsedBuffer(flush_interval=0.05, flush_size=100)
+
+    buffer.record(token_ids[0])
+    time.sleep(0.3)
+
+    db.session.expire_all()
+    assert db.session.get(APIToken, token_ids[0]).last_used_at is not None
+
+
+def make_user(user_id=1, is_active=True):
+    return SimpleNamespace(id=user_id, is_active=is_active)
+
+
+def test_claims_cache_put_get_and_invalidate_user():
+    cache = ClaimsCache(maxsize=10, ttl=60)
+    entry = cache.put("h1", {"id": 1, "exp": time.time() + 3600}, make_user(1, is_active=False))
+    cache.put("h2", {"id": 1}, make_user(1))
+    cache.put("h3", {"id": 2}, make_user(2))
+
+    assert cache.get("h1") == entry
+    assert entry.user.is_active is False
+
+    cache.invalidate_user(1)
+    assert cache.get("h1") is None
+    assert cache.get("h2") is None
+    assert cache.get("h3") is not None
+
+
+def test_claims_cache_respects_token_exp():
+    cache = ClaimsCache(maxsize=10, ttl=60)
+    cache.put("expired", {"id": 1, "exp": time.time() - 1}, make_user())
+    assert cache.get("expired") is None
+
+    cache = ClaimsCache(maxsize=1, ttl=60)
+    cache.put("h1", {"id": 1}, make_user(1))
+    cache.put("h2", {"id": 2}, make_user(2))
+    assert cache.get("h1") is None
+    assert len(cache) == 1
+
+
+def test_claims_cache_skips_put_after_invalidation():
+    cache = ClaimsCache(maxsize=10, ttl=60)
+    generation = cache.generation(1)
+    # 加载User期间该用户的修改已提交
+    cache.invalidate_user(1)
+    entry = cache.put("h1", {"id": 1}, make_user(1), generation)
+
+    assert entry.user.id == 1
+    assert cache.get("h1") is None
+
+    cache.put("h1", {"id": 1}, make_user(1), cache.generation(1))
+    assert cache.get("h1") is not None
+
+
+def test_claims_invalidated_only_after_commit(app):
+    user = User(username="claims_user", email="claims@example.com", password="pwd")
+    db.session.add(user)
+    db.session.commit()
+    cache = claims_cache
+    cache.put("h1", {"id": user.id}, user)
+
+    user.is_active = False
+    db.session.flush()
+    assert cache.get("h1") is not None  # 尚未提交，其他请求仍只能读到旧数据
+
+    db.session.rollback()
+    db.session.commit()
+    assert cache.get("h1") is not None
+
+    user.is_active = False
+    db.session.commit()
+    assert cache.get("h1") is None
+
+    cache.put("h2", {"id": user.id}, user)
+    user.email = "other@example.com"  # 与认证无关的字段不会驱逐缓存
+    db.session.commit()
+    assert cache.get("h2") is not None
@@ -0,0 +1,129 @@
+import time
+from unittest.mock import patch
+
+import pytest
+
+from taobaoutils.api.callback_buffer import CallbackBuffer
+from taobaoutils.app import db
+from taobaoutils.models import APIToken, ProductListing, RequestConfig, User
+
+
+@pytest.fixture
+def listing_ids(app):
+    user = User(username="buffer_user", email="buffer@example.com", password="pwd")
+    db.session.add(user)
+    db.session.commit()
+    rc = RequestConfig(user_id=user.id, name="Buffer Config", body={}, header={})
+    db.session.add(rc)
+    db.session.commit()
+    listings = [
+        ProductListing(user_id=user.id, request_config_id=rc.id, status="是否完成", response_content="old")
+        for _ in range(3)
+    ]
+    db.session.add_all(listings)
+    db.session.commit()
+    return [listing.id for listing in listings]
+
+
+@pytest.fixture
+def headers(listing_ids):
+    token_str, token = APIToken.create_token(User.query.first().id, "BufferToken")
+    db.session.add(token)
+    db.session.commit()
+    return {"Authorization": f"Bearer {token_str}"}
+
+
+@pytest.fixture
+def buffer():
+    # 较长的写回间隔，测试中手动调用 flush
+    buffer = CallbackBuffer(max_size=2, flush_interval=60, flush_size=100)
+    with (
+        patch("taobaoutils.api.resources.CALLBACK_BUFFERED", True),
+        patch("taobaoutils.api.resources.callback_buffer", buffer),
+    ):
+        yield buffer
+    buffer.stop(timeout=5)
+
+
+def listing_rows(ids):
+    db.session.expire_all()
+    return [
+        (listing.status, listing.response_code, listing.response_content)
+        for listing in ProductListing.query.filter(ProductListing.id.in_(ids)).order_by(ProductListing.id)
+    ]
+
+
+def test_buffered_callbacks_are_written_on_flush(client, headers, listing_ids, buffer):
+    first = {"id": listing_ids[0], "status": "running"}
+    second = {"id": listing_ids[0], "status": "success", "response_code": 200, "response_content": "ok"}
+
+    assert client.post("/api/scheduler/callback", json=first, headers=headers).status_code == 202
+    assert client.post("/api/scheduler/callback", json=second, headers=headers).status_code == 202
+    assert listing_rows(listing_ids[:1]) == [("是否完成", None, "old")]
+
+    assert buffer.flush() == 2
+    # 按到达顺序写回，后到的回调生效
+    assert listing_rows(listing_ids[:1]) == [("success", 200, "ok")]
+    assert buffer.status()["flushed"] == 2
+
+
+def test_full_buffer_falls_back_to_synchronous_update(client, headers, listing_ids, buffer):
+    for listing_id in listing_ids[:2]:
+        response = client.post("/api/scheduler/callback", json={"id": listing_id, "status": "success"}, headers=headers)
+        assert response.status_code == 202
+
+    response = client.post("/api/scheduler/callback", json={"id": listing_ids[2], "status": "failed"}, headers=headers)
+    assert response.status_code == 200
+    assert listing_rows(listing_ids) == [("是否完成", None, "old")] * 2 + [("failed", None, "old")]
+    # 队列满时仍然按原接口检查listing是否存在
+    response = client.post("/api/scheduler/callback", json={"id": 99999, "status": "failed"}, headers=headers)
+    assert response.status_code == 404
+    assert buffer.status()["rejected"] == 2
+
+
+def test_failed_flush_keeps_callbacks(app, listing_ids):
+    buffer = CallbackBuffer(flush_interval=60)
+    buffer._pending.append(
+        {"listing_id": listing_ids[0], "new_status": "success", "new_response_code": None, "new_response_content": None}
+    )
+
+    with patch.object(db.engine, "begin", side_effect=RuntimeError("database is locked")):
+        with pytest.raises(RuntimeError):
+            buffer.flush()
+
+    assert buffer.status()["pending"] == 1
+    assert buffer.status()["errors"] == 1
+    assert buffer.flush() == 1
+    assert listing_rows(listing_ids[:1]) == [("success", None, "old")]
+
+
+def test_stop_flushes_pending_callbacks(app, listing_ids):
+    buffer = CallbackBuffer(flush_interval=60)
+    for listing_id in listing_ids:
+        assert buffer.submit(
+            {"listing_id": listing_id, "new_status": "success", "new_response_code": 200, "new_response_content": None}
+        )
+
+    buffer.stop(timeout=5)
+
+    assert listing_rows(listing_ids) == [("success", 200, "old")] * 3
+    assert buffer.status()["pending"] == 0
+    # 停止后不再接收
+    assert not buffer.submit({"listing_id": listing_ids[0], "new_status": "late"})
+
+
+def test_flusher_thread_writes_batches(app, listing_ids):
+    buffer = CallbackBuffer(flush_interval=0.001, flush_size=2)
+    for listing_id in listing_ids:
+        buffer.submit(
+            {"listing_id": listing_id, "new_status": "success", "new_response_code": None, "new_response_content": None}
+        )
+
+    for _ in range(500):
+        if buffer.status()["flushed"] == 3:
+            break
+        time.sleep(0.01)
+    buffer.stop(timeout=5)
+
+    assert buffer.status()["flushed"] == 3
+    assert listing_rows(listing_ids) == [("success", None, "old")] * 3
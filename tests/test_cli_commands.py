@@ -71,3 +71,31 @@ def test_test_command_with_coverage():
         args = mock_pytest.main.call_args[0][0]
         assert "--cov=src/taobaoutils" in args
         assert "--cov-report=html" in args
+
+
+def test_dispatcher_command_once():
+    runner = CliRunner()
+
+    with (
+        patch("taobaoutils.cli.create_app") as mock_create_app,
+        patch("taobaoutils.dispatcher.OutboxDispatcher.run_once", return_value=3) as mock_run_once,
+    ):
+        result = runner.invoke(main, ["dispatcher", "--once"])
+
+        assert result.exit_code == 0
+        mock_create_app.assert_called_once_with(start_dispatcher=False)
+        mock_run_once.assert_called_once()
+
+
+def test_fake_scheduler_command():
+    runner = CliRunner()
+
+    with patch("taobaoutils.fake_scheduler.FakeScheduler") as mock_scheduler:
+        mock_scheduler.return_value.serve_forever.side_effect = KeyboardInterrupt
+        result = runner.invoke(main, ["fake-scheduler", "--port", "9000", "--latency", "0.1", "--callbacks"])
+
+        assert result.exit_code == 0
+        mock_scheduler.assert_called_once_with(
+            "127.0.0.1", 9000, latency=0.1, error_rate=0.0, callbacks=True, callback_batch=0
+        )
+        mock_scheduler.return_value.stop.assert_called_once()
@@ -0,0 +1,247 @@
+import threading
+from datetime import datetime, timedelta
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+
+from taobaoutils.app import db, guard
+from taobaoutils.dispatcher import OutboxDispatcher, start_dispatcher_thread
+from taobaoutils.models import APIToken, ImportJob, OutboxEntry, ProductListing, RequestConfig, User
+from taobaoutils.scheduler import CircuitBreaker
+
+
+@pytest.fixture
+def outbox_mode():
+    with patch("taobaoutils.api.resources.DISPATCH_MODE", "outbox"):
+        yield
+
+
+@pytest.fixture
+def auth_headers(app):
+    user = User(username="outbox_user", email="outbox@example.com", password="password")
+    db.session.add(user)
+    db.session.commit()
+    rc = RequestConfig(user_id=user.id, name="Outbox Config", body={"title": "{title}"}, header={})
+    _, token_obj = APIToken.create_token(user_id=user.id, name="OutboxToken")
+    db.session.add_all([rc, token_obj])
+    db.session.commit()
+    return {
+        "Authorization": f"Bearer {guard.encode_jwt_token(user)}",
+        "X-Request-Config-ID": str(rc.id),
+        "X-API-Token-ID": str(token_obj.id),
+    }
+
+
+def upload(client, auth_headers, rows=3, **form):
+    lines = ["商品ID,商品链接,标题,库存,上架编码"] + [f"{i},http://o{i},O{i},{i},C{i}" for i in range(rows)]
+    data = {
+        "file": (BytesIO("\n".join(lines).encode()), "outbox.csv"),
+        "request_config_id": auth_headers["X-Request-Config-ID"],
+        "api_token_id": auth_headers["X-API-Token-ID"],
+        **form,
+    }
+    response = client.post(
+        "/api/product-listings/upload", data=data, content_type="multipart/form-data", headers=auth_headers
+    )
+    assert response.status_code == 201
+    return response.json["job_id"]
+
+
+def make_ready(entries=None):
+    """把条目的退避时间和租约都提前到过去"""
+    past = datetime.utcnow() - timedelta(seconds=1)
+    query = OutboxEntry.query if entries is None else OutboxEntry.query.filter(OutboxEntry.id.in_(entries))
+    query.update({"available_at": past, "leased_until": None}, synchronize_session=False)
+    db.session.commit()
+
+
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_writes_outbox_and_dispatcher_sends(mock_post_batch, outbox_mode, client, auth_headers, app):
+    mock_post_batch.return_value = True
+    job_id = upload(client, auth_headers)
+
+    # 上传请求本身不发送，listing和发件箱条目在同一事务中写入
+    mock_post_batch.assert_not_called()
+    assert OutboxEntry.query.count() == 3
+    assert ProductListing.query.filter_by(status="Uploaded").count() == 3
+    assert db.session.get(ImportJob, job_id).status == "queued_for_dispatch"
+
+    dispatcher = OutboxDispatcher(app, batch_size=2)
+    assert dispatcher.run_once() == 2
+    db.session.expire_all()
+    assert db.session.get(ImportJob, job_id).status == "queued_for_dispatch"
+    assert dispatcher.run_once() == 1
+    assert dispatcher.run_once() == 0
+
+    assert mock_post_batch.call_count == 2
+    assert OutboxEntry.query.count() == 0
+    assert ProductListing.query.filter_by(status="是否完成").count() == 3
+    job = db.session.get(ImportJob, job_id)
+    db.session.refresh(job)
+    assert (job.status, job.rows_dispatched) == ("completed", 3)
+    assert job.finished_at is not None
+
+
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_failed_entries_back_off_then_die(mock_post_batch, outbox_mode, client, auth_headers, app):
+    mock_post_batch.return_value = False
+    job_id = upload(client, auth_headers, rows=2)
+    dispatcher = OutboxDispatcher(app, max_attempts=2, backoff_base=60)
+
+    before = datetime.utcnow()
+    assert dispatcher.run_once() == 2
+    entries = OutboxEntry.query.all()
+    assert [(entry.status, entry.attempts, entry.lease_id) for entry in entries] == [("pending", 1, None)] * 2
+    assert all(
+        before + timedelta(seconds=30) <= entry.available_at <= before + timedelta(seconds=61) for entry in entries
+    )
+    # 退避期间不会被再次领取
+    assert dispatcher.run_once() == 0
+
+    make_ready()
+    assert dispatcher.run_once() == 2
+    db.session.expire_all()
+    assert {(entry.status, entry.attempts) for entry in OutboxEntry.query} == {("dead", 2)}
+    # dead 条目不再发送，任务完成并记录失败行数
+    job = db.session.get(ImportJob, job_id)
+    assert (job.status, job.rows_failed) == ("completed", 2)
+    make_ready()
+    assert dispatcher.run_once() == 0
+
+    # 重试接口把 dead 条目重新放回发件箱
+    mock_post_batch.return_value = True
+    response = client.post(f"/api/import-jobs/{job_id}/retry", headers=auth_headers)
+    assert response.status_code == 202
+    assert response.json["job"]["rows_failed"] == 0
+    assert response.json["job"]["status"] == "queued_for_dispatch"
+    assert dispatcher.run_once() == 2
+    assert ProductListing.query.filter_by(status="是否完成").count() == 2
+    assert OutboxEntry.query.count() == 0
+    db.session.expire_all()
+    assert db.session.get(ImportJob, job_id).status == "completed"
+
+
+def test_lease_is_exclusive_until_expired(outbox_mode, client, auth_headers, app):
+    upload(client, auth_headers, rows=3)
+    first = OutboxDispatcher(app, batch_size=2)
+    second = OutboxDispatcher(app, batch_size=10)
+
+    leased = first.lease()
+    assert len(leased) == 2
+    # 另一个调度器只能领取剩下的条目
+    assert [entry.id for entry in second.lease()] == [3]
+    assert second.lease() == []
+
+    # 租约过期后（例如持有者崩溃）条目可以被重新领取
+    make_ready([entry.id for entry in leased])
+    assert sorted(entry.id for entry in second.lease()) == [1, 2]
+
+
+@patch("taobaoutils.api.resources._send_single_task_to_scheduler")
+def test_create_listing_enqueues_in_outbox_mode(mock_send, outbox_mode, client, auth_headers):
+    response = client.post(
+        "/api/product-listings",
+        json={
+            "product_link": "http://single",
+            "request_config_id": int(auth_headers["X-Request-Config-ID"]),
+            "api_token_id": int(auth_headers["X-API-Token-ID"]),
+        },
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 201
+    mock_send.assert_not_called()
+    assert [entry.listing_id for entry in OutboxEntry.query] == [response.json["id"]]
+
+
+def test_enqueue_resets_existing_entries(app, auth_headers):
+    user_id = User.query.first().id
+    listings = [ProductListing(user_id=user_id, request_config_id=1) for _ in range(2)]
+    db.session.add_all(listings)
+    db.session.flush()
+    assert OutboxEntry.enqueue([listings[0].id]) == 1
+    db.session.commit()
+    OutboxEntry.query.update({"status": "dead", "attempts": 8})
+
+    assert OutboxEntry.enqueue([listing.id for listing in listings]) == 2
+    db.session.commit()
+    assert {(entry.listing_id, entry.status, entry.attempts) for entry in OutboxEntry.query} == {
+        (listings[0].id, "pending", 0),
+        (listings[1].id, "pending", 0),
+    }
+
+
+def test_backoff_grows_and_is_capped(app):
+    dispatcher = OutboxDispatcher(app, backoff_base=5, backoff_max=60)
+
+    assert 2.5 <= dispatcher.backoff(1) <= 5
+    assert 10 <= dispatcher.backoff(3) <= 20
+    assert 30 <= dispatcher.backoff(10) <= 60
+
+
+def test_outbox_import_without_new_rows_completes(outbox_mode, client, auth_headers):
+    upload(client, auth_headers, rows=2)
+    # 全部重复的行被跳过，没有需要发送的条目
+    job_id = upload(client, auth_headers, rows=2, dedupe="product_id")
+
+    job = db.session.get(ImportJob, job_id)
+    assert (job.status, job.rows_skipped) == ("completed", 2)
+    assert job.finished_at is not None
+
+
+def test_start_dispatcher_thread_once_per_process(app):
+    with patch("taobaoutils.dispatcher._dispatcher", None):
+        first = start_dispatcher_thread(app)
+        try:
+            assert start_dispatcher_thread(app) is first
+            assert [t.name for t in threading.enumerate()].count("tb-outbox") == 1
+        finally:
+            first.stop(timeout=2)
+        # 线程停止后再次调用会重新启动
+        second = start_dispatcher_thread(app)
+        assert second is not first and second.running
+        second.stop(timeout=2)
+
+
+def test_dispatcher_thread_stops(app):
+    dispatcher = OutboxDispatcher(app, poll_interval=0.01)
+    thread = dispatcher.start()
+    assert thread.is_alive()
+    dispatcher.stop(timeout=2)
+    assert not thread.is_alive()
+
+
+@patch("taobaoutils.api.resources.FALLBACK_TO_OUTBOX", True)
+@patch("taobaoutils.scheduler._post_batch_tasks", return_value=False)
+def test_inline_failures_fall_back_to_outbox(mock_post_batch, client, auth_headers):
+    job_id = upload(client, auth_headers, rows=2)
+
+    assert mock_post_batch.call_count == 1
+    assert db.session.get(ImportJob, job_id).rows_failed == 2
+    assert OutboxEntry.query.count() == 2
+
+
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_dispatcher_waits_while_circuit_open(mock_post_batch, outbox_mode, client, auth_headers, app):
+    upload(client, auth_headers, rows=1)
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure()
+
+    with patch("taobaoutils.dispatcher.scheduler_client.breaker", return_value=breaker):
+        assert OutboxDispatcher(app).run_once() == 0
+
+    mock_post_batch.assert_not_called()
+    assert OutboxEntry.query.one().attempts == 0
+
+
+def test_scheduler_status_endpoint(client, auth_headers):
+    db.session.add(OutboxEntry(listing_id=1, status="dead"))
+    db.session.commit()
+
+    response = client.get("/api/scheduler/status", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json["dispatch_mode"] == "inline"
+    assert response.json["outbox"] == {"pending": 0, "dead": 1}
+    assert {"breakers", "latency"} <= set(response.json)
@@ -1,11 +1,19 @@
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from io import BytesIO
 from unittest.mock import patch
 
 import pandas as pd
 import pytest
+from sqlalchemy import event
 
+from taobaoutils.api.resources import _dispatch_job_listings, _fail_job
 from taobaoutils.app import db, guard
-from taobaoutils.models import APIToken, ProductListing, RequestConfig, User
+from taobaoutils.models import APIToken, ImportJob, ImportJobLeaseLostError, ProductListing, RequestConfig, User
+from taobaoutils.workers import QueueFullError
 
 
 @pytest.fixture
@@ -34,7 +42,7 @@ def auth_headers(app):
         }
 
 
-@patch("taobaoutils.api.resources._send_batch_tasks_to_scheduler")
+@patch("taobaoutils.scheduler._post_batch_tasks")
 def test_upload_excel_success(mock_send_batch, client, auth_headers, app):
     mock_send_batch.return_value = True
     rc_id = auth_headers["X-Request-Config-ID"]
@@ -72,7 +80,7 @@ def test_upload_excel_success(mock_send_batch, client, auth_headers, app):
         assert pl.status == "是否完成"  # Should be updated after callback
 
 
-@patch("taobaoutils.api.resources._send_batch_tasks_to_scheduler")
+@patch("taobaoutils.scheduler._post_batch_tasks")
 def test_upload_excel_scheduler_fail(mock_send_batch, client, auth_headers, app):
     mock_send_batch.return_value = False
     rc_id = auth_headers["X-Request-Config-ID"]
@@ -113,6 +121,29 @@ def test_upload_invalid_file_type(client, auth_headers):
     assert "Invalid file type" in response.json["message"]
 
 
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_csv(mock_send_batch, client, auth_headers, app):
+    mock_send_batch.return_value = True
+    content = "商品ID,商品链接,标题,库存,上架编码\n0001,http://c1,C1,5,X1\n0002,http://c2,C2,,X2\n"
+
+    data = {
+        "file": (BytesIO(content.encode()), "export.csv"),
+        "request_config_id": auth_headers["X-Request-Config-ID"],
+        "api_token_id": auth_headers["X-API-Token-ID"],
+    }
+    response = client.post(
+        "/api/product-listings/upload", data=data, content_type="multipart/form-data", headers=auth_headers
+    )
+    assert response.status_code == 201
+    assert "processed 2 product listings" in response.json["message"]
+
+    with app.app_context():
+        listings = {pl.product_id: pl for pl in ProductListing.query.all()}
+        assert set(listings) == {"0001", "0002"}
+        assert listings["0002"].stock is None
+        assert listings["0001"].status == "是否完成"
+
+
 def test_upload_missing_headers(client, auth_headers):
     df = pd.DataFrame({"WrongHeader": [1]})
     excel_file = BytesIO()
@@ -129,3 +160,565 @@ def test_upload_missing_headers(client, auth_headers):
     )
     assert response.status_code == 400
     assert "Missing required headers" in response.json["message"]
+
+
+@patch("taobaoutils.api.resources.CHUNK_SIZE", 2)
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_excel_chunked(mock_send_batch, client, auth_headers, app):
+    # Second chunk fails to dispatch; only the first chunk is marked as sent
+    mock_send_batch.side_effect = [True, False]
+
+    df = pd.DataFrame(
+        {
+            "商品ID": [1, 2, 3],
+            "商品链接": ["http://a", "http://b", "http://c"],
+            "标题": ["A", "B", "C"],
+            "库存": [1, 2, 3],
+            "上架编码": ["A1", "B1", "C1"],
+        }
+    )
+    excel_file = BytesIO()
+    df.to_excel(excel_file, index=False)
+    excel_file.seek(0)
+
+    data = {
+        "file": (excel_file, "chunks.xlsx"),
+        "request_config_id": auth_headers["X-Request-Config-ID"],
+        "api_token_id": auth_headers["X-API-Token-ID"],
+    }
+    response = client.post(
+        "/api/product-listings/upload", data=data, content_type="multipart/form-data", headers=auth_headers
+    )
+    assert response.status_code == 201
+    assert mock_send_batch.call_count == 2
+    assert [len(call.args[0]) for call in mock_send_batch.call_args_list] == [2, 1]
+
+    with app.app_context():
+        statuses = {pl.product_id: pl.status for pl in ProductListing.query.all()}
+        assert statuses == {"1": "是否完成", "2": "是否完成", "3": "Uploaded"}
+
+
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_excel_without_executemany_returning(mock_send_batch, client, auth_headers, app):
+    """Databases without executemany RETURNING fall back to ORM inserts."""
+    mock_send_batch.return_value = True
+
+    df = pd.DataFrame({"商品ID": [444], "商品链接": ["http://l4"], "标题": ["T4"], "库存": [None], "上架编码": ["C4"]})
+    excel_file = BytesIO()
+    df.to_excel(excel_file, index=False)
+    excel_file.seek(0)
+
+    data = {
+        "file": (excel_file, "orm.xlsx"),
+        "request_config_id": auth_headers["X-Request-Config-ID"],
+        "api_token_id": auth_headers["X-API-Token-ID"],
+    }
+    with patch.object(db.engine.dialect, "insert_executemany_returning", False):
+        response = client.post(
+            "/api/product-listings/upload", data=data, content_type="multipart/form-data", headers=auth_headers
+        )
+    assert response.status_code == 201
+
+    with app.app_context():
+        pl = ProductListing.query.filter_by(product_id="444").first()
+        assert pl.stock is None
+        assert pl.status == "是否完成"
+
+
+def make_upload(auth_headers, filename="job.xlsx", rows=2, **extra):
+    df = pd.DataFrame(
+        {
+            "商品ID": [str(500 + i) for i in range(rows)],
+            "商品链接": [f"http://job{i}" for i in range(rows)],
+            "标题": [f"J{i}" for i in range(rows)],
+            "库存": list(range(rows)),
+            "上架编码": [f"J{i}" for i in range(rows)],
+        }
+    )
+    excel_file = BytesIO()
+    df.to_excel(excel_file, index=False)
+    excel_file.seek(0)
+    return {
+        "file": (excel_file, filename),
+        "request_config_id": auth_headers["X-Request-Config-ID"],
+        "api_token_id": auth_headers["X-API-Token-ID"],
+        **extra,
+    }
+
+
+def wait_for_job(client, auth_headers, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/import-jobs/{job_id}", headers=auth_headers).json
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Import job {job_id} did not finish")
+
+
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_excel_async_job(mock_send_batch, client, auth_headers, app):
+    mock_send_batch.return_value = True
+
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_upload(auth_headers, rows=3, **{"async": "true"}),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 202
+    job_id = response.json["job_id"]
+    assert response.json["status_url"] == f"/api/import-jobs/{job_id}"
+
+    job = wait_for_job(client, auth_headers, job_id)
+    assert job["status"] == "completed"
+    assert job["rows_parsed"] == 3
+    assert job["rows_inserted"] == 3
+    assert job["rows_dispatched"] == 3
+    assert job["rows_failed"] == 0
+
+    with app.app_context():
+        assert ProductListing.query.filter_by(status="是否完成").count() == 3
+
+    jobs = client.get("/api/import-jobs", headers=auth_headers).json
+    assert [j["id"] for j in jobs] == [job_id]
+
+
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_excel_sync_job_records_failures(mock_send_batch, client, auth_headers):
+    mock_send_batch.return_value = False
+
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_upload(auth_headers),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 201
+
+    job = client.get(f"/api/import-jobs/{response.json['job_id']}", headers=auth_headers).json
+    assert job["status"] == "completed"
+    assert job["rows_inserted"] == 2
+    assert job["rows_dispatched"] == 0
+    assert job["rows_failed"] == 2
+
+
+def test_upload_excel_async_validates_header_row_only(client, auth_headers, app):
+    upload = make_upload(auth_headers, **{"async": "true"})
+    upload["file"] = (BytesIO(b"\xe5\x95\x86\xe5\x93\x81ID,title\n1,a\n"), "job.csv")
+    with patch("taobaoutils.api.resources.read_listing_chunks") as mock_read:
+        response = client.post(
+            "/api/product-listings/upload", data=upload, content_type="multipart/form-data", headers=auth_headers
+        )
+    assert response.status_code == 400
+    assert "Missing required headers" in response.json["message"]
+    mock_read.assert_not_called()  # 请求中不打开逐块解析的读取器
+
+    with app.app_context():
+        assert ImportJob.query.count() == 0
+
+
+def test_upload_xls_async_validated_by_worker(client, auth_headers):
+    upload = make_upload(auth_headers, **{"async": "true"})
+    upload["file"] = (BytesIO(b"\xd0\xcf\x11\xe0" + b"\x00" * 64), "job.xls")
+    response = client.post(
+        "/api/product-listings/upload", data=upload, content_type="multipart/form-data", headers=auth_headers
+    )
+    assert response.status_code == 202
+
+    job = wait_for_job(client, auth_headers, response.json["job_id"])
+    assert job["status"] == "failed"
+    assert job["error"]
+
+
+def test_upload_excel_async_queue_full(client, auth_headers):
+    with patch("taobaoutils.api.resources.import_executor.submit", side_effect=QueueFullError):
+        response = client.post(
+            "/api/product-listings/upload",
+            data=make_upload(auth_headers, **{"async": "true"}),
+            content_type="multipart/form-data",
+            headers=auth_headers,
+        )
+    assert response.status_code == 503
+
+    job = client.get(f"/api/import-jobs/{response.json['job_id']}", headers=auth_headers).json
+    assert job["status"] == "failed"
+
+
+def test_import_job_not_found(client, auth_headers):
+    response = client.get("/api/import-jobs/9999", headers=auth_headers)
+    assert response.status_code == 404
+
+
+@patch("taobaoutils.api.resources.CHUNK_SIZE", 2)
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_excel_resumes_from_checkpoint(mock_send_batch, client, auth_headers, app):
+    mock_send_batch.return_value = True
+    upload = make_upload(auth_headers, rows=5)
+    content = upload["file"][0].getvalue()
+
+    # The second chunk fails while parsing: the first chunk stays committed
+    from taobaoutils import ingest
+
+    original = ingest.frame_to_records
+    calls = []
+
+    def flaky_frame_to_records(df):
+        calls.append(len(df))
+        if len(calls) == 2:
+            raise RuntimeError("disk on fire")
+        return original(df)
+
+    with patch("taobaoutils.ingest.frame_to_records", side_effect=flaky_frame_to_records):
+        response = client.post(
+            "/api/product-listings/upload",
+            data={**upload, "file": (BytesIO(content), "job.xlsx")},
+            content_type="multipart/form-data",
+            headers=auth_headers,
+        )
+    assert response.status_code == 500
+    job_id = response.json["job_id"]
+    assert response.json["checkpoint_row"] == 2
+
+    job = client.get(f"/api/import-jobs/{job_id}", headers=auth_headers).json
+    assert job["status"] == "failed"
+    assert job["rows_inserted"] == 2
+
+    # Re-uploading the same file resumes the failed job after the checkpoint
+    response = client.post(
+        "/api/product-listings/upload",
+        data={**upload, "file": (BytesIO(content), "job.xlsx")},
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 201
+    assert response.json["job_id"] == job_id
+    assert response.json["resumed_from_row"] == 2
+
+    job = client.get(f"/api/import-jobs/{job_id}", headers=auth_headers).json
+    assert job["status"] == "completed"
+    assert job["rows_inserted"] == 5
+    assert job["checkpoint_row"] == 5
+    assert job["rows_dispatched"] == 5
+
+    with app.app_context():
+        product_ids = sorted(pl.product_id for pl in ProductListing.query.all())
+        assert product_ids == ["500", "501", "502", "503", "504"]
+        assert ProductListing.query.filter_by(import_job_id=job_id, status="是否完成").count() == 5
+
+
+@patch("taobaoutils.api.resources.CHUNK_SIZE", 2)
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_excel_resumes_after_worker_died(mock_send_batch, client, auth_headers, app):
+    mock_send_batch.return_value = True
+    upload = make_upload(auth_headers, rows=5)
+    content = upload["file"][0].getvalue()
+
+    def post():
+        return client.post(
+            "/api/product-listings/upload",
+            data={**upload, "file": (BytesIO(content), "job.xlsx")},
+            content_type="multipart/form-data",
+            headers=auth_headers,
+        )
+
+    # 进程在第二块解析时被杀死：没有机会把任务标记为失败，任务停留在 running
+    from taobaoutils import ingest
+
+    original = ingest.frame_to_records
+    calls = []
+
+    def dying_frame_to_records(df):
+        calls.append(len(df))
+        if len(calls) == 2:
+            raise SystemExit("killed")
+        return original(df)
+
+    with patch("taobaoutils.ingest.frame_to_records", side_effect=dying_frame_to_records):
+        with pytest.raises(SystemExit):
+            post()
+
+    with app.app_context():
+        job = ImportJob.query.one()
+        assert job.status == "running"
+        assert job.checkpoint_row == 2
+        job_id, old_lease = job.id, job.lease_id
+
+    # 心跳还新鲜时认为任务仍在执行，不重复导入
+    response = post()
+    assert response.status_code == 409
+    assert response.json["job"]["id"] == job_id
+
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        job.heartbeat_at = job.started_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+
+    response = post()
+    assert response.status_code == 201
+    assert response.json["job_id"] == job_id
+    assert response.json["resumed_from_row"] == 2
+
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        assert job.status == "completed"
+        assert job.rows_inserted == 5
+        assert sorted(pl.product_id for pl in ProductListing.query.all()) == ["500", "501", "502", "503", "504"]
+
+        # 旧执行者（若其实还活着）的下一次提交会失败
+        with pytest.raises(ImportJobLeaseLostError):
+            job.renew_lease(old_lease)
+
+
+def test_upload_truncated_xlsx_fails_job_and_can_be_reuploaded(client, auth_headers, app):
+    upload = make_upload(auth_headers)
+    content = upload["file"][0].getvalue()[:200]
+
+    def post():
+        return client.post(
+            "/api/product-listings/upload",
+            data={**upload, "file": (BytesIO(content), "job.xlsx")},
+            content_type="multipart/form-data",
+            headers=auth_headers,
+        )
+
+    response = post()
+    assert response.status_code == 400
+    assert "Error processing Excel file" in response.json["message"]
+
+    # 同一文件之前导入失败过：重新上传会接管该任务，打开文件失败后任务重新标记为失败，而不是停留在接管后的状态
+    with app.app_context():
+        job = ImportJob(
+            user_id=User.query.filter_by(username="excel_user").one().id,
+            request_config_id=int(auth_headers["X-Request-Config-ID"]),
+            api_token_id=int(auth_headers["X-API-Token-ID"]),
+            filename="job.xlsx",
+            file_hash=hashlib.sha256(content).hexdigest(),
+            status="failed",
+        )
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    for _ in range(2):
+        response = post()
+        assert response.status_code == 400
+        with app.app_context():
+            job = db.session.get(ImportJob, job_id)
+            assert job.status == "failed"
+            assert job.error
+
+
+def test_fail_job_fenced_by_lease(app, auth_headers):
+    with app.app_context():
+        job = ImportJob(
+            user_id=User.query.filter_by(username="excel_user").one().id,
+            request_config_id=int(auth_headers["X-Request-Config-ID"]),
+            filename="job.xlsx",
+            status="running",
+        )
+        job.heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.add(job)
+        db.session.commit()
+        old_lease = job.lease_id
+        new_lease = job.take_over(datetime.utcnow())
+
+        # 旧执行者迟到的失败不会覆盖接管者的任务
+        _fail_job(job, RuntimeError("late failure"), old_lease)
+        assert (job.status, job.error, job.lease_id) == ("queued", None, new_lease)
+
+        _fail_job(job, RuntimeError("boom"), new_lease)
+        assert (job.status, job.error) == ("failed", "boom")
+
+
+def test_upload_jsonl_with_non_object_line(client, auth_headers, app):
+    lines = ['{"商品ID": 1, "商品链接": "l", "标题": "t", "库存": 1, "上架编码": "c"}', "[1, 2]"]
+    data = {
+        "file": (BytesIO("\n".join(lines).encode()), "items.jsonl"),
+        "request_config_id": auth_headers["X-Request-Config-ID"],
+        "api_token_id": auth_headers["X-API-Token-ID"],
+    }
+    response = client.post(
+        "/api/product-listings/upload", data=data, content_type="multipart/form-data", headers=auth_headers
+    )
+
+    assert response.status_code == 400
+    assert response.json["message"] == "JSON Lines line 2 is not a JSON object."
+    with app.app_context():
+        assert db.session.get(ImportJob, response.json["job_id"]).status == "failed"
+
+
+def make_csv_upload(auth_headers, rows, **extra):
+    lines = ["商品ID,商品链接,标题,库存,上架编码"] + [f"{pid},{link},T,1,C" for pid, link in rows]
+    return {
+        "file": (BytesIO("\n".join(lines).encode()), "dedupe.csv"),
+        "request_config_id": auth_headers["X-Request-Config-ID"],
+        "api_token_id": auth_headers["X-API-Token-ID"],
+        **extra,
+    }
+
+
+@patch("taobaoutils.api.resources.CHUNK_SIZE", 2)
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_dedupe_by_product_id(mock_send_batch, client, auth_headers, app):
+    mock_send_batch.return_value = True
+    first = [("1", "http://a"), ("2", "http://b")]
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_csv_upload(auth_headers, first, dedupe="product_id"),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 201
+    assert response.json["skipped"] == 0
+
+    # Overlapping sheet: "2" exists already, "3" repeats inside the file, a row without ID is kept
+    second = [("2", "http://b"), ("3", "http://c"), ("3", "http://c2"), ("", "http://d")]
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_csv_upload(auth_headers, second, dedupe="product_id"),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 201
+    assert response.json["skipped"] == 2
+
+    job = client.get(f"/api/import-jobs/{response.json['job_id']}", headers=auth_headers).json
+    assert job["rows_parsed"] == 4
+    assert job["rows_inserted"] == 2
+    assert job["rows_skipped"] == 2
+    assert job["checkpoint_row"] == 4
+
+    with app.app_context():
+        assert sorted(pl.product_link for pl in ProductListing.query.all()) == [
+            "http://a",
+            "http://b",
+            "http://c",
+            "http://d",
+        ]
+    # Only new rows are sent to the scheduler
+    assert sum(len(call.args[0]) for call in mock_send_batch.call_args_list) == 4
+
+
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_upload_dedupe_by_product_link(mock_send_batch, client, auth_headers, app):
+    mock_send_batch.return_value = True
+    for rows in ([("1", "http://a")], [("2", "http://a"), ("3", "http://b")]):
+        response = client.post(
+            "/api/product-listings/upload",
+            data=make_csv_upload(auth_headers, rows, dedupe="product_link"),
+            content_type="multipart/form-data",
+            headers=auth_headers,
+        )
+        assert response.status_code == 201
+    assert response.json["skipped"] == 1
+
+    # Without dedupe the same rows are inserted again
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_csv_upload(auth_headers, [("1", "http://a")]),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.json["skipped"] == 0
+    with app.app_context():
+        assert ProductListing.query.count() == 3
+
+
+def test_upload_dedupe_invalid_choice(client, auth_headers):
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_csv_upload(auth_headers, [("1", "http://a")], dedupe="title"),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 400
+
+
+@patch("taobaoutils.api.resources.CHUNK_SIZE", 2)
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_retry_import_job_sends_only_failed_chunks(mock_post_batch, client, auth_headers, app):
+    mock_post_batch.side_effect = [True, False, True]
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_upload(auth_headers, rows=5),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    assert response.status_code == 201
+    job_id = response.json["job_id"]
+    job = client.get(f"/api/import-jobs/{job_id}", headers=auth_headers).json
+    assert (job["rows_dispatched"], job["rows_failed"]) == (3, 2)
+
+    mock_post_batch.reset_mock(side_effect=True)
+    mock_post_batch.return_value = True
+    response = client.post(f"/api/import-jobs/{job_id}/retry", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json["job"]["rows_dispatched"] == 5
+    assert response.json["job"]["rows_failed"] == 0
+    assert [len(call.args[0]) for call in mock_post_batch.call_args_list] == [2]
+
+    with app.app_context():
+        assert ProductListing.query.filter_by(status="Uploaded").count() == 0
+
+
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_dispatch_keeps_status_set_by_early_callback(mock_post_batch, client, auth_headers, app):
+    def post_batch(tasks_data, shared=None):
+        # scheduler 的回调在批量请求返回之前就已经更新了第一个listing
+        first_id = int(json.loads(tasks_data[0])["callback_id"])
+        ProductListing.query.filter_by(id=first_id).update({"status": "success"})
+        return True
+
+    mock_post_batch.side_effect = post_batch
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_upload(auth_headers, rows=2),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 201
+    assert [listing.status for listing in ProductListing.query.order_by(ProductListing.id)] == ["success", "是否完成"]
+
+
+@contextmanager
+def recorded_statements(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+@patch("taobaoutils.api.resources.CHUNK_SIZE", 10)
+@patch("taobaoutils.scheduler._post_batch_tasks")
+def test_dispatch_query_count(mock_post_batch, client, auth_headers, app):
+    """Dispatching a job costs a fixed number of statements per page, independent of the page size."""
+    mock_post_batch.return_value = False
+    response = client.post(
+        "/api/product-listings/upload",
+        data=make_upload(auth_headers, rows=30),
+        content_type="multipart/form-data",
+        headers=auth_headers,
+    )
+    job_id = response.json["job_id"]
+    mock_post_batch.return_value = True
+
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        with recorded_statements(db.engine) as statements:
+            assert _dispatch_job_listings(job) == 30
+
+    # Config and token are loaded with each page, never one by one per listing
+    assert not [s for s in statements if s.startswith(("SELECT request_configs", "SELECT api_tokens"))]
+    listing_selects = [s for s in statements if s.startswith("SELECT product_listings")]
+    assert len(listing_selects) == 4  # 3 pages + the empty page that ends the scan
+    assert "JOIN request_configs" in listing_selects[0]
+    # Per page: listings SELECT, status UPDATE, job UPDATE and the job refresh after commit
+    assert len(statements) <= 3 * 4 + 2
@@ -0,0 +1,90 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from taobaoutils.fake_scheduler import FakeScheduler, expand_tasks
+
+
+class CallbackHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.callbacks.append((self.path, self.headers["Authorization"], body))
+        # 批量回调接口返回每项的结果
+        data = b""
+        if isinstance(body, list):
+            data = json.dumps({"results": [{"id": item["id"], "result": "updated"} for item in body]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def callback_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CallbackHandler)
+    server.callbacks = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fake_scheduler_accepts_tasks_and_calls_back(callback_server):
+    callback_url = f"http://127.0.0.1:{callback_server.server_port}/api/scheduler/callback"
+    payload = {
+        "shared": {"0": {"callback_url": callback_url, "callback_token": "tok", "method": "POST"}},
+        "tasks_data": [{"name": "a", "callback_id": "1", "shared": 0}, {"name": "b", "callback_id": "2", "shared": 0}],
+    }
+
+    with FakeScheduler(callbacks=True) as fake:
+        response = requests.post(
+            f"{fake.url}/add_req_tasks",
+            data=gzip.compress(json.dumps(payload).encode()),
+            headers={"Content-Encoding": "gzip"},
+        )
+        assert response.json() == {"message": "ok", "count": 2}
+        assert requests.post(f"{fake.url}/add_req_task", json={"payload": {}}).status_code == 200
+        assert requests.post(f"{fake.url}/unknown", json={}).status_code == 404
+        assert fake.wait_for_callbacks(2, timeout=5)
+
+    assert fake.stats["requests"] == 2
+    assert fake.stats["tasks"] == 3
+    assert fake.stats["callbacks_sent"] == 2
+    assert sorted(body["id"] for _, _, body in callback_server.callbacks) == [1, 2]
+    assert {auth for _, auth, _ in callback_server.callbacks} == {"Bearer tok"}
+    assert {body["status"] for _, _, body in callback_server.callbacks} == {"success"}
+
+
+def test_fake_scheduler_bulk_callbacks(callback_server):
+    callback_url = f"http://127.0.0.1:{callback_server.server_port}/api/scheduler/callback"
+    tasks = [{"callback_url": callback_url, "callback_token": "tok", "callback_id": str(i)} for i in range(5)]
+
+    with FakeScheduler(callbacks=True, callback_batch=2) as fake:
+        requests.post(f"{fake.url}/add_req_tasks", json={"tasks_data": tasks})
+        assert fake.wait_for_callbacks(5, timeout=5)
+
+    assert fake.stats["callbacks_sent"] == 5
+    assert {path for path, _, _ in callback_server.callbacks} == {"/api/scheduler/callbacks"}
+    assert sorted(len(body) for _, _, body in callback_server.callbacks) == [1, 2, 2]
+
+
+def test_fake_scheduler_injects_errors():
+    with FakeScheduler(error_rate=1.0) as fake:
+        response = requests.post(f"{fake.url}/add_req_tasks", json={"tasks_data": [{"name": "a"}]})
+
+    assert response.status_code == 503
+    assert fake.stats["errors"] == 1
+    assert fake.stats["tasks"] == 0
+
+
+def test_expand_tasks():
+    payload = {"shared": {"3": {"method": "PUT", "cron": None}}, "tasks_data": [{"name": "a", "shared": 3}, {"b": 1}]}
+
+    assert expand_tasks(payload) == [{"method": "PUT", "cron": None, "name": "a"}, {"b": 1}]
@@ -0,0 +1,272 @@
+from io import BytesIO
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from taobaoutils.ingest import (
+    MissingHeadersError,
+    UnsupportedFormatError,
+    check_headers,
+    detect_format,
+    frame_to_records,
+    iter_chunks,
+    normalize_frame,
+    read_listing_chunks,
+    read_xls,
+    read_xlsx,
+)
+
+HEADER = "商品ID,商品链接,标题,库存,上架编码"
+
+
+def make_xlsx(rows, header=("商品ID", "商品链接", "标题", "库存", "上架编码")):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(list(header))
+    for row in rows:
+        sheet.append(list(row))
+    stream = BytesIO()
+    workbook.save(stream)
+    stream.seek(0)
+    return stream
+
+
+def test_read_xlsx_streams_normalized_records():
+    stream = make_xlsx(
+        [
+            (111, "http://l1", "T1", 10.0, "C1"),
+            (None, None, None, None, None),
+            ("222", "http://l2", "T2", None, 7),
+        ]
+    )
+    chunks = list(read_xlsx(stream, chunk_size=10))
+
+    assert chunks == [
+        [
+            {"product_id": "111", "product_link": "http://l1", "title": "T1", "stock": 10, "listing_code": "C1"},
+            {"product_id": "222", "product_link": "http://l2", "title": "T2", "stock": None, "listing_code": "7"},
+        ]
+    ]
+
+
+def test_read_xlsx_chunks():
+    stream = make_xlsx([(i, f"http://l{i}", f"T{i}", i, f"C{i}") for i in range(5)])
+    chunks = list(read_xlsx(stream, chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[2][0]["product_id"] == "4"
+
+
+def test_read_xlsx_skip_rows():
+    stream = make_xlsx([(i, f"http://l{i}", f"T{i}", i, f"C{i}") for i in range(5)])
+    chunks = list(read_xlsx(stream, chunk_size=2, skip_rows=3))
+
+    assert [[record["product_id"] for record in chunk] for chunk in chunks] == [["3", "4"]]
+
+
+def test_read_xlsx_header_order_and_extra_columns():
+    stream = make_xlsx(
+        [("x", "C1", 5, "T1", "http://l1", "111")],
+        header=("备注", "上架编码", "库存", "标题", "商品链接", "商品ID"),
+    )
+    assert list(read_xlsx(stream)) == [
+        [{"product_id": "111", "product_link": "http://l1", "title": "T1", "stock": 5, "listing_code": "C1"}]
+    ]
+
+
+def test_read_xlsx_missing_headers_fails_before_rows():
+    stream = make_xlsx([(1,)], header=("WrongHeader",))
+    with pytest.raises(MissingHeadersError) as exc_info:
+        read_xlsx(stream)
+    assert "商品ID" in exc_info.value.missing
+
+
+def test_read_listing_chunks_pandas_fallback():
+    df = pd.DataFrame({"商品ID": [111, 222], "商品链接": ["http://l1", None], "标题": ["T1", "T2"], "库存": [3, None]})
+    df["上架编码"] = None
+    stream = BytesIO()
+    df.to_excel(stream, index=False)
+    stream.seek(0)
+
+    # Same workbook read through the pandas path used for legacy .xls uploads
+    assert list(read_xls(stream, chunk_size=1)) == [
+        [{"product_id": "111", "product_link": "http://l1", "title": "T1", "stock": 3, "listing_code": None}],
+        [{"product_id": "222", "product_link": None, "title": "T2", "stock": None, "listing_code": None}],
+    ]
+    stream.seek(0)
+    assert len(list(read_listing_chunks(stream, "file.xlsx"))) == 1
+
+
+def test_normalize_frame_types():
+    df = pd.DataFrame(
+        {
+            "product_id": [111.0, None],
+            "product_link": ["http://l1", None],
+            "title": ["T1", "T2"],
+            "stock": ["12", ""],
+            "listing_code": [1, 2],
+        }
+    )
+    records = frame_to_records(normalize_frame(df))
+
+    assert records == [
+        {"product_id": "111", "product_link": "http://l1", "title": "T1", "stock": 12, "listing_code": "1"},
+        {"product_id": None, "product_link": None, "title": "T2", "stock": None, "listing_code": "2"},
+    ]
+    assert type(records[0]["stock"]) is int
+
+
+def test_read_csv_non_numeric_stock_is_null():
+    content = f"{HEADER}\n111,http://l1,T1,N/A,C1\n222,http://l2,T2,10件,C2\n333,http://l3,T3,7.9,C3\n"
+    chunks = list(read_listing_chunks(BytesIO(content.encode("utf-8")), "items.csv"))
+
+    assert [record["stock"] for record in chunks[0]] == [None, None, 7]
+
+
+def test_iter_chunks():
+    assert list(iter_chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_chunks([], 2)) == []
+
+
+@pytest.mark.parametrize(
+    ("content", "filename", "expected"),
+    [
+        (HEADER.encode(), "a.csv", "csv"),
+        (HEADER.replace(",", "\t").encode(), "a.csv", "tsv"),
+        (HEADER.replace(",", "\t").encode(), "a.tsv", "tsv"),
+        ('{"商品ID": "1"}'.encode(), "a.jsonl", "jsonl"),
+        (b"PAR1\x15\x04", "a.parquet", "parquet"),
+        (b"\xd0\xcf\x11\xe0\xa1\xb1", "a.xls", "xls"),
+    ],
+)
+def test_detect_format(content, filename, expected):
+    stream = BytesIO(content)
+    assert detect_format(stream, filename) == expected
+    assert stream.tell() == 0
+
+
+def test_detect_format_prefers_content_over_extension():
+    # An xlsx workbook saved with an .xls name is still read as xlsx
+    assert detect_format(make_xlsx([]), "legacy.xls") == "xlsx"
+
+
+def test_detect_format_unsupported_extension():
+    with pytest.raises(UnsupportedFormatError):
+        detect_format(BytesIO(b"dummy"), "notes.txt")
+
+
+def test_read_csv_keeps_text_and_skips_empty_rows():
+    content = f'{HEADER}\n00123,http://l1,"T, 1",10,C1\n,,,,\n\n222,,T2,,7\n'
+    chunks = list(read_listing_chunks(BytesIO(content.encode("utf-8-sig")), "items.csv", chunk_size=10))
+
+    assert chunks == [
+        [
+            {"product_id": "00123", "product_link": "http://l1", "title": "T, 1", "stock": 10, "listing_code": "C1"},
+            {"product_id": "222", "product_link": None, "title": "T2", "stock": None, "listing_code": "7"},
+        ]
+    ]
+
+
+def test_read_tsv_gb18030_with_skip_rows():
+    rows = "".join(f"{i}\thttp://l{i}\t标题{i}\t{i}\tC{i}\n" for i in range(5))
+    content = (HEADER.replace(",", "\t") + "\n" + rows).encode("gb18030")
+    chunks = list(read_listing_chunks(BytesIO(content), "items.tsv", chunk_size=2, skip_rows=1))
+
+    assert [[record["title"] for record in chunk] for chunk in chunks] == [["标题1", "标题2"], ["标题3", "标题4"]]
+
+
+def test_read_csv_missing_headers():
+    with pytest.raises(MissingHeadersError):
+        read_listing_chunks(BytesIO(b"id,link\n1,2\n"), "items.csv")
+
+
+def test_read_jsonl():
+    lines = [
+        '{"商品ID": 111, "商品链接": "http://l1", "标题": "T\\"1", "库存": 3, "上架编码": "C1"}',
+        "",
+        '{"商品ID": "222", "商品链接": null, "标题": "T2", "上架编码": "C2"}',
+    ]
+    chunks = list(read_listing_chunks(BytesIO("\n".join(lines).encode()), "items.jsonl"))
+
+    assert chunks == [
+        [
+            {"product_id": "111", "product_link": "http://l1", "title": 'T"1', "stock": 3, "listing_code": "C1"},
+            {"product_id": "222", "product_link": None, "title": "T2", "stock": None, "listing_code": "C2"},
+        ]
+    ]
+
+
+def test_read_jsonl_missing_headers():
+    with pytest.raises(MissingHeadersError):
+        read_listing_chunks(BytesIO(b'{"id": 1}\n'), "items.jsonl")
+
+
+@pytest.mark.parametrize("line", ["[1, 2]", '"x"', "3", "{not json"])
+def test_read_jsonl_rejects_non_object_lines(line):
+    first = '{"商品ID": 1, "商品链接": "l", "标题": "t", "库存": 1, "上架编码": "c"}'
+    chunks = read_listing_chunks(BytesIO(f"{first}\n\n{line}\n".encode()), "items.jsonl")
+
+    with pytest.raises(UnsupportedFormatError, match="line 3"):
+        list(chunks)
+
+
+def test_read_parquet():
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame(
+        {
+            "商品ID": ["1", "2", "3"],
+            "商品链接": ["http://l1", "http://l2", None],
+            "标题": ["T1", "T2", "T3"],
+            "库存": [1, None, 3],
+            "上架编码": ["C1", "C2", "C3"],
+            "备注": ["x", "y", "z"],
+        }
+    )
+    stream = BytesIO()
+    df.to_parquet(stream, index=False)
+    stream.seek(0)
+
+    chunks = list(read_listing_chunks(stream, "items.parquet", chunk_size=2, skip_rows=1))
+    assert [[record["product_id"] for record in chunk] for chunk in chunks] == [["2"], ["3"]]
+    assert chunks[0][0]["stock"] is None
+
+
+@pytest.mark.parametrize(
+    "content, filename",
+    [
+        (f"{HEADER}\n111,http://l1,T1,1,C1\n".encode(), "items.csv"),
+        (f"{HEADER.replace(',', chr(9))}\n".encode(), "items.tsv"),
+        ('{"商品ID": "1", "商品链接": "l", "标题": "t", "库存": 1, "上架编码": "c"}\n'.encode(), "items.jsonl"),
+    ],
+)
+def test_check_headers_restores_stream(content, filename):
+    stream = BytesIO(content)
+    check_headers(stream, filename)
+    assert stream.tell() == 0
+
+
+def test_check_headers_reads_only_xlsx_header_row():
+    stream = make_xlsx([("111", "http://l1", "T1", 1, "C1")])
+    with patch("taobaoutils.ingest.load_workbook", wraps=load_workbook) as mock_load:
+        assert check_headers(stream, "items.xlsx") == "xlsx"
+    assert stream.tell() == 0
+    assert mock_load.call_count == 1
+
+    with pytest.raises(MissingHeadersError):
+        check_headers(make_xlsx([], header=("商品ID", "标题")), "items.xlsx")
+
+
+def test_check_headers_skips_xls():
+    # .xls 只能整份解析，表头留给后台导入时校验
+    stream = BytesIO(b"\xd0\xcf\x11\xe0" + b"\x00" * 64)
+    with patch("taobaoutils.ingest.pd.read_excel") as mock_read_excel:
+        assert check_headers(stream, "items.xls") == "xls"
+    mock_read_excel.assert_not_called()
+
+
+def test_read_parquet_without_pyarrow_names_extra():
+    with patch.dict("sys.modules", {"pyarrow": None, "pyarrow.parquet": None}):
+        with pytest.raises(UnsupportedFormatError, match=r"taobaoutils\[parquet\]"):
+            read_listing_chunks(BytesIO(b"PAR1\x15\x04"), "items.parquet")
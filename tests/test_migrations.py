@@ -0,0 +1,157 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text, tuple_
+from sqlalchemy.orm import Session
+
+from taobaoutils.api.resources import _decode_cursor, _encode_cursor
+from taobaoutils.app import db
+from taobaoutils.migrations import upgrade_schema
+from taobaoutils.models import APIToken, ProductListing
+from taobaoutils.storage import encode_text
+
+
+def test_upgrade_legacy_api_tokens(app):
+    """A database created before token_hash existed gets the column, a backfill and the index."""
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE api_tokens (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, name VARCHAR(255) NOT NULL,"
+                " token VARCHAR(255) NOT NULL UNIQUE, scopes TEXT, created_at DATETIME, expires_at DATETIME,"
+                " last_used_at DATETIME, is_active BOOLEAN, prefix VARCHAR(10) NOT NULL, suffix VARCHAR(6) NOT NULL)"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO api_tokens (id, user_id, name, token, is_active, prefix, suffix)"
+                " VALUES (1, 1, 'legacy', 'legacy-token', 1, 'legacy-tok', 'ytoken')"
+            )
+        )
+
+    with engine.begin() as conn:
+        db.metadata.create_all(conn)
+
+    with engine.begin() as conn:
+        token_hash = conn.execute(text("SELECT token_hash FROM api_tokens WHERE id = 1")).scalar_one()
+        assert token_hash == APIToken.hash_token("legacy-token")
+
+        indexes = {index["name"]: index for index in inspect(conn).get_indexes("api_tokens")}
+        assert indexes["ix_api_tokens_token_hash"]["unique"]
+
+        # Running the upgrade again is a no-op
+        upgrade_schema(db.metadata, conn)
+
+
+def test_upgrade_adds_scalar_defaults(app):
+    """Columns added to existing tables take their scalar default, so older rows are not NULL."""
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE import_jobs (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,"
+                " request_config_id INTEGER NOT NULL, api_token_id INTEGER, filename VARCHAR(255) NOT NULL,"
+                " status VARCHAR(20) NOT NULL, rows_parsed INTEGER NOT NULL, rows_inserted INTEGER NOT NULL,"
+                " rows_dispatched INTEGER NOT NULL, rows_failed INTEGER NOT NULL, error TEXT,"
+                " created_at DATETIME, started_at DATETIME, finished_at DATETIME)"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO import_jobs (id, user_id, request_config_id, filename, status, rows_parsed,"
+                " rows_inserted, rows_dispatched, rows_failed) VALUES (1, 1, 1, 'old.xlsx', 'failed', 0, 0, 0, 0)"
+            )
+        )
+
+    with engine.begin() as conn:
+        db.metadata.create_all(conn)
+
+    with engine.begin() as conn:
+        row = conn.execute(text("SELECT checkpoint_row, file_hash FROM import_jobs WHERE id = 1")).one()
+        assert row == (0, None)
+
+
+@pytest.mark.parametrize("legacy_column", ["response_content TEXT", "response_body BLOB"])
+def test_upgrade_moves_legacy_response_content(app, legacy_column):
+    """Legacy inline responses (plain TEXT, or the compressed response_body column) move to the responses table."""
+    engine = create_engine("sqlite://")
+    body = '{\n  "code": 800,\n  "msg": "success"\n}' * 20
+    stored = encode_text(body) if legacy_column.startswith("response_body") else body
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE product_listings (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,"
+                f" request_config_id INTEGER NOT NULL, status VARCHAR(50), {legacy_column})"
+            )
+        )
+        name = legacy_column.split()[0]
+        conn.execute(
+            text(
+                f"INSERT INTO product_listings (id, user_id, request_config_id, status, {name})"
+                " VALUES (1, 1, 1, 'success', :body), (2, 1, 1, 'failed', 'short'), (3, 1, 1, 'pending', NULL),"
+                " (4, 1, 1, 'success', :body)"
+            ),
+            {"body": stored},
+        )
+
+    with engine.begin() as conn:
+        db.metadata.create_all(conn)
+
+    with engine.begin() as conn:
+        columns = {column["name"] for column in inspect(conn).get_columns("product_listings")}
+        assert not {"response_content", "response_body"} & columns
+        listings = conn.execute(text("SELECT id, response_id FROM product_listings ORDER BY id")).all()
+        responses = dict(conn.execute(text("SELECT id, size FROM responses")).all())
+        # 相同的内容只保存一次
+        assert len(responses) == 2
+        assert listings[0][1] == listings[3][1]
+        assert listings[2][1] is None
+        assert responses[listings[0][1]] == len(body)
+
+        upgrade_schema(db.metadata, conn)
+
+    with Session(engine) as session:
+        assert [listing.response_content for listing in session.query(ProductListing).order_by(ProductListing.id)] == [
+            body,
+            "short",
+            None,
+            body,
+        ]
+
+
+def test_upgrade_backfills_null_send_time(app):
+    """Legacy listings without send_time get a sentinel, so keyset pagination can encode and pass them."""
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE product_listings (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,"
+                " request_config_id INTEGER NOT NULL, status VARCHAR(50), send_time DATETIME)"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO product_listings (id, user_id, request_config_id, status, send_time)"
+                " VALUES (1, 1, 1, 'success', NULL), (2, 1, 1, 'success', '2024-01-01 00:00:00.000000'),"
+                " (3, 1, 1, 'success', NULL)"
+            )
+        )
+
+    with engine.begin() as conn:
+        db.metadata.create_all(conn)
+
+    with Session(engine) as session:
+        seen = []
+        cursor = None
+        while True:
+            query = session.query(ProductListing).filter(ProductListing.user_id == 1)
+            if cursor:
+                query = query.filter(tuple_(ProductListing.send_time, ProductListing.id) < _decode_cursor(cursor))
+            page = query.order_by(ProductListing.send_time.desc(), ProductListing.id.desc()).limit(1).all()
+            if not page:
+                break
+            seen.append(page[0].id)
+            cursor = _encode_cursor(page[0])
+
+    # 回填的行排在最后，翻页时不会丢失
+    assert seen == [2, 3, 1]
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT count(*) FROM product_listings WHERE send_time IS NULL")).scalar_one() == 0
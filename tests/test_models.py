@@ -68,8 +68,8 @@ def test_request_config_model(session):
 
     # Test generate_body
     class MockProduct:
-        def to_dict(self):
-            return {"product_link": "http://test.com", "title": "Title"}
+        product_link = "http://test.com"
+        title = "Title"
 
     generated = rc.generate_body(MockProduct())
     assert generated == {"u": "http://test.com"}
@@ -97,3 +97,22 @@ def test_api_token_model(session):
     # Test expiration
     token.expires_at = datetime.now(UTC) - timedelta(days=1)
     assert not token.verify_token(token_str)
+
+
+def test_api_token_find_by_token(session):
+    u = User(username="user", email="u@e.com", password="pwd")
+    session.add(u)
+    session.commit()
+
+    token_str, token = APIToken.create_token(u.id, "Lookup Token")
+    session.add(token)
+    session.commit()
+
+    assert token.token_hash == APIToken.hash_token(token_str)
+    assert APIToken.find_by_token(token_str) == token
+    assert APIToken.find_by_token("wrong") is None
+
+    # Inactive tokens are found by digest but rejected by verification
+    token.is_active = False
+    session.commit()
+    assert APIToken.find_by_token(token_str) is None
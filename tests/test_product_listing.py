@@ -1,6 +1,8 @@
+from datetime import datetime, timedelta
 from unittest.mock import patch
 
 import pytest
+from sqlalchemy import event, text
 
 from taobaoutils.app import db, guard
 from taobaoutils.models import APIToken, ProductListing, RequestConfig, User
@@ -98,3 +100,161 @@ def test_get_listings(client, auth_headers, app):
     response = client.get(f"/api/product-listings/{pl1_id}", headers=auth_headers)
     assert response.status_code == 200
     assert response.json["product_link"] == "l1"
+
+
+def test_get_listings_fields_projection(client, auth_headers, app):
+    rc_id = int(auth_headers["X-Request-Config-ID"])
+    with app.app_context():
+        listings = [
+            ProductListing(user_id=1, request_config_id=rc_id, product_link=f"l{i}", response_content="ok")
+            for i in range(3)
+        ]
+        db.session.add_all(listings)
+        db.session.commit()
+        listing_id = listings[0].id
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "product_listings" in statement:
+            statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            response = client.get("/api/product-listings?fields=id,status", headers=auth_headers)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+    assert response.status_code == 200
+    assert [sorted(item) for item in response.json] == [["id", "status"]] * 3
+    # 只查询选中的列，不 JOIN responses 表
+    assert len(statements) == 1
+    assert "product_link" not in statements[0]
+    assert "responses" not in statements[0]
+
+    response = client.get(f"/api/product-listings/{listing_id}?fields=response_content,send_time", headers=auth_headers)
+    assert list(response.json) == ["response_content", "send_time"]
+    assert response.json["response_content"] == "ok"
+
+    # 默认返回全部字段，响应内容在同一个查询中加载
+    response = client.get("/api/product-listings", headers=auth_headers)
+    assert list(response.json[0]) == list(ProductListing.DICT_FIELDS)
+    assert {item["response_content"] for item in response.json} == {"ok"}
+
+
+def test_get_listings_unknown_field(client, auth_headers):
+    response = client.get("/api/product-listings?fields=id,password", headers=auth_headers)
+
+    assert response.status_code == 400
+    assert "password" in response.json["message"]
+
+
+@pytest.fixture
+def paged_listings(app, auth_headers):
+    rc_id = int(auth_headers["X-Request-Config-ID"])
+    other = RequestConfig(user_id=1, name="Other Config", body={}, header={})
+    db.session.add(other)
+    db.session.commit()
+    base = datetime(2024, 1, 1)
+    listings = [
+        ProductListing(
+            user_id=1,
+            request_config_id=other.id if i % 3 == 0 else rc_id,
+            status="success" if i % 2 else "failed",
+            response_code=200 if i % 2 else 500,
+            # 每两条的发送时间相同，分页需要按 id 区分
+            send_time=base + timedelta(minutes=i // 2),
+            product_link=f"l{i}",
+        )
+        for i in range(7)
+    ]
+    db.session.add_all(listings)
+    db.session.commit()
+    return {"other_config_id": other.id, "ids": [listing.id for listing in listings]}
+
+
+def fetch_all(client, auth_headers, query):
+    pages = []
+    cursor = None
+    while True:
+        url = f"/api/product-listings?{query}" + (f"&cursor={cursor}" if cursor else "")
+        response = client.get(url, headers=auth_headers)
+        assert response.status_code == 200
+        pages.append([item["id"] for item in response.json])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+def test_get_listings_keyset_pagination(client, auth_headers, paged_listings):
+    ids = paged_listings["ids"]
+
+    pages = fetch_all(client, auth_headers, "limit=3&fields=id")
+
+    # 按 (send_time, id) 倒序，相同发送时间的不会重复或遗漏
+    assert pages == [ids[::-1][0:3], ids[::-1][3:6], ids[::-1][6:]]
+
+
+def test_get_listings_page_size_capped(client, auth_headers, paged_listings):
+    with patch("taobaoutils.api.resources.LISTING_MAX_PAGE_SIZE", 2):
+        response = client.get("/api/product-listings?limit=1000", headers=auth_headers)
+
+    assert len(response.json) == 2
+    assert "X-Next-Cursor" in response.headers
+
+
+def test_get_listings_filters(client, auth_headers, paged_listings):
+    ids = paged_listings["ids"]
+
+    pages = fetch_all(client, auth_headers, "status=success&limit=2")
+    assert sum(pages, []) == [ids[5], ids[3], ids[1]]
+
+    pages = fetch_all(client, auth_headers, f"request_config_id={paged_listings['other_config_id']}")
+    assert pages == [[ids[6], ids[3], ids[0]]]
+
+    pages = fetch_all(client, auth_headers, "response_code=500&since=2024-01-01T00:01:00&until=2024-01-01T00:03:00")
+    assert pages == [[ids[4], ids[2]]]
+
+    # 带时区的时间转成 UTC 比较
+    pages = fetch_all(client, auth_headers, "since=2024-01-01T08:03:00%2B08:00")
+    assert pages == [[ids[6]]]
+
+
+def test_get_listings_invalid_cursor(client, auth_headers):
+    response = client.get("/api/product-listings?cursor=not-a-cursor", headers=auth_headers)
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    ("condition", "index"),
+    [
+        ("", "ix_product_listings_user_send_time"),
+        ("AND status = 'success'", "ix_product_listings_user_status"),
+        ("AND request_config_id = 1", "ix_product_listings_user_send_time"),
+        ("AND response_code = 200", "ix_product_listings_user_send_time"),
+    ],
+)
+def test_listing_pages_use_indexes(app, condition, index):
+    plan = db.session.execute(
+        text(
+            "EXPLAIN QUERY PLAN SELECT id FROM product_listings WHERE user_id = 1 "
+            f"{condition} AND (send_time, id) < ('2024-01-01', 10) ORDER BY send_time DESC, id DESC LIMIT 100"
+        )
+    ).all()
+    details = " ".join(row[-1] for row in plan)
+
+    assert index in details
+    assert "TEMP B-TREE" not in details
+
+
+@pytest.mark.parametrize(
+    "statement",
+    ["SELECT id FROM product_listings WHERE user_id = 1", "DELETE FROM product_listings WHERE user_id = 1"],
+)
+def test_listing_user_lookups_use_index(app, statement):
+    """user_id 外键没有单独的索引，由以 user_id 开头的复合索引覆盖，不需要扫描整张表"""
+    detail = db.session.execute(text(f"EXPLAIN QUERY PLAN {statement}")).all()[0][-1]
+
+    assert detail.startswith("SEARCH product_listings USING") and "(user_id=?)" in detail
@@ -1,3 +1,4 @@
+import json
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -5,10 +6,10 @@ from requests.exceptions import RequestException
 
 from taobaoutils.api.resources import (
     _get_payload_from_listing,
-    _send_batch_tasks_to_scheduler,
     _send_single_task_to_scheduler,
 )
-from taobaoutils.models import ProductListing
+from taobaoutils.models import ProductListing, RequestConfig
+from taobaoutils.scheduler import send_batch_tasks
 
 
 @pytest.fixture
@@ -68,7 +69,7 @@ def test_get_payload_malformed_template(mock_listing):
 # --- Test _send_single_task_to_scheduler ---
 
 
-@patch("taobaoutils.api.resources.requests.post")
+@patch("taobaoutils.scheduler.scheduler_client.post")
 def test_send_single_task_success(mock_post, mock_listing, mock_config):
     mock_post.return_value.raise_for_status = MagicMock()
 
@@ -81,7 +82,7 @@ def test_send_single_task_success(mock_post, mock_listing, mock_config):
         assert kwargs["json"]["target_url"] == "http://target"
 
 
-@patch("taobaoutils.api.resources.requests.post")
+@patch("taobaoutils.scheduler.scheduler_client.post")
 def test_send_single_task_with_request_config(mock_post, mock_listing, mock_config):
     mock_post.return_value.raise_for_status = MagicMock()
 
@@ -106,7 +107,7 @@ def test_send_single_task_with_request_config(mock_post, mock_listing, mock_conf
         assert json_data["random_max"] == 20
 
 
-@patch("taobaoutils.api.resources.requests.post")
+@patch("taobaoutils.scheduler.scheduler_client.post")
 def test_send_single_task_no_config(mock_post, mock_listing, mock_config):
     mock_listing.request_config = None
     with patch("taobaoutils.api.resources.config_data", mock_config):
@@ -115,7 +116,7 @@ def test_send_single_task_no_config(mock_post, mock_listing, mock_config):
         mock_post.assert_not_called()
 
 
-@patch("taobaoutils.api.resources.requests.post")
+@patch("taobaoutils.scheduler.scheduler_client.post")
 def test_send_single_task_failure(mock_post, mock_listing, mock_config):
     mock_post.side_effect = RequestException("Error")
 
@@ -123,59 +124,106 @@ def test_send_single_task_failure(mock_post, mock_listing, mock_config):
         assert _send_single_task_to_scheduler(mock_listing) is False
 
 
-# --- Test _send_batch_tasks_to_scheduler ---
+# --- Test send_batch_tasks ---
 
 
-@patch("taobaoutils.api.resources.requests.post")
+def posted_tasks(call):
+    assert call.kwargs["headers"]["Content-Type"] == "application/json"
+    return json.loads(call.kwargs["data"])["tasks_data"]
+
+
+@patch("taobaoutils.scheduler.scheduler_client.post")
 def test_send_batch_tasks_success(mock_post, mock_listing, mock_config):
     mock_post.return_value.raise_for_status = MagicMock()
-    # Define templates with placeholders
-    mock_listing.request_config.header = '{"Cookie": "user_{id}"}'
-    # Use body instead of payload, with templates
-    mock_listing.request_config.body = '{"title": "{title}", "url": "{product_link}"}'
-    # Set method
-    mock_listing.request_config.method = "PUT"
-    # Mock generate_body to simulate model behavior OR rely on actual model if not mocked?
-    # mock_listing.request_config is a MagicMock. `generate_body` needs to be mocked or implemented.
-    # If it is a MagicMock, I must mock the return value OF generate_body.
-    # Wait, the code now calls `req_config.generate_body`. If `req_config` is a MagicMock, `generate_body` does nothing unless side_effect/return_value set.
-    # I should simulate substitution in the mock return value.
-    mock_listing.request_config.generate_body.return_value = {"title": "TestProduct", "url": "http://example.com"}
-
+    # Header is passed through as-is; body placeholders are rendered from the listing
+    mock_listing.request_config = RequestConfig(
+        user_id=1,
+        name="batch",
+        header='{"Cookie": "user_{id}"}',
+        body='{"title": "{title}", "url": "{product_link}", "stock": {stock}}',
+        method="PUT",
+    )
+    mock_listing.api_token = MagicMock(token="cb-token")
     mock_listing.id = 99
-    mock_listing.title = "TestProduct"
+    mock_listing.title = 'Test "Product"'
     mock_listing.product_link = "http://example.com"
+    mock_listing.stock = None
 
     listings = [mock_listing]
 
     # Add CALLBACK_URL to config
     mock_config["scheduler"]["CALLBACK_URL"] = "http://callback"
 
-    with patch("taobaoutils.api.resources.config_data", mock_config):
-        result = _send_batch_tasks_to_scheduler(listings)
+    with patch("taobaoutils.scheduler.config_data", mock_config):
+        result = send_batch_tasks(listings)
 
-        assert result is True
+        assert result
+        assert result.sent_ids == [99]
         mock_post.assert_called_once()
-        args, kwargs = mock_post.call_args
-        json_data = kwargs["json"]
-        assert "tasks_data" in json_data
-        assert len(json_data["tasks_data"]) == 1
-        item = json_data["tasks_data"][0]
-        assert item["name"] == "TestProduct"
+        assert mock_post.call_args.args[0] == "http://scheduler/add_req_tasks"
+        tasks = posted_tasks(mock_post.call_args)
+        assert len(tasks) == 1
+        item = tasks[0]
+        assert item["name"] == 'Test "Product"'
         assert item["method"] == "PUT"
         # Verify raw templates are passed for header (no substitution)
         assert item["header"] == {"Cookie": "user_{id}"}
-        # Verify SUBSTITUTED values for body (from generate_body)
-        assert item["body"] == {"title": "TestProduct", "url": "http://example.com"}
+        # Verify SUBSTITUTED values for body, quotes escaped
+        assert item["body"] == {"title": 'Test "Product"', "url": "http://example.com", "stock": None}
         assert item["callback_url"] == "http://callback"
         assert item["callback_id"] == "99"
+        assert item["callback_token"] == "cb-token"
+        assert item["request_url"] == "http://scheduler"
+        assert item["cron"] is None
+        assert isinstance(item["start_time"], float)
 
 
-@patch("taobaoutils.api.resources.requests.post")
+@patch("taobaoutils.scheduler.scheduler_client.post")
 def test_send_batch_tasks_failure(mock_post, mock_listing, mock_config):
     mock_post.side_effect = RequestException("Error")
-    mock_listing.request_config.header = "{}"  # valid json
-    mock_listing.request_config.payload = "{}"
-
-    with patch("taobaoutils.api.resources.config_data", mock_config):
-        assert _send_batch_tasks_to_scheduler([mock_listing]) is False
+    mock_listing.request_config = RequestConfig(user_id=1, name="batch", body="{}", header="{}")
+    mock_listing.api_token = None
+
+    with patch("taobaoutils.scheduler.config_data", mock_config):
+        result = send_batch_tasks([mock_listing])
+        assert not result
+        assert result.failed_ids == [1]
+
+
+@patch("taobaoutils.scheduler.DISPATCH_CHUNK_SIZE", 2)
+@patch("taobaoutils.scheduler.scheduler_client.post")
+def test_send_batch_tasks_chunked(mock_post, mock_config):
+    """Chunks are sent separately; only the listings of a failed chunk are reported as failed."""
+
+    def post(url, data, **kwargs):
+        if any(task["callback_id"] == "3" for task in json.loads(data)["tasks_data"]):
+            raise RequestException("chunk failed")
+        return MagicMock()
+
+    mock_post.side_effect = post
+    configs = [
+        RequestConfig(user_id=1, name="a", body='{"n": "{title}"}', header="{}"),
+        RequestConfig(user_id=1, name="b", body="", header="not json"),
+    ]
+    listings = []
+    for listing_id in range(1, 6):
+        listing = MagicMock(spec=ProductListing)
+        listing.id = listing_id
+        listing.title = f"T{listing_id}"
+        listing.request_config = configs[listing_id % 2]
+        listing.api_token = None
+        listings.append(listing)
+    listings[1].request_config = None  # Missing config: never sent
+
+    with patch("taobaoutils.scheduler.config_data", mock_config):
+        result = send_batch_tasks(listings)
+
+    assert mock_post.call_count == 2
+    tasks = [task for call in mock_post.call_args_list for task in posted_tasks(call)]
+    assert sorted(len(posted_tasks(call)) for call in mock_post.call_args_list) == [2, 2]
+    bodies = {task["callback_id"]: (task["header"], task["body"]) for task in tasks}
+    # Empty body renders as {}, an invalid header as null
+    assert bodies == {"1": (None, {}), "3": (None, {}), "5": (None, {}), "4": ({}, {"n": "T4"})}
+    assert not result
+    assert sorted(result.sent_ids) == [4, 5]
+    assert sorted(result.failed_ids) == [1, 2, 3]
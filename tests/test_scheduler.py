@@ -0,0 +1,330 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from taobaoutils.fake_scheduler import expand_tasks
+from taobaoutils.models import ProductListing, RequestConfig
+from taobaoutils.scheduler import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyWindow,
+    SchedulerClient,
+    _post_batch_tasks,
+    send_batch_tasks,
+)
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        encoding = self.headers.get("Content-Encoding")
+        self.server.encodings.append((encoding, len(body)))
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "zstd":
+            import zstandard
+
+            body = zstandard.ZstdDecompressor().decompress(body)
+        self.server.requests.append((self.client_address, json.loads(body)))
+        payload = b'{"ok": true}'
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+    server.requests = []
+    server.status = 200
+    server.encodings = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_reuses_connection(http_server):
+    client = SchedulerClient()
+    url = f"http://127.0.0.1:{http_server.server_port}/add_req_task"
+
+    for i in range(3):
+        response = client.post(url, json={"n": i})
+        assert response.json() == {"ok": True}
+    client.close()
+
+    assert [body for _, body in http_server.requests] == [{"n": 0}, {"n": 1}, {"n": 2}]
+    # Keep-alive: every request arrived over the same client socket
+    assert len({address for address, _ in http_server.requests}) == 1
+
+
+def test_client_from_config():
+    client = SchedulerClient.from_config(
+        {
+            "POOL_MAXSIZE": 8,
+            "CONNECT_TIMEOUT": 1,
+            "READ_TIMEOUT": 7,
+            "CONNECT_RETRIES": 0,
+            "ADAPTIVE_TIMEOUT_MIN_SAMPLES": 50,
+            "LATENCY_WINDOW": 100,
+        }
+    )
+    adapter = client.session.get_adapter("http://scheduler")
+
+    assert adapter._pool_maxsize == 8
+    assert adapter.max_retries.total == 0
+    assert (client.min_samples, client.latency_window) == (50, 100)
+    with patch.object(client.session, "post") as mock_post:
+        mock_post.return_value.status_code = 200
+        client.post("http://scheduler/add_req_tasks", json={})
+        client.post("http://scheduler/add_req_task", read_timeout=2, json={})
+    assert [call.kwargs["timeout"] for call in mock_post.call_args_list] == [(1, 7), (1, 2)]
+
+
+def test_client_session_shared_and_recreated_after_fork():
+    client = SchedulerClient()
+    session = client.session
+    assert client.session is session
+
+    with patch("taobaoutils.scheduler.os.getpid", return_value=-1):
+        assert client.session is not session
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success(0.1)  # 成功后连续失败计数清零
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    # 半开状态只放行一个探测请求
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20
+    breaker.before_call()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.snapshot() == {
+        "state": "closed",
+        "consecutive_failures": 0,
+        "times_opened": 2,
+        "rejected": 2,
+        "retry_in": None,
+    }
+
+
+def test_breaker_counts_slow_calls_as_failures():
+    breaker = CircuitBreaker(failure_threshold=2, slow_call_seconds=1)
+
+    breaker.record_success(0.5)
+    breaker.record_success(1.5)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_success(2)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_latency_window_percentiles():
+    window = LatencyWindow(size=100)
+    assert window.percentile(99) is None
+    for ms in range(1, 201):
+        window.add(ms / 1000)
+
+    assert len(window) == 100
+    assert window.percentile(50) == 0.15
+    assert window.percentile(99) == 0.199
+
+
+def test_client_fails_fast_when_scheduler_errors(http_server):
+    http_server.status = 503
+    client = SchedulerClient(failure_threshold=2, reset_timeout=60)
+    url = f"http://127.0.0.1:{http_server.server_port}/add_req_tasks"
+
+    assert client.post(url, json={"n": 1}).status_code == 503
+    assert client.post(url, json={"n": 2}).status_code == 503
+    with pytest.raises(requests.exceptions.RequestException):
+        client.post(url, json={"n": 3})
+    client.close()
+
+    # 第三个请求没有发到服务器
+    assert len(http_server.requests) == 2
+    status = client.status()
+    assert status["breakers"][f"127.0.0.1:{http_server.server_port}"]["state"] == "open"
+    assert status["latency"][url]["samples"] == 2
+
+
+def test_read_timeout_adapts_to_observed_latency(http_server):
+    client = SchedulerClient(read_timeout=30, min_samples=5, timeout_factor=3, min_read_timeout=0.5)
+    url = f"http://127.0.0.1:{http_server.server_port}/add_req_task"
+
+    assert client.read_timeout_for(url) == 30
+    for i in range(5):
+        client.post(url, json={"n": i})
+    client.close()
+
+    # 本地请求的 p99 很小，超时收紧到下限；不会超过调用方给出的上限
+    assert client.read_timeout_for(url) == 0.5
+    assert client.read_timeout_for(url, limit=0.2) == 0.2
+    assert SchedulerClient(adaptive_timeout=False).read_timeout_for(url) == 30
+
+
+def test_non_adaptive_post_keeps_static_read_timeout():
+    client = SchedulerClient(read_timeout=30, connect_timeout=5, min_samples=1, min_read_timeout=0.5)
+    url = "http://scheduler/add_req_tasks"
+    client._latency_window(url).add(0.01)
+
+    with patch.object(client.session, "post") as mock_post:
+        mock_post.return_value.status_code = 200
+        client.post(url, json={})
+        client.post(url, json={}, adaptive=False)
+    assert [call.kwargs["timeout"] for call in mock_post.call_args_list] == [(5, 0.5), (5, 30)]
+
+
+@patch("taobaoutils.scheduler.scheduler_client")
+def test_batch_post_uses_static_read_timeout(mock_client):
+    with patch("taobaoutils.scheduler.config_data", {"scheduler": {"SCHEDULER_SERVICE_URL": "http://scheduler"}}):
+        assert _post_batch_tasks([b"{}"])
+
+    assert mock_client.post.call_args.kwargs["adaptive"] is False
+
+
+def test_probe_released_when_post_raises_unexpected_error():
+    client = SchedulerClient(failure_threshold=1, reset_timeout=0)
+    url = "http://scheduler/add_req_tasks"
+    breaker = client.breaker(url)
+
+    with patch.object(client.session, "post", side_effect=RuntimeError("boom")):
+        with pytest.raises(RuntimeError):
+            client.post(url, json={})
+        assert breaker.snapshot()["times_opened"] == 1
+        # 半开状态的探测请求抛出非 RequestException 的异常
+        with pytest.raises(RuntimeError):
+            client.post(url, json={})
+    assert breaker.snapshot()["times_opened"] == 2
+
+    # 探测名额已释放，下一个请求仍然可以作为探测发出
+    with patch.object(client.session, "post") as mock_post:
+        mock_post.return_value.status_code = 200
+        client.post(url, json={})
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_read_timeout_sample_recorded_on_timeout():
+    client = SchedulerClient(read_timeout=2, failure_threshold=1)
+    with patch.object(client.session, "post", side_effect=requests.exceptions.ReadTimeout("slow")):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            client.post("http://scheduler/add_req_tasks", json={})
+
+    assert client.status()["latency"]["http://scheduler/add_req_tasks"]["p99"] == 2
+    assert client.breaker("http://scheduler/other").state == CircuitBreaker.OPEN
+
+
+def test_client_compresses_large_bodies(http_server):
+    client = SchedulerClient(content_encoding="gzip", compress_min_bytes=100)
+    url = f"http://127.0.0.1:{http_server.server_port}/add_req_tasks"
+    large = json.dumps({"tasks_data": [{"header": {"Cookie": "x" * 50}}] * 50}).encode()
+
+    client.post(url, data=large, headers={"Content-Type": "application/json"}, compress=True)
+    client.post(url, data=b'{"small": 1}', compress=True)
+    client.post(url, data=large)  # 未要求压缩
+    client.close()
+
+    assert [body for _, body in http_server.requests] == [json.loads(large), {"small": 1}, json.loads(large)]
+    (first_encoding, first_size), *rest = http_server.encodings
+    assert first_encoding == "gzip" and first_size < len(large) / 10
+    assert rest == [(None, 12), (None, len(large))]
+
+
+def test_client_zstd_encoding(http_server):
+    pytest.importorskip("zstandard")
+    client = SchedulerClient(content_encoding="zstd", compress_min_bytes=0)
+
+    client.post(f"http://127.0.0.1:{http_server.server_port}/add_req_tasks", data=b'{"a": 1}', compress=True)
+    client.close()
+
+    assert http_server.encodings[0][0] == "zstd"
+    assert http_server.requests[0][1] == {"a": 1}
+
+
+def test_client_encoding_config():
+    with patch("taobaoutils.scheduler._zstd_compressor", return_value=None):
+        assert SchedulerClient(content_encoding="zstd").content_encoding == "gzip"
+    assert SchedulerClient.from_config({"CONTENT_ENCODING": "gzip"}).content_encoding == "gzip"
+    with pytest.raises(ValueError):
+        SchedulerClient(content_encoding="br")
+
+
+def without_start_time(payload):
+    return [{key: value for key, value in task.items() if key != "start_time"} for task in expand_tasks(payload)]
+
+
+@pytest.mark.parametrize("encoding", ["identity", "gzip"])
+def test_normalized_payload_matches_full_tasks(http_server, encoding):
+    configs = [
+        RequestConfig(user_id=1, name="a", body='{"t": "{title}"}', header='{"Cookie": "a"}', method="PUT"),
+        RequestConfig(user_id=1, name="b", body="", header='{"Cookie": "b"}'),
+    ]
+    listings = []
+    for listing_id in range(1, 8):
+        listing = ProductListing(user_id=1, request_config_id=1, title=f"T{listing_id}")
+        listing.id = listing_id
+        listing.request_config = configs[listing_id % 2]
+        listings.append(listing)
+
+    client = SchedulerClient(content_encoding=encoding, compress_min_bytes=0)
+    scheduler_config = {"SCHEDULER_SERVICE_URL": f"http://127.0.0.1:{http_server.server_port}"}
+    payloads = {}
+    for payload_format in ("tasks", "normalized"):
+        with (
+            patch("taobaoutils.scheduler.scheduler_client", client),
+            patch("taobaoutils.scheduler.config_data", {"scheduler": scheduler_config}),
+            patch("taobaoutils.scheduler.PAYLOAD_FORMAT", payload_format),
+            patch("taobaoutils.scheduler.DISPATCH_CHUNK_SIZE", 5),
+        ):
+            http_server.requests.clear()
+            result = send_batch_tasks(listings)
+        assert sorted(result.sent_ids) == list(range(1, 8))
+        payloads[payload_format] = [body for _, body in http_server.requests]
+    client.close()
+
+    full, normalized = payloads["tasks"], payloads["normalized"]
+    assert "shared" not in full[0]["tasks_data"][0]
+    assert all("header" not in task for payload in normalized for task in payload["tasks_data"])
+    # 每块只带本块引用到的公共字段
+    assert sorted(sorted(payload["shared"]) for payload in normalized) == [["0", "1"], ["1"]]
+    assert sorted(map(without_start_time, normalized), key=len) == sorted(map(without_start_time, full), key=len)
+    expected_encoding = None if encoding == "identity" else encoding
+    assert {encoding for encoding, _ in http_server.encodings} == {expected_encoding}
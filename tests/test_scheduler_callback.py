@@ -1,7 +1,10 @@
+from unittest.mock import patch
+
 import pytest
+from sqlalchemy import event
 
-from taobaoutils.app import db
-from taobaoutils.models import APIToken, ProductListing, RequestConfig, User
+from taobaoutils.app import db, guard
+from taobaoutils.models import APIToken, ProductListing, RequestConfig, ResponseBody, User
 
 
 @pytest.fixture
@@ -83,3 +86,145 @@ def test_callback_partial_update(client, api_auth_headers, app):
         pl = db.session.get(ProductListing, pl_id)
         assert pl.status == "failed"
         assert pl.response_code is None
+
+
+def test_callback_token_cached_and_revoked(client, api_auth_headers, app):
+    """A cached token authenticates without a lookup and stops working once revoked."""
+    with app.app_context():
+        user = User.query.filter_by(username="cb_user").first()
+        rc = RequestConfig(user_id=user.id, name="Callback Config 3", body={}, header={})
+        db.session.add(rc)
+        db.session.commit()
+        pl = ProductListing(user_id=user.id, request_config_id=rc.id, product_id="789")
+        db.session.add(pl)
+        db.session.commit()
+        pl_id = pl.id
+        jwt_headers = {"Authorization": f"Bearer {guard.encode_jwt_token(user)}"}
+
+    data = {"id": pl_id, "status": "completed"}
+    assert client.post("/api/scheduler/callback", json=data, headers=api_auth_headers).status_code == 200
+
+    with patch.object(APIToken, "find_by_token") as mock_find:
+        assert client.post("/api/scheduler/callback", json=data, headers=api_auth_headers).status_code == 200
+        mock_find.assert_not_called()
+
+    token_id = api_auth_headers["X-API-Token-ID"]
+    response = client.put(f"/api/tokens/{token_id}", json={"is_active": False}, headers=jwt_headers)
+    assert response.status_code == 200
+    assert client.post("/api/scheduler/callback", json=data, headers=api_auth_headers).status_code == 401
+
+
+def test_callback_token_deleted(client, api_auth_headers, app):
+    with app.app_context():
+        user = User.query.filter_by(username="cb_user").first()
+        jwt_headers = {"Authorization": f"Bearer {guard.encode_jwt_token(user)}"}
+
+    data = {"id": 99999, "status": "completed"}
+    assert client.post("/api/scheduler/callback", json=data, headers=api_auth_headers).status_code == 404
+
+    token_id = api_auth_headers["X-API-Token-ID"]
+    assert client.delete(f"/api/tokens/{token_id}", headers=jwt_headers).status_code == 200
+    assert client.post("/api/scheduler/callback", json=data, headers=api_auth_headers).status_code == 401
+
+
+def make_listings(app, count, **kwargs):
+    with app.app_context():
+        user = User.query.filter_by(username="cb_user").first()
+        rc = RequestConfig(user_id=user.id, name="Bulk Config", body={}, header={})
+        db.session.add(rc)
+        db.session.commit()
+        listings = [ProductListing(user_id=user.id, request_config_id=rc.id, **kwargs) for _ in range(count)]
+        db.session.add_all(listings)
+        db.session.commit()
+        return [listing.id for listing in listings]
+
+
+def test_bulk_callbacks(client, api_auth_headers, app):
+    ids = make_listings(app, 3, status="是否完成", response_code=100, response_content="old")
+    callbacks = [
+        {"id": ids[0], "status": "success", "response_code": 200, "response_content": "ok"},
+        {"id": ids[1], "status": "failed"},
+        {"id": 99999, "status": "success"},
+        {"id": ids[2]},
+        {"status": "success"},
+        {"id": ids[2], "status": "success", "response_code": "abc"},
+    ]
+
+    response = client.post("/api/scheduler/callbacks", json=callbacks, headers=api_auth_headers)
+
+    assert response.status_code == 200
+    assert response.json["updated"] == 2
+    assert [(result["id"], result["result"]) for result in response.json["results"]] == [
+        (ids[0], "updated"),
+        (ids[1], "updated"),
+        (99999, "not_found"),
+        (ids[2], "invalid"),
+        (None, "invalid"),
+        (ids[2], "invalid"),
+    ]
+    with app.app_context():
+        rows = {
+            listing.id: (listing.status, listing.response_code, listing.response_content)
+            for listing in ProductListing.query.filter(ProductListing.id.in_(ids))
+        }
+    # 未提供的 response_code/response_content 保持原值
+    assert rows == {
+        ids[0]: ("success", 200, "ok"),
+        ids[1]: ("failed", 100, "old"),
+        ids[2]: ("是否完成", 100, "old"),
+    }
+
+
+def test_bulk_callbacks_single_update_statement(client, api_auth_headers, app):
+    ids = make_listings(app, 50)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("UPDATE"):
+            statements.append(executemany)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            response = client.post(
+                "/api/scheduler/callbacks",
+                json={"callbacks": [{"id": listing_id, "status": "success"} for listing_id in ids]},
+                headers=api_auth_headers,
+            )
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+    assert response.status_code == 200
+    assert response.json["updated"] == 50
+    assert statements == [True]
+
+
+def test_bulk_callbacks_store_identical_responses_once(client, api_auth_headers, app):
+    ids = make_listings(app, 20)
+    body = '{"code": 800, "msg": "success"}'
+    callbacks = [{"id": listing_id, "status": "success", "response_content": body} for listing_id in ids]
+
+    response = client.post("/api/scheduler/callbacks", json=callbacks, headers=api_auth_headers)
+
+    assert response.json["updated"] == 20
+    with app.app_context():
+        assert ResponseBody.query.count() == 1
+        assert {listing.response_content for listing in ProductListing.query} == {body}
+
+
+def test_bulk_callbacks_rejects_bad_body(client, api_auth_headers):
+    response = client.post("/api/scheduler/callbacks", json={"id": 1, "status": "success"}, headers=api_auth_headers)
+    assert response.status_code == 400
+
+    with patch("taobaoutils.api.resources.CALLBACK_BATCH_LIMIT", 2):
+        response = client.post(
+            "/api/scheduler/callbacks",
+            json=[{"id": i, "status": "success"} for i in range(3)],
+            headers=api_auth_headers,
+        )
+    assert response.status_code == 413
+
+
+def test_bulk_callbacks_requires_token(client):
+    response = client.post("/api/scheduler/callbacks", json=[])
+    assert response.status_code == 401
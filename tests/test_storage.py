@@ -0,0 +1,98 @@
+from unittest.mock import patch
+
+import pytest
+
+from taobaoutils.app import db
+from taobaoutils.models import ProductListing, RequestConfig, ResponseBody, User
+from taobaoutils.storage import TRUNCATED_MARKER, decode_text, encode_text, truncate_text
+
+RESPONSE = '{\n  "code": 800,\n  "data": {\n    "msg": "商品已上架"\n  }\n}\n' * 10
+
+
+def test_encode_round_trip():
+    data = encode_text(RESPONSE, compression="zlib", min_bytes=64)
+
+    assert data[:1] == b"\x01"
+    assert len(data) < len(RESPONSE.encode()) / 3
+    assert decode_text(data) == RESPONSE
+
+
+def test_short_and_incompressible_text_stored_raw():
+    assert encode_text("ok", compression="zlib", min_bytes=64) == b"\x00ok"
+    assert encode_text(RESPONSE, compression="none") == b"\x00" + RESPONSE.encode()
+    random_text = bytes(range(32, 127)).decode()
+    assert decode_text(encode_text(random_text, min_bytes=0)) == random_text
+    # 旧数据库中的文本值原样返回
+    assert decode_text("legacy") == "legacy"
+
+
+def test_zstd_round_trip():
+    pytest.importorskip("zstandard")
+    data = encode_text(RESPONSE, compression="zstd", min_bytes=0)
+
+    assert data[:1] == b"\x02"
+    assert decode_text(data) == RESPONSE
+
+
+def test_zstd_without_zstandard_names_extra():
+    with patch("taobaoutils.storage._zstd", return_value=None):
+        with pytest.raises(RuntimeError, match=r"taobaoutils\[zstd\]"):
+            decode_text(b"\x02\x28\xb5\x2f\xfd")
+        with pytest.raises(RuntimeError, match="zstandard is not installed"):
+            encode_text(RESPONSE, compression="zstd", min_bytes=0)
+
+
+def test_truncate_text():
+    assert truncate_text("abc", 0) == "abc"
+    assert truncate_text("abc", 3) == "abc"
+    truncated = truncate_text("商品" * 20, 19)
+    assert truncated.endswith(TRUNCATED_MARKER)
+    assert len(truncated.encode()) <= 19
+    # 不会截断在多字节字符中间
+    assert truncated[: -len(TRUNCATED_MARKER)] == "商"
+    assert decode_text(encode_text("x" * 1000, max_bytes=100)) == "x" * (100 - len(TRUNCATED_MARKER)) + TRUNCATED_MARKER
+
+
+def test_listing_responses_are_stored_once_and_compressed(app):
+    user = User(username="storage_user", email="storage@example.com", password="pwd")
+    db.session.add(user)
+    db.session.commit()
+    rc = RequestConfig(user_id=user.id, name="Storage Config", body={}, header={})
+    db.session.add(rc)
+    db.session.commit()
+    listings = [
+        ProductListing(user_id=user.id, request_config_id=rc.id, response_content=content)
+        for content in (RESPONSE, RESPONSE, "ok")
+    ]
+    db.session.add_all(listings)
+    db.session.commit()
+    db.session.expire_all()
+
+    assert [db.session.get(ProductListing, listing.id).to_dict()["response_content"] for listing in listings] == [
+        RESPONSE,
+        RESPONSE,
+        "ok",
+    ]
+    assert ResponseBody.query.count() == 2
+    assert listings[0].response_id == listings[1].response_id
+    stored = db.session.execute(
+        db.text("SELECT content FROM responses WHERE id = :id"), {"id": listings[0].response_id}
+    )
+    stored = stored.scalar_one()
+    assert stored[:1] == b"\x01"
+    assert len(stored) < len(RESPONSE.encode()) / 3
+
+    listings[2].response_content = None
+    db.session.commit()
+    assert db.session.get(ProductListing, listings[2].id).response_content is None
+
+
+def test_intern_truncates_before_hashing(app):
+    with patch("taobaoutils.storage.RESPONSE_MAX_BYTES", 50):
+        ids = ResponseBody.intern(["x" * 100, "x" * 200])
+    db.session.commit()
+
+    assert len(set(ids.values())) == 1
+    response = ResponseBody.query.one()
+    assert response.content == "x" * (50 - len(TRUNCATED_MARKER)) + TRUNCATED_MARKER
+    assert response.size == 50
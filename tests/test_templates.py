@@ -0,0 +1,135 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from taobaoutils.app import db
+from taobaoutils.models import ProductListing, RequestConfig, User
+from taobaoutils.templates import CompiledTemplate, TemplateCache, template_cache
+
+
+def test_render_placeholders_in_strings():
+    template = CompiledTemplate('{"title": "{title}", "url": "{product_link}?id={product_id}", "fixed": [1, "x"]}')
+
+    assert template.fields == {"title", "product_link", "product_id"}
+    body = template.render({"title": "T", "product_link": "http://a", "product_id": 7})
+    assert body == {"title": "T", "url": "http://a?id=7", "fixed": [1, "x"]}
+
+
+def test_render_escapes_values():
+    template = CompiledTemplate('{"title": "{title}"}')
+    title = 'Say "hi" \\ {stock}'
+
+    body = template.render({"title": title})
+    assert body == {"title": title}
+    assert json.loads(json.dumps(body)) == {"title": title}
+
+
+def test_render_raw_placeholders():
+    template = CompiledTemplate('{"stock": {stock}, "items": [{id}, "{stock}"], "note": "{unknown}"}')
+
+    assert template.fields == {"stock", "id"}
+    assert template.render({"stock": 3, "id": 9}) == {"stock": 3, "items": [9, "3"], "note": "{unknown}"}
+    assert template.render({"stock": None, "id": 9}) == {"stock": None, "items": [9, ""], "note": "{unknown}"}
+
+
+def test_render_formats_like_to_dict():
+    template = CompiledTemplate('{"at": "{send_time}", "stock": "{stock}"}')
+    sent = datetime(2024, 1, 2, 3, 4, 5)
+
+    assert template.render({"send_time": sent, "stock": None}) == {"at": sent.isoformat(), "stock": ""}
+
+
+def test_every_to_dict_field_is_a_placeholder():
+    source = json.dumps({field: "{" + field + "}" for field in ProductListing.DICT_FIELDS})
+
+    assert CompiledTemplate(source).fields == set(ProductListing.DICT_FIELDS)
+
+
+def test_render_returns_fresh_objects():
+    template = CompiledTemplate('{"list": [1, 2], "title": "{title}"}')
+    first = template.render_object(SimpleNamespace(title="a"))
+    first["list"].append(3)
+
+    assert template.render_object(SimpleNamespace(title="b")) == {"list": [1, 2], "title": "b"}
+
+
+def test_template_cache_keyed_by_version_and_source():
+    cache = TemplateCache(maxsize=2)
+    template = cache.get(1, "v1", '{"a": "{title}"}')
+
+    assert cache.get(1, "v1", '{"a": "{title}"}') is template
+    assert cache.get(1, "v2", '{"a": "{title}"}') is not template
+    # Same version but edited in memory: recompiled
+    assert cache.get(1, "v1", '{"b": "{title}"}').render({"title": "x"}) == {"b": "x"}
+    cache.get(2, "v1", "{}")
+    cache.get(3, "v1", "{}")
+    assert len(cache) == 2
+
+
+def test_generate_body_uses_compiled_template(session):
+    user = User(username="tpl", email="tpl@example.com", password="pwd")
+    session.add(user)
+    session.commit()
+    rc = RequestConfig(user_id=user.id, name="tpl", body={"title": "{title}"}, header={})
+    session.add(rc)
+    session.commit()
+    template_cache.clear()
+
+    listing = SimpleNamespace(title='A "quoted" title')
+    assert rc.generate_body(listing) == {"title": 'A "quoted" title'}
+    assert rc.compiled_body() is rc.compiled_body()
+
+    # Updating the config bumps updated_at and the new template is used
+    rc.body = json.dumps({"name": "{title}"})
+    db.session.commit()
+    assert rc.generate_body(listing) == {"name": 'A "quoted" title'}
+
+
+def test_invalid_template_raises():
+    with pytest.raises(json.JSONDecodeError):
+        CompiledTemplate('{"title": "{title}"')
+
+
+def test_render_batch_matches_render():
+    template = CompiledTemplate(
+        '{"title": "{title}", "url": "{product_link}?id={id}", "stock": {stock}, "id": {id}, "at": "{send_time}"}'
+    )
+    sent = datetime(2024, 1, 2, 3, 4, 5)
+    rows = [
+        {"title": 'Say "hi" \\ 中文\n', "product_link": "http://a", "id": 1, "stock": 3, "send_time": sent},
+        {"title": None, "product_link": "http://b", "id": 2, "stock": None, "send_time": None},
+    ]
+    columns = {field: [row[field] for row in rows] for field in template.fields}
+
+    bodies = template.render_batch(columns)
+    assert [json.loads(body) for body in bodies] == [template.render(row) for row in rows]
+    assert all(isinstance(body, bytes) for body in bodies)
+
+
+def test_render_batch_from_dataframe():
+    template = CompiledTemplate('{"product": {product_id}, "name": "{title}"}')
+    frame = pd.DataFrame({"product_id": ["007", None], "title": ["a", "b"]}, index=[5, 9])
+
+    assert [json.loads(body) for body in template.render_batch(frame)] == [
+        {"product": "007", "name": "a"},
+        {"product": None, "name": "b"},
+    ]
+
+
+def test_render_batch_without_placeholders():
+    template = CompiledTemplate('{"fixed": [1, "x"]}')
+
+    assert template.render_batch({}, length=2) == [b'{"fixed":[1,"x"]}'] * 2
+
+
+def test_render_batch_without_placeholders_one_body_per_row():
+    template = CompiledTemplate('{"fixed": true}')
+
+    assert template.render_batch({"title": ["a", "b", "c"]}) == [b'{"fixed":true}'] * 3
+    assert template.render_batch(pd.DataFrame({"title": ["a", "b"]})) == [b'{"fixed":true}'] * 2
+    assert template.render_batch(pd.DataFrame(index=range(2))) == [b'{"fixed":true}'] * 2
+    with pytest.raises(ValueError):
+        template.render_batch({})
@@ -19,7 +19,7 @@ def test_send_request_success(mock_config_data):
     mock_response.status_code = 200
     mock_response.json.return_value = {"code": 800, "msg": "success"}
 
-    with patch("taobaoutils.utils.requests.post", return_value=mock_response) as mock_post:
+    with patch("taobaoutils.scheduler.scheduler_client.post", return_value=mock_response) as mock_post:
         success, content = send_request("http://test.com", {"data": 1})
 
         assert success is True
@@ -29,7 +29,7 @@ def test_send_request_success(mock_config_data):
 
 def test_send_request_http_error(mock_config_data):
     """Test request with HTTP error response."""
-    with patch("taobaoutils.utils.requests.post") as mock_post:
+    with patch("taobaoutils.scheduler.scheduler_client.post") as mock_post:
         mock_post.side_effect = requests.exceptions.HTTPError("404 Client Error")
 
         success, content = send_request("http://test.com", {})
@@ -40,7 +40,7 @@ def test_send_request_http_error(mock_config_data):
 
 def test_send_request_connection_error(mock_config_data):
     """Test request with connection error."""
-    with patch("taobaoutils.utils.requests.post") as mock_post:
+    with patch("taobaoutils.scheduler.scheduler_client.post") as mock_post:
         mock_post.side_effect = requests.exceptions.ConnectionError("Connection refused")
 
         success, content = send_request("http://test.com", {})
@@ -56,7 +56,7 @@ def test_send_request_invalid_json(mock_config_data):
     mock_response.json.side_effect = json.JSONDecodeError("Expecting value", "doc", 0)
     mock_response.text = "Invalid JSON"
 
-    with patch("taobaoutils.utils.requests.post", return_value=mock_response):
+    with patch("taobaoutils.scheduler.scheduler_client.post", return_value=mock_response):
         success, content = send_request("http://test.com", {})
 
         assert success is True  # Function still returns True for success status code, just logs warning
@@ -69,7 +69,7 @@ def test_send_request_with_cookies_arg(mock_config_data):
     mock_response.status_code = 200
     mock_response.json.return_value = {}
 
-    with patch("taobaoutils.utils.requests.post", return_value=mock_response) as mock_post:
+    with patch("taobaoutils.scheduler.scheduler_client.post", return_value=mock_response) as mock_post:
         send_request("http://test.com", {}, cookies="a=1; b=2")
 
         call_args = mock_post.call_args
@@ -85,7 +85,7 @@ def test_send_request_with_config_cookies(mock_config_data):
     mock_response.status_code = 200
     mock_response.json.return_value = {}
 
-    with patch("taobaoutils.utils.requests.post", return_value=mock_response) as mock_post:
+    with patch("taobaoutils.scheduler.scheduler_client.post", return_value=mock_response) as mock_post:
         send_request("http://test.com", {})
 
         call_args = mock_post.call_args
@@ -101,7 +101,7 @@ def test_send_request_partial_config_cookies(mock_config_data):
     mock_response.status_code = 200
     mock_response.json.return_value = {}
 
-    with patch("taobaoutils.utils.requests.post", return_value=mock_response) as mock_post:
+    with patch("taobaoutils.scheduler.scheduler_client.post", return_value=mock_response) as mock_post:
         send_request("http://test.com", {})
 
         call_args = mock_post.call_args
@@ -117,7 +117,7 @@ def test_send_request_custom_headers(mock_config_data):
     mock_response.status_code = 200
     mock_response.json.return_value = {}
 
-    with patch("taobaoutils.utils.requests.post", return_value=mock_response) as mock_post:
+    with patch("taobaoutils.scheduler.scheduler_client.post", return_value=mock_response) as mock_post:
         send_request("http://test.com", {})
 
         call_args = mock_post.call_args
@@ -0,0 +1,23 @@
+import threading
+
+import pytest
+
+from taobaoutils.workers import BoundedExecutor, QueueFullError
+
+
+def test_bounded_executor_rejects_when_full():
+    executor = BoundedExecutor(max_workers=1, max_pending=1)
+    release = threading.Event()
+
+    running = executor.submit(release.wait)
+    pending = executor.submit(lambda: "done")
+    with pytest.raises(QueueFullError):
+        executor.submit(lambda: None)
+
+    release.set()
+    running.result(timeout=1)
+    assert pending.result(timeout=1) == "done"
+
+    # Slots are released once tasks finish
+    assert executor.submit(lambda: 42).result(timeout=1) == 42
+    executor.shutdown()